@@ -0,0 +1 @@
+""" Benchmarks of the House Rocket data layer. Run from src/: python -m benchmarks.<name> """
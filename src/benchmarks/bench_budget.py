@@ -0,0 +1,66 @@
+""" Benchmark: payload of charts over budget, before and after house_rocket.budget.
+
+Builds the chart types of the dashboard from the rows of a csv, with many more points
+than the dashboard sends today, and fits each one in the chart budget:
+- line: average price per sale day and zipcode, one point per (day, zipcode), LTTB;
+- map: scatter_mapbox of the houses (like Location of Recommended Properties), decimated;
+- scatter: price x sqft_living of the houses, WebGL and decimated;
+- bars: price histogram with one bar per $1,000, adjacent bars merged.
+
+For each chart: points, bytes before and after, time to fit. Checks that every reduced
+figure fits and that the bars still count every house.
+
+    python -m benchmarks.bench_budget --data kc_house_data.csv --budget-kb 256
+"""
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.budget import fit_figure, points
+from house_rocket.ingest import read_csv
+
+
+def charts( df ):
+    """ Plotly figures with one point per row (or per $1,000 bin) """
+    import plotly.express as px
+    daily = df.groupby(['date', 'zipcode'], as_index=False)['price'].mean().sort_values('date')
+    edges = np.arange(df['price'].min() // 1000 * 1000, df['price'].max() + 1000, 1000)
+    counts, _ = np.histogram(df['price'], bins=edges)
+    bars = px.bar(x=( edges[:-1] + edges[1:] ) / 2, y=counts, labels={'x': 'price', 'y': 'count'})
+    bars.update_traces(width=np.diff(edges))
+    return {'line': px.line(daily, x='date', y='price'),
+            'map': px.scatter_mapbox(df, lat='lat', lon='long', size='price', size_max=15, zoom=10),
+            'scatter': px.scatter(df, x='sqft_living', y='price'),
+            'bars': bars}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--budget-kb', type=int, default=256)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    df = read_csv( args.data )
+    allowance = args.budget_kb * 1024
+    print('{:>8}  {:>9}  {:>12}  {:>9}  {:>12}  {:>8}'.format('chart', 'points', 'bytes', 'kept', 'sent', 'fit ms'))
+    for name, fig in charts( df ).items():
+        before = len(fig.to_json())
+        start = time.perf_counter()
+        text = fit_figure( fig, allowance, name )
+        elapsed = time.perf_counter() - start
+        reduced = json.loads(text)
+        assert len(text) <= allowance or before <= allowance, name
+        if name == 'bars':
+            assert sum(reduced['data'][0]['y']) == len(df), 'bars lost houses'
+        print('{:>8}  {:>9,}  {:>12,}  {:>9,}  {:>12,}  {:>8.1f}  {}'.format(
+            name, points( fig.to_plotly_json()['data'][0] ), before, points( reduced['data'][0] ), len(text),
+            elapsed * 1e3, reduced['data'][0]['type']))
+
+
+if __name__ == '__main__':
+    main()
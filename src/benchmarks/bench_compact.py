@@ -0,0 +1,67 @@
+""" Benchmark: bytes per row of the house dataset, before and after the compact encodings.
+
+Compares the memory of the same csv held as:
+- pandas:  pd.read_csv() + set_feature(), default dtypes ('id' int64, 'date' Python strings);
+- typed:   ingest.read_csv() + set_feature(), SCHEMA dtypes and datetime 'date';
+- compact: HouseDataset( *load_compact( path ) ), codes of house_rocket.compact, derived
+           columns computed when read.
+
+and checks that every column read from the compact dataset (derived ones included) has
+exactly the values of the pandas frame: no displayed number changes.
+
+    python -m benchmarks.bench_compact --data kc_house_data.csv
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.dataset import HouseDataset, set_feature
+from house_rocket.ingest import build_cache, load_compact, read_csv, DATE_FORMAT
+
+
+def frame_bytes( df ):
+    """ Bytes of a dataframe, Python objects included """
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    args = parser.parse_args()
+
+    pandas_frame = set_feature( pd.read_csv(args.data) )
+    typed = set_feature( read_csv( args.data ) )
+    build_cache( args.data )
+    start = time.perf_counter()
+    data = HouseDataset( *load_compact( args.data ) )
+    attach = time.perf_counter() - start
+
+    rows = len(data)
+    before = frame_bytes( pandas_frame )
+    sizes = [('pandas', before), ('typed', frame_bytes( typed )), ('compact', data.nbytes)]
+    print('{:>10}  {:>12}  {:>10}  {:>8}'.format('layout', 'bytes', 'bytes/row', 'ratio'))
+    for name, size in sizes:
+        print('{:>10}  {:>12,}  {:>10.1f}  {:>7.1f}x'.format(name, size, size / rows, before / size))
+    print('attach {:.4f} s, {} rows'.format(attach, rows))
+
+    print('\n{:>14}  {:>10}  {:>8}  {:>10}'.format('column', 'encoding', 'codes', 'bytes/row'))
+    for name in data.columns:
+        params = data.encoding( name )
+        codes = data.codes( name )
+        print('{:>14}  {:>10}  {:>8}  {:>10}'.format(
+            name, params['kind'] if params else ('derived' if codes is None else 'raw'),
+            '-' if codes is None else str(codes.dtype), '-' if codes is None else codes.itemsize))
+
+    # same values as the pandas frame, column by column
+    for name in pandas_frame.columns:
+        expected = pandas_frame[name].to_numpy()
+        if name == 'date':
+            expected = pd.to_datetime(expected, format=DATE_FORMAT).to_numpy()
+        assert np.array_equal(data[name], expected), name
+    print('\nevery value equal to pd.read_csv + set_feature')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+""" Benchmark: KD-tree comparables x brute-force pairwise distances.
+
+Checks that house_rocket.comparables finds the same k nearest neighbours and radius
+neighbours as computing the distance of every pair of properties (in blocks of rows),
+and times both at several sizes (synthetic rows are the dataset rows jittered by ~100 m).
+
+    python -m benchmarks.bench_comparables --rows 21613 100000 1000000 --k 10 --radius 500
+
+Above --brute-max-rows the pairwise time is extrapolated from the largest size measured
+(it grows with rows^2), marked '~'. The radius query returns every pair within --radius:
+keep rows * (neighbours per property) within memory.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from house_rocket.comparables import ComparablesIndex, comparables, group_median
+from house_rocket.ingest import load_dataset
+
+BLOCK_ROWS = 1024
+
+
+def brute_force( points, price, k, radius_m ):
+    """ k-th neighbour distance, k-nearest median price, radius count and radius median price
+    of every point, from all the pairwise distances """
+    n = len(points)
+    kth, knn_median = np.empty(n), np.empty(n)
+    owners, neighbours = [], []
+    for start in range(0, n, BLOCK_ROWS):
+        rows = np.arange(start, min(start + BLOCK_ROWS, n))
+        dist = np.sqrt(( ( points[rows, None, :] - points[None, :, :] ) ** 2 ).sum(axis=2))
+        dist[np.arange(len(rows)), rows] = np.inf  # leave the property itself out
+        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        kth[rows] = np.take_along_axis(dist, nearest, axis=1).max(axis=1)
+        knn_median[rows] = np.median(price[nearest], axis=1)
+        owner, neighbour = np.nonzero(dist <= radius_m)
+        owners.append(rows[owner])
+        neighbours.append(neighbour)
+    owner, neighbour = np.concatenate(owners), np.concatenate(neighbours)
+    return kth, knn_median, np.bincount(owner, minlength=n), group_median( owner, price[neighbour], n )
+
+
+def synthetic( data, rows, seed=0 ):
+    """ rows properties resampled from the dataset, coordinates jittered by ~100 m """
+    rng = np.random.default_rng(seed)
+    pick = rng.integers(0, len(data), rows)
+    lat = data['lat'].to_numpy()[pick] + rng.normal(0, 0.001, rows)
+    long = data['long'].to_numpy()[pick] + rng.normal(0, 0.0013, rows)
+    return lat, long, data['price'].to_numpy(dtype='float64')[pick], data['price_m2'].to_numpy()[pick]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--rows', type=int, nargs='+', default=[21613, 100_000])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=500, help='metres')
+    parser.add_argument('--brute-max-rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    data = load_dataset( args.data, columns=['lat', 'long', 'price', 'price_m2'] )
+    ComparablesIndex( data['lat'][:10], data['long'][:10] )  # scipy import, out of the timings
+    print('{:>10}  {:>9}  {:>10}  {:>12}  {:>12}  {:>9}'.format('rows', 'build s', 'knn s', 'radius s', 'pairwise s', 'speedup'))
+    brute_rate = None
+    for rows in args.rows:
+        lat, long, price, price_m2 = synthetic( data, rows )
+
+        start = time.perf_counter()
+        index = ComparablesIndex( lat, long )
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        knn = comparables( index, price, price_m2, k=args.k )
+        knn_time = time.perf_counter() - start
+        start = time.perf_counter()
+        near = comparables( index, price, price_m2, radius_m=args.radius )
+        radius_time = time.perf_counter() - start
+
+        if rows <= args.brute_max_rows:
+            start = time.perf_counter()
+            kth, knn_median, count, radius_median = brute_force( index.points, price, args.k, args.radius )
+            brute = time.perf_counter() - start
+            brute_rate = brute / rows ** 2
+
+            # same neighbours: same k-th distance everywhere, same median where the k-th
+            # neighbour isn't tied with the next one (ties may be broken either way)
+            assert np.allclose(knn['distance_m'], kth, rtol=1e-9)
+            dist, _ = index.knn( args.k + 1 )
+            untied = dist[:, -1] > dist[:, -2]
+            assert np.allclose(knn['comparables_price'][untied], knn_median[untied])
+            assert ( near['comparables'].to_numpy() == count ).all()
+            assert np.allclose(near['comparables_price'], radius_median, equal_nan=True)
+            brute_text = '{:.2f}'.format(brute)
+        else:
+            brute = brute_rate * rows ** 2
+            brute_text = '~{:.0f}'.format(brute)
+
+        print('{:>10,}  {:>9.3f}  {:>10.3f}  {:>12.3f}  {:>12}  {:>8.0f}x'.format(
+            rows, build, knn_time, radius_time, brute_text, brute / ( build + knn_time + radius_time )))
+    print('same k-nearest and radius comparables as the pairwise distances')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+""" Benchmark and self-check of the delta ingestion: incremental aggregates vs full recompute.
+
+Adds the sales of the csv before its last days to a temporary store, then appends the
+sales of each remaining day as a delta (house_rocket.delta), with a few sales already
+stored mixed in. After each delta:
+- the aggregates are folded (fold_aggregates: only the groups and zipcodes that received
+  sales) and built again from every row (build_aggregates), both timed;
+- every cube must be equal to the full recompute, value for value, and the descriptive
+  statistics must be equal for every zipcode;
+- the repeated sales must have been dropped.
+
+A delta with an invalid value must be rejected, leaving the store unchanged.
+
+    python -m benchmarks.bench_delta --data kc_house_data.csv --days 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.delta import append_rows, build_aggregates, fold_aggregates
+from house_rocket.partitions import Catalog, PartitionedDataset, add_dataset, load_partition
+
+
+def store_data( store ):
+    """ Every partition of the benchmark dataset, in catalog order """
+    catalog = Catalog( store )
+    entries = catalog.entries( 'bench' )
+    return PartitionedDataset( [load_partition( catalog.path( e ) ) for e in entries], entries )
+
+
+def check_equal( folded, full ):
+    """ Asserts that folded and recomputed aggregates are equal """
+    (cubes, stats), (expected_cubes, expected_stats) = folded, full
+    for name, cube in expected_cubes.items():
+        pd.testing.assert_frame_equal(cubes[name], cube, check_exact=True)
+    assert np.array_equal(stats.partitions, expected_stats.partitions)
+    for zipcode in [None] + [[z] for z in expected_stats.partitions]:
+        pd.testing.assert_frame_equal(stats.describe( zipcode ), expected_stats.describe( zipcode ), check_exact=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--days', type=int, default=10, help='last sale days appended as deltas')
+    parser.add_argument('--repeated', type=int, default=5, help='stored sales mixed in each delta')
+    args = parser.parse_args()
+
+    raw = pd.read_csv(args.data, dtype=str)
+    days = raw['date'].str[:8]
+    last = sorted(days.unique())[-args.days:]
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as store:
+        base = os.path.join(store, 'base.csv')
+        raw.loc[~days.isin(last)].to_csv(base, index=False)
+        add_dataset( base, 'bench', store_dir=store )
+        data = store_data( store )
+        aggregates = build_aggregates( data )
+        print('base: {:,} rows, {} partitions'.format(len(data), len(data.parts)))
+
+        # rejected delta: nothing is written
+        bad = raw.loc[days == last[0]].head(3).assign(price='n/a')
+        try:
+            append_rows( bad, 'bench', store_dir=store )
+        except ValueError as e:
+            assert len(store_data( store )) == len(data)
+            print('invalid delta rejected: {}'.format(str(e).splitlines()[1]))
+        else:
+            raise AssertionError('invalid delta accepted')
+
+        print('\n{:>10}  {:>6}  {:>9}  {:>8}  {:>8}  {:>10}  {:>8}'.format(
+            'day', 'sales', 'dropped', 'zipcodes', 'fold ms', 'full ms', 'speedup'))
+        for day in last:
+            sales = raw.loc[days == day]
+            stored = raw.loc[~days.isin(last)].sample(args.repeated, random_state=rng.integers(1 << 31))
+            entries, dropped = append_rows( pd.concat([sales, stored, sales.head(1)]), 'bench', store_dir=store )
+            assert dropped == args.repeated + 1, dropped
+
+            start = len(data)
+            data = store_data( store )
+            assert len(data) == start + len(sales)
+
+            t = time.perf_counter()
+            aggregates = fold_aggregates( *aggregates, data, start )
+            fold = time.perf_counter() - t
+            t = time.perf_counter()
+            full = build_aggregates( data )
+            rebuild = time.perf_counter() - t
+            check_equal( aggregates, full )
+            print('{:>10}  {:>6}  {:>9}  {:>8}  {:>8.1f}  {:>10.1f}  {:>7.1f}x'.format(
+                day, len(sales), dropped, sales['zipcode'].nunique(), fold * 1e3, rebuild * 1e3, rebuild / fold))
+
+        assert len(data) == len(raw)
+    print('\nfolded aggregates equal to the full recompute after every delta')
+
+
+if __name__ == '__main__':
+    main()
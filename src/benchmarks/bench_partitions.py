@@ -0,0 +1,101 @@
+""" Benchmark: zipcode / date filters on the partitioned store, pruned vs full scan.
+
+Adds the csv to a temporary store (one region, one partition per sale month) and, for a
+few filters, compares the store path with the same mask computed on every row: dates go
+through PartitionedDataset.where() (scans only the sale months the catalog can't rule
+out), zipcodes through the bitmaps of FilterIndex (every month holds most zipcodes, the
+catalog can't prune them). Also compares the time to open the partitions of the filter
+(load_partition) with the time to open every partition: the store reads only the files
+the catalog keeps. Checks that both give the same rows.
+
+    python -m benchmarks.bench_partitions --data kc_house_data.csv
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.filters import FilterIndex
+from house_rocket.partitions import Catalog, PartitionedDataset, add_dataset, load_partition
+
+
+def best( fn, repeat ):
+    """ Best time of fn() over repeat runs, and its result """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def full_scan( data, zipcodes=None, start=None, end=None ):
+    """ Row positions matching the filters, testing every row """
+    mask = np.ones(len(data), dtype=bool)
+    if zipcodes:
+        mask &= data.isin( 'zipcode', zipcodes )
+    if start is not None:
+        mask &= data['date'] >= np.datetime64(pd.Timestamp(start).normalize())
+    if end is not None:
+        mask &= data['date'] <= np.datetime64(pd.Timestamp(end))
+    return np.flatnonzero(mask)
+
+
+def store_rows( data, index, zipcodes=None, start=None, end=None ):
+    """ Row positions matching the filters: sale months pruned by where(), zipcodes from the bitmaps """
+    rows = data.where( start=start, end=end ) if start is not None or end is not None else None
+    if zipcodes:
+        selected = index.rows( index.member( 'zipcode', zipcodes ) )
+        rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+    return np.arange(len(data)) if rows is None else rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as store:
+        start = time.perf_counter()
+        add_dataset( args.data, 'bench', store_dir=store )
+        catalog = Catalog( store )
+        entries = catalog.entries( 'bench' )
+        data = PartitionedDataset( [load_partition( catalog.path( e ) ) for e in entries], entries )
+        # no result cache: every run computes the bitmaps again
+        index = FilterIndex( data, member_columns=['zipcode'], cache_size=0 )
+        print('store: {} partitions, {:,} rows, built in {:.2f} s'.format(
+            len(entries), len(data), time.perf_counter() - start))
+
+        dates = pd.to_datetime(data['date'])
+        last = dates.max()
+        zipcodes = pd.Series(data['zipcode']).value_counts().index[:2].tolist()
+        filters = [('every row', {}),
+                   ('last 3 months', {'start': last - pd.DateOffset(months=3)}),
+                   ('last month', {'start': last - pd.DateOffset(months=1)}),
+                   ('2 zipcodes', {'zipcodes': zipcodes}),
+                   ('2 zipcodes, 3 months', {'zipcodes': zipcodes, 'start': last - pd.DateOffset(months=3)})]
+
+        load_all, _ = best( lambda: PartitionedDataset( [load_partition( catalog.path( e ) ) for e in entries],
+                                                        entries ), args.repeat )
+
+        print('\n{:>22}  {:>8}  {:>9}  {:>10}  {:>10}  {:>8}  {:>9}  {:>9}'.format(
+            'filter', 'rows', 'scanned', 'full ms', 'store ms', 'speedup', 'open ms', 'all ms'))
+        for name, kwargs in filters:
+            full, expected = best( lambda: full_scan( data, **kwargs ), args.repeat )
+            data.scanned = 0
+            pruned, rows = best( lambda: store_rows( data, index, **kwargs ), args.repeat )
+            assert np.array_equal(rows, expected), name
+            kept = catalog.partitions( 'bench', **kwargs )
+            load, _ = best( lambda: PartitionedDataset( [load_partition( catalog.path( e ) ) for e in kept], kept ),
+                            args.repeat )
+            print('{:>22}  {:>8,}  {:>4}/{:<4}  {:>10.3f}  {:>10.3f}  {:>7.1f}x  {:>9.2f}  {:>9.2f}'.format(
+                name, len(rows), data.scanned // args.repeat, len(entries), full * 1e3, pruned * 1e3, full / pruned,
+                load * 1e3, load_all * 1e3))
+    print('\nsame rows as the full scan for every filter')
+
+
+if __name__ == '__main__':
+    main()
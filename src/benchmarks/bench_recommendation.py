@@ -0,0 +1,126 @@
+""" Benchmark: vectorized recommendation rules x original per-row .loc loops.
+
+Checks that house_rocket.recommendation builds the same buy/sell reports as the loops
+previously used by buy_repport / sell_repport, and times both at several sizes.
+
+    python -m benchmarks.bench_recommendation --rows 20000 1000000 10000000
+
+The loop version costs about 0.3 ms per row (minutes from 1M rows on), so above --legacy-max-rows its time is
+extrapolated from the per-row cost of the largest size actually measured (marked '~').
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.recommendation import zipcode_median_price, buy_report, sell_report, WINTER_MEDIAN_PRICE
+
+COLUMNS = ['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long']
+
+
+# ========================================================================
+# Original implementation (house_rocket_real_state.py, before vectorization)
+# ========================================================================
+def legacy_buy_report( data ):
+    dfzip = data[['price', 'zipcode']].groupby('zipcode').median().reset_index()
+    df2 = pd.merge(data, dfzip, on='zipcode', how='inner')
+    df2.rename(columns={'price_x': 'buy_price', 'price_y': 'median_price'}, inplace=True)
+
+    df2['recommendation'] = pd.Series('NA', index=df2.index, dtype=object)
+    for i in range(len(df2)):
+        if ( df2.loc[i, 'buy_price'] < df2.loc[i, 'median_price'] ) & ( df2.loc[i, 'condition'] >= 4 ) & ( df2.loc[i, 'waterfront'] == 1 ):
+            df2.loc[i, 'recommendation'] = 'compra'
+        else:
+            df2.loc[i, 'recommendation'] = 'não compra'
+
+    recom_buy = df2.loc[df2['recommendation'] == 'compra'].copy()
+    recom_buy['condition_status'] = "NA"
+    recom_buy['condition_status'] = recom_buy['condition'].apply( lambda x: 'excelente' if x == 5 else "muito bom" if x == 4 else None )
+    rep_buy = recom_buy[['id', 'zipcode', 'buy_price', 'median_price', 'condition_status', 'recommendation', 'lat', 'long']]
+    return rep_buy.reset_index(drop=True)
+
+
+def legacy_sell_report( recom_buy ):
+    recom_sell = recom_buy.copy()
+    recom_sell['seasonality'] = 'winter'
+    recom_sell['winter_median_price'] = WINTER_MEDIAN_PRICE
+    recom_sell = recom_sell.reset_index(drop=True)
+
+    # object columns, as 'NA' produced on pandas 1.x (pandas >= 3 would infer a str column)
+    recom_sell['sale_price'] = pd.Series('NA', index=recom_sell.index, dtype=object)
+    for i in range(len(recom_sell)):
+        recom_sell.loc[i, 'sale_price'] = ((recom_sell.loc[i, 'buy_price'] * 30 / 100) + recom_sell.loc[i, 'buy_price'])
+
+    recom_sell['profit'] = pd.Series('NA', index=recom_sell.index, dtype=object)
+    for i in range(len(recom_sell)):
+        recom_sell.loc[i, 'profit'] = (recom_sell.loc[i, 'sale_price'] - recom_sell.loc[i, 'buy_price'])
+
+    return recom_sell[['id', 'zipcode', 'seasonality', 'winter_median_price', 'buy_price', 'sale_price', 'profit']]
+
+
+def vectorized_reports( data ):
+    rep_buy = buy_report( data, median_price=zipcode_median_price( data ) )
+    return rep_buy, sell_report( rep_buy, WINTER_MEDIAN_PRICE )
+
+
+def legacy_reports( data ):
+    rep_buy = legacy_buy_report( data )
+    return rep_buy, legacy_sell_report( rep_buy )
+
+
+# ========================================================================
+# Benchmark
+# ========================================================================
+def resample( base, rows, seed=0 ):
+    """ Resamples the King County rows (with replacement) up to the requested size
+    :param base: original dataset
+    :param rows: number of rows
+    :param seed: random seed
+    :return: dataset with COLUMNS and unique ids """
+    rng = np.random.default_rng(seed)
+    df = base[COLUMNS].iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+    df['id'] = np.arange(rows, dtype='int64')
+    df['price'] = np.round(df['price'].to_numpy() * rng.uniform(0.9, 1.1, rows))
+    return df
+
+
+def timed( func, *args ):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--rows', type=int, nargs='+', default=[20_000, 1_000_000, 10_000_000])
+    parser.add_argument('--legacy-max-rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    base = pd.read_csv( args.data )
+    per_row = None
+
+    print('{:>12} {:>14} {:>14} {:>10}  {}'.format('rows', 'loops (s)', 'vectorized (s)', 'speedup', 'same report'))
+    for rows in args.rows:
+        data = resample( base, rows )
+        t_new, (new_buy, new_sell) = timed( vectorized_reports, data )
+
+        if rows <= args.legacy_max_rows:
+            t_old, (old_buy, old_sell) = timed( legacy_reports, data )
+            per_row = t_old / rows
+            pd.testing.assert_frame_equal(new_buy, old_buy, check_dtype=False)
+            pd.testing.assert_frame_equal(new_sell, old_sell, check_dtype=False)
+            old, same = '{:.3f}'.format(t_old), 'yes'
+        elif per_row is not None:
+            t_old = per_row * rows
+            old, same = '~{:.1f}'.format(t_old), 'not run'
+        else:
+            t_old, old, same = None, 'skipped', 'not run'
+
+        speedup = '{:.0f}x'.format(t_old / t_new) if t_old else '-'
+        print('{:>12,} {:>14} {:>14.3f} {:>10}  {}'.format(rows, old, t_new, speedup, same))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+""" Benchmark: scenario engine x one buy_report + sell_report per scenario.
+
+Checks that house_rocket.scenarios gives, for every scenario, the houses, investment
+and profit of running the recommendation reports with the same rules, and times both.
+
+    python -m benchmarks.bench_scenarios --workers 1 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from house_rocket.ingest import load_dataset
+from house_rocket.recommendation import buy_report, sell_report
+from house_rocket.scenarios import DEFAULT_GRID, run_scenarios, season_medians
+
+
+def report_scenario( data, season_prices, scenario ):
+    """ Houses, investment and profit of one scenario, from the report functions """
+    rep_buy = buy_report( data, min_condition=scenario['min_condition'], waterfront=scenario['waterfront'],
+                          max_price_ratio=scenario['max_price_ratio'] )
+    rep_sell = sell_report( rep_buy, season_prices[scenario['season']], season=scenario['season'],
+                            markup=scenario['markup'], markup_above_median=scenario['markup_above_median'] )
+    return len(rep_buy), rep_buy['buy_price'].sum(), rep_sell['profit'].sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    data = load_dataset( args.data, columns=['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long', 'date'] )
+    season_prices = season_medians( data )
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        scenarios = run_scenarios( data, DEFAULT_GRID, workers=workers )
+        print('engine, {} worker(s): {} scenarios in {:.3f} s'.format(workers, len(scenarios), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    expected = np.array([report_scenario( data, season_prices, row ) for _, row in scenarios.iterrows()])
+    elapsed = time.perf_counter() - start
+    print('buy_report + sell_report per scenario: {:.1f} s'.format(elapsed))
+
+    assert ( scenarios['houses'].to_numpy() == expected[:, 0] ).all()
+    assert np.allclose(scenarios['invested'], expected[:, 1], rtol=1e-12)
+    assert np.allclose(scenarios['profit'], expected[:, 2], rtol=1e-9)
+    print('same houses, investment and profit for every scenario')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+""" Load test: memory of several dashboard processes serving concurrent sessions.
+
+Starts --workers processes (standing for Streamlit server processes). Each one attaches
+the dataset, then serves --sessions simulated sessions (threads running zipcode filters,
+table pages and descriptive statistics on the shared dataset). While every worker is
+alive, each reports its private memory (USS) and proportional share (PSS) from
+/proc/self/smaps_rollup, after attaching the dataset and after serving the sessions.
+Three ways of attaching are compared:
+
+- csv:    HouseDataset( read_csv( path ) ), every process parses and compacts its own copy
+- frame:  HouseDataset( load_dataset( path ) ), decoded frame of the cache, compacted again
+- shared: HouseDataset( *load_compact( path ) ), zero-copy views of the codes in the mapped cache file
+
+    python -m benchmarks.bench_shared_memory --rows 2000000 --workers 4 --sessions 8
+
+With 'shared', the private memory of the attached dataset stays near zero per worker
+(the mapped pages are counted once in the total PSS), whatever the dataset size.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from benchmarks.bench_streaming import write_synthetic_csv
+
+COLUMNS = ['id', 'date', 'price', 'bedrooms', 'zipcode', 'sqft_living', 'price_m2']
+
+
+def memory():
+    """ Private (USS) and proportional (PSS) memory of this process, in bytes """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return fields['Private_Clean'] + fields['Private_Dirty'], fields['Pss']
+
+
+def session( data, queries, seed ):
+    """ One simulated user: zipcode filters, a table page and descriptive statistics """
+    rng = np.random.default_rng(seed)
+    zipcodes = np.unique(data['zipcode'])
+    for _ in range(queries):
+        mask = data.isin('zipcode', rng.choice(zipcodes, 3, replace=False))
+        data.frame( columns=COLUMNS, mask=mask, limit=50 )
+        num = data.frame( columns=['price', 'sqft_living', 'price_m2'], mask=mask )
+        num.describe()
+
+
+def worker( path, mode, sessions, queries, barrier, results, rank ):
+    from house_rocket.dataset import HouseDataset
+    from house_rocket.ingest import load_compact, load_dataset, read_csv
+
+    loaders = {'csv': lambda p: ( read_csv( p ), ), 'frame': lambda p: ( load_dataset( p ), ), 'shared': load_compact}
+    private_before, _ = memory()
+    data = HouseDataset( *loaders[mode]( path ) )
+    # touch every page of every column, as the dashboard cubes and indexes do
+    for name in data.columns:
+        np.asarray(data[name]).view('uint8')[::4096].sum()
+
+    barrier.wait()  # every worker attached: pages mapped by several processes are shared
+    private_attached, _ = memory()
+
+    threads = [threading.Thread(target=session, args=(data, queries, rank * 1000 + s)) for s in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    barrier.wait()
+    private, pss = memory()
+    results.put((rank, private_attached - private_before, private - private_before, pss))
+    barrier.wait()
+
+
+def run( path, mode, workers, sessions, queries ):
+    ctx = multiprocessing.get_context('spawn')
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, mode, sessions, queries, barrier, results, rank))
+             for rank in range(workers)]
+    for p in procs:
+        p.start()
+    out = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    from house_rocket.ingest import build_cache, cache_path
+
+    path = os.path.join(tempfile.gettempdir(), 'house_rocket_shared_{}.csv'.format(args.rows))
+    write_synthetic_csv( args.data, path, args.rows )
+    build_cache( path )
+    print('dataset: {:,} rows, cache {:.0f} MB'.format(args.rows, os.path.getsize(cache_path( path )) / 2**20))
+
+    print('private MB per worker (mean), total PSS MB of the workers')
+    print('{:<7} {:>7}  {:>14}  {:>15}  {:>9}'.format('mode', 'workers', 'dataset attach', 'after sessions', 'total PSS'))
+    try:
+        for mode in ['csv', 'frame', 'shared']:
+            for workers in args.workers:
+                out = np.array(run( path, mode, workers, args.sessions, args.queries ), dtype='float64') / 2**20
+                print('{:<7} {:>7}  {:>14.0f}  {:>15.0f}  {:>9.0f}'.format(
+                    mode, workers, out[:, 1].mean(), out[:, 2].mean(), out[:, 3].sum()))
+    finally:
+        os.remove(path)
+        os.remove(cache_path( path ))
+
+
+if __name__ == '__main__':
+    main()
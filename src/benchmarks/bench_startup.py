@@ -0,0 +1,178 @@
+""" Benchmark: cold start of the dashboard process.
+
+1. Import-time breakdown (python -X importtime, fresh interpreter): modules imported at
+   the top of the script (before the first paint) and modules imported by the sessions.
+2. Time to first byte and to first paint: starts `streamlit run` the way the Procfile
+   does, then measures, from the process start,
+   - server: first byte of the HTTP page,
+   - first paint: first element (delta) received by a browser session,
+   - full page: end of the first script run.
+
+    python -m benchmarks.bench_startup --runs 3
+
+The csv cache and the geofile store should be built first (Procfile), as in production.
+"""
+import argparse
+import ast
+import asyncio
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+SCRIPT = 'house_rocket_real_state.py'
+
+
+def script_imports( path=SCRIPT ):
+    """ Modules imported by the script: at the top level, and inside functions
+    :param path: script path
+    :return: top-level modules, session modules (lists of names) """
+    tree = ast.parse(open(path).read())
+    top, sessions = [], []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [node.module] if isinstance(node, ast.ImportFrom) else [a.name for a in node.names]
+            target = top if node in tree.body else sessions
+            target.extend(n for n in names if n not in target)
+    return top, [n for n in sessions if n not in top]
+
+
+def import_times( modules ):
+    """ Cumulative import time of each module, imported in order in a fresh interpreter
+    (a module already imported by a previous one counts 0)
+    :param modules: module names
+    :return: list of (module, seconds), total seconds """
+    code = 'import ' + ', '.join(modules)
+    start = time.perf_counter()
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         check=True, capture_output=True, text=True).stderr
+    total = time.perf_counter() - start
+
+    cumulative = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cum, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # imported by the -c code, not by another module
+            cumulative[name.strip()] = int(cum) / 1e6
+    return [(m, cumulative.get(m, 0.0)) for m in modules], total
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+async def connect( port ):
+    """ Opens a browser session on the streamlit websocket """
+    from tornado.websocket import websocket_connect
+
+    for endpoint in ('_stcore/stream', 'stream'):  # newer / older streamlit
+        try:
+            return await websocket_connect('ws://localhost:{}/{}'.format(port, endpoint))
+        except Exception:
+            pass
+    raise RuntimeError('no streamlit websocket on port {}'.format(port))
+
+
+async def script_run( ws, start, timeout ):
+    """ Asks the session for a script run and waits for its end
+    :return: seconds to the first delta and to script_finished (from start) """
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    msg = BackMsg()
+    msg.rerun_script.query_string = ''
+    await ws.write_message(msg.SerializeToString(), binary=True)
+
+    first_delta = None
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        raw = await ws.read_message()
+        if raw is None:
+            break
+        fwd = ForwardMsg()
+        fwd.ParseFromString(raw)
+        kind = fwd.WhichOneof('type')
+        if kind == 'delta':
+            first_delta = first_delta or time.perf_counter() - start
+            element = fwd.delta.new_element
+            if fwd.delta.WhichOneof('type') == 'new_element' and element.WhichOneof('type') == 'exception':
+                raise RuntimeError('the script raised {}: {}'.format(element.exception.type, element.exception.message))
+        elif kind == 'script_finished':
+            return first_delta, time.perf_counter() - start
+    raise RuntimeError('the script did not finish in {} s'.format(timeout))
+
+
+async def first_run( port, start, timeout ):
+    """ Opens a browser session on the websocket and times the first script run
+    :return: seconds to the first delta and to script_finished (from start) """
+    ws = await connect( port )
+    try:
+        return await script_run( ws, start, timeout )
+    finally:
+        ws.close()
+
+
+def start_server( env=None, timeout=120 ):
+    """ Starts `streamlit run` on a free port and waits for its first HTTP byte
+    :param env: environment of the process. Default: this one
+    :return: process, port, start time (perf_counter) and seconds to the first byte """
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'streamlit', 'run', SCRIPT, '--server.headless', 'true',
+                             '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    while True:
+        try:
+            with urllib.request.urlopen('http://localhost:{}/'.format(port), timeout=1) as resp:
+                resp.read(1)
+            return proc, port, start, time.perf_counter() - start
+        except OSError:
+            if proc.poll() is not None or time.perf_counter() - start > timeout:
+                proc.terminate()
+                raise RuntimeError('streamlit did not start')
+            time.sleep(0.02)
+
+
+def cold_start( timeout=120 ):
+    """ Starts a new streamlit process and times it
+    :return: dict of seconds: server, first_paint, full_page """
+    proc, port, start, server = start_server( timeout=timeout )
+    try:
+        first_paint, full_page = asyncio.run(first_run( port, start, timeout ))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {'server': server, 'first_paint': first_paint, 'full_page': full_page}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='cold starts (median is reported)')
+    parser.add_argument('--imports-only', action='store_true')
+    args = parser.parse_args()
+
+    top, sessions = script_imports()
+    times, total = import_times( top + sessions )
+    print('import time, fresh interpreter ({:.2f} s wall)'.format(total))
+    for label, names in [('top level (before first paint)', top), ('sessions (lazy)', sessions)]:
+        print('  {}:'.format(label))
+        for name, seconds in times:
+            if name in names:
+                print('    {:<32} {:6.3f} s'.format(name, seconds))
+        print('    {:<32} {:6.3f} s'.format('total', sum(s for n, s in times if n in names)))
+    if args.imports_only:
+        return
+
+    runs = [cold_start() for _ in range(args.runs)]
+    print('cold start, median of {} runs (from process start)'.format(len(runs)))
+    for key, label in [('server', 'server first byte'), ('first_paint', 'first paint'), ('full_page', 'full page')]:
+        print('  {:<32} {:6.2f} s'.format(label, statistics.median(r[key] for r in runs)))
+
+
+if __name__ == '__main__':
+    main()
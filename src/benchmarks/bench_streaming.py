@@ -0,0 +1,115 @@
+""" Benchmark: peak memory of the chunked ingestion on a large synthetic csv.
+
+Writes a csv with the format of kc_house_data.csv (rows resampled from it), then runs
+house_rocket.streaming.stream_dataset in a child process and checks that the memory
+used on top of the interpreter and libraries (peak RSS - RSS after imports) stays under
+the ceiling given to stream_dataset.
+
+    python -m benchmarks.bench_streaming --rows 50000000 --memory-limit-mb 256
+
+Exits with status 1 when the ceiling is exceeded.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def write_synthetic_csv( base_path, path, rows, batch_rows=1_000_000, seed=0 ):
+    """ Writes `rows` rows resampled from the base csv, keeping its text format
+    :param base_path: kc_house_data.csv
+    :param path: output csv
+    :param rows: number of rows
+    :param batch_rows: rows written at a time
+    :param seed: random seed """
+    rng = np.random.default_rng(seed)
+    base = pd.read_csv(base_path, dtype=str)
+    written = 0
+    with open(path, 'w') as f:
+        while written < rows:
+            n = min(batch_rows, rows - written)
+            batch = base.iloc[rng.integers(0, len(base), n)]
+            batch.to_csv(f, index=False, header=written == 0)
+            written += n
+
+
+def max_rss():
+    """ Peak resident memory of this process, in bytes. VmHWM rather than ru_maxrss: the
+    latter keeps the peak of the parent at fork time, which would count the csv generation """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+
+
+def current_rss():
+    """ Current resident memory of this process, in bytes """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def child( path, memory_limit ):
+    """ Runs the ingestion and prints: rows, seconds, baseline RSS, peak RSS """
+    from house_rocket.streaming import stream_dataset  # imports count in the baseline
+    import house_rocket.aggregates  # noqa: F401
+    baseline = current_rss()
+
+    start = time.perf_counter()
+    result = stream_dataset( path, memory_limit=memory_limit )
+    print(result.rows, time.perf_counter() - start, baseline, max_rss())
+
+
+def measure( path, memory_limit_mb ):
+    """ Runs the ingestion of a csv in a child process
+    :param path: csv path
+    :param memory_limit_mb: ceiling given to stream_dataset
+    :return: rows, seconds, baseline RSS and peak RSS (bytes) of the child """
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_streaming', '--child', '--csv', str(path),
+                          '--memory-limit-mb', str(memory_limit_mb)],
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         check=True, capture_output=True, text=True).stdout.split()
+    return int(out[0]), float(out[1]), int(out[2]), int(out[3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv')
+    parser.add_argument('--rows', type=int, default=50_000_000)
+    parser.add_argument('--memory-limit-mb', type=int, default=256)
+    parser.add_argument('--csv', help='existing synthetic csv (skips the generation)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    memory_limit = args.memory_limit_mb * 2**20
+
+    if args.child:
+        return child( args.csv, memory_limit )
+
+    path = args.csv
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), 'house_rocket_{}.csv'.format(args.rows))
+        start = time.perf_counter()
+        write_synthetic_csv( args.data, path, args.rows )
+        print('wrote {:,} rows ({:.0f} MB) in {:.0f} s'.format(args.rows, os.path.getsize(path) / 2**20,
+                                                            time.perf_counter() - start))
+
+    rows, seconds, baseline, peak = measure( path, args.memory_limit_mb )
+
+    used = peak - baseline
+    print('rows: {:,}  time: {:.1f} s  baseline RSS: {:.0f} MB  peak RSS: {:.0f} MB  '
+          'data: {:.0f} MB / limit {} MB'.format(rows, seconds, baseline / 2**20, peak / 2**20,
+                                                 used / 2**20, args.memory_limit_mb))
+    if args.csv is None:
+        os.remove(path)
+    if used > memory_limit:
+        print('FAILED: memory ceiling exceeded')
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+""" Benchmark suite: the data layer function by function, and full reruns of the dashboard.
+
+For each --rows size, writes a synthetic King County-shaped csv (benchmarks.synthetic)
+and times:
+- micro-benchmarks (BENCHMARKS): one step of a rerun each, on the inputs the dashboard
+  gives it, repeated --repeat times;
+- full_rerun_cold / full_rerun: the dashboard run by a `streamlit run` server on the
+  synthetic csv (HOUSE_ROCKET_DATA), for a session opened on its websocket, without a
+  browser (benchmarks.bench_startup). The first run builds the csv cache and the
+  singletons (cold), the next --repeat runs of the session hit them, as the reruns of
+  a browser session do. (Running the script with plain python wouldn't do: streamlit
+  caches are bypassed without a session.)
+
+The results (machine, commit, min and median seconds of each benchmark at each size)
+are written to --output. With --baseline, every median is compared to the same
+benchmark and size of the baseline file: slower by more than --tolerance, and by more
+than NOISE_FLOOR seconds, is flagged as a regression and the exit status is 1.
+
+    python -m benchmarks.suite --rows 10000 100000 --output benchmarks/results/baseline.json
+    python -m benchmarks.suite --rows 10000 100000 --baseline benchmarks/results/baseline.json
+
+Only compare results of the same machine. The full rerun needs the dashboard
+dependencies (requirements.txt) and the zipcode store (python -m house_rocket.geostore);
+--no-rerun skips it.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_csv
+from house_rocket.ingest import cache_path
+
+# Regressions smaller than this (seconds) are timer noise
+NOISE_FLOOR = 0.005
+
+# Zipcodes selected by the micro-benchmarks of the filters
+ZIPCODES = [98001, 98103, 98115]
+
+
+def prepare( path ):
+    """ Inputs of the micro-benchmarks, built the way the dashboard builds them
+    :param path: csv path (the columnar cache is built here)
+    :return: dict """
+    from house_rocket.aggregates import build_cube
+    from house_rocket.dataset import HouseDataset
+    from house_rocket.filters import FilterIndex
+    from house_rocket.ingest import build_cache, load_compact, read_csv
+    from house_rocket.recommendation import buy_report
+    from house_rocket.stats import StatsEngine
+
+    build_cache( path )
+    data = HouseDataset( *load_compact( path ) )
+    df = data.frame( columns=['zipcode', 'yr_built', 'date', 'price', 'sqft_living', 'price_m2'] )
+    zip_cube = build_cube( df, by=('zipcode',) )
+    report = data.frame( columns=['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long'] )
+    return {'path': path,
+            'raw': read_csv( path ),
+            'data': data,
+            'cube_frame': df,
+            'zip_cube': zip_cube,
+            'season_cube': build_cube( df, by=('zipcode', 'season'), metrics=('price',) ),
+            'date_cube': build_cube( df, by=('zipcode', 'date'), metrics=('price',) ),
+            'index': FilterIndex( data, member_columns=['zipcode'] ),
+            'stats': StatsEngine( data, data.numeric_columns ),
+            'report_frame': report,
+            'median_price': zip_cube[('price', 'median')].rename('price').reset_index(),
+            'buy_report': buy_report( report, median_price=zip_cube[('price', 'median')].rename('price').reset_index() )}
+
+
+def bench_read_csv( ctx ):
+    from house_rocket.ingest import read_csv
+    read_csv( ctx['path'] )
+
+
+def bench_build_cache( ctx ):
+    from house_rocket.ingest import build_cache
+    build_cache( ctx['path'] )
+
+
+def bench_get_data( ctx ):
+    from house_rocket.dataset import HouseDataset
+    from house_rocket.ingest import load_compact
+    HouseDataset( *load_compact( ctx['path'] ) )
+
+
+def bench_set_feature( ctx ):
+    from house_rocket.dataset import set_feature
+    set_feature( ctx['raw'] )
+
+
+def bench_cubes( ctx ):
+    from house_rocket.aggregates import build_cube
+    df = ctx['cube_frame']
+    build_cube( df, by=('zipcode',) )
+    build_cube( df, by=('zipcode', 'season'), metrics=('price',) )
+    build_cube( df, by=('zipcode', 'yr_built'), metrics=('price',) )
+    build_cube( df, by=('zipcode', 'date'), metrics=('price',) )
+
+
+def bench_filter_index( ctx ):
+    from house_rocket.filters import FilterIndex
+    FilterIndex( ctx['data'], member_columns=['zipcode'] )
+
+
+def bench_overview( ctx ):
+    """ Data Overview with a zipcode filter: filter, first page, averages, descriptive table """
+    from house_rocket.aggregates import select
+    from house_rocket.tables import PagedTable
+    index = ctx['index']
+    mask = index.rows( index.member( 'zipcode', ZIPCODES ) )
+    PagedTable( ctx['data'] ).window( page=1, page_size=50, rows=mask )
+    select( ctx['zip_cube'], 'zipcode', ZIPCODES )
+    ctx['stats'].describe( ZIPCODES )
+
+
+def bench_table_sort( ctx ):
+    from house_rocket.tables import PagedTable
+    PagedTable( ctx['data'] ).window( page=3, page_size=50, sort_by='price', ascending=False )
+
+
+def bench_stats_engine( ctx ):
+    from house_rocket.stats import StatsEngine
+    StatsEngine( ctx['data'], ctx['data'].numeric_columns )
+
+
+def bench_map_clusters( ctx ):
+    from house_rocket.spatial import cluster_levels, pick_zoom, cells_geojson
+    data = ctx['data']
+    levels = cluster_levels( data['lat'], data['long'], price=data['price'] )
+    cells_geojson( levels[pick_zoom( levels, max_clusters=500 )] )
+
+
+def bench_histograms( ctx ):
+    from house_rocket.histograms import ContinuousHistogram, DiscreteHistogram
+    data = ctx['data']
+    ContinuousHistogram( data['price'] ).bins( 50 )
+    for name in ['bedrooms', 'bathrooms', 'floors', 'waterfront']:
+        DiscreteHistogram( data[name] ).bins()
+
+
+def bench_timeseries( ctx ):
+    from house_rocket.timeseries import FREQUENCIES, MAX_POINTS, resample
+    for freq in FREQUENCIES.values():
+        resample( ctx['date_cube'], 'date', freq ).series( max_points=MAX_POINTS )
+
+
+def bench_buy_report( ctx ):
+    from house_rocket.recommendation import buy_report
+    buy_report( ctx['report_frame'], median_price=ctx['median_price'], min_condition=4, waterfront=True )
+
+
+def bench_sell_report( ctx ):
+    from house_rocket.recommendation import sell_report, WINTER_MEDIAN_PRICE
+    sell_report( ctx['buy_report'], WINTER_MEDIAN_PRICE, season='winter', markup=30 )
+
+
+def bench_scenarios( ctx ):
+    from house_rocket.scenarios import SEASONS, run_scenarios
+    season_prices = ctx['season_cube'][('price', 'median')].unstack('season').reindex(columns=list(SEASONS))
+    run_scenarios( ctx['report_frame'], median_price=ctx['median_price'], season_prices=season_prices )
+
+
+def bench_comparables( ctx ):
+    from house_rocket.comparables import ComparablesIndex, comparables
+    data = ctx['data']
+    comparables( ComparablesIndex( data['lat'], data['long'] ), data['price'], data['price_m2'] )
+
+
+BENCHMARKS = {'read_csv': bench_read_csv,
+              'build_cache': bench_build_cache,
+              'get_data': bench_get_data,
+              'set_feature': bench_set_feature,
+              'cubes': bench_cubes,
+              'filter_index': bench_filter_index,
+              'overview': bench_overview,
+              'table_sort': bench_table_sort,
+              'stats_engine': bench_stats_engine,
+              'map_clusters': bench_map_clusters,
+              'histograms': bench_histograms,
+              'timeseries': bench_timeseries,
+              'buy_report': bench_buy_report,
+              'sell_report': bench_sell_report,
+              'scenarios': bench_scenarios,
+              'comparables': bench_comparables}
+
+
+def measure( func, repeat, *args ):
+    """ Seconds of each of `repeat` calls """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func( *args )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result( name, rows, times ):
+    return {'benchmark': name, 'rows': rows, 'runs': len(times),
+            'min': min(times), 'median': statistics.median(times)}
+
+
+async def session_runs( port, runs, timeout ):
+    """ Script runs of one browser session, one after the other
+    :return: seconds of each run, from the request to script_finished """
+    from benchmarks.bench_startup import connect, script_run
+    ws = await connect( port )
+    try:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            _, finished = await script_run( ws, start, timeout )
+            times.append(finished)
+        return times
+    finally:
+        ws.close()
+
+
+def full_rerun( path, reruns, timeout=3600 ):
+    """ Cold run and reruns of the dashboard on a csv, in a streamlit server
+    :param path: csv path (its columnar cache is removed first, the cold run builds it)
+    :param reruns: runs of the same session after the cold one (widgets unchanged)
+    :return: seconds of the cold run, seconds of each rerun """
+    from benchmarks.bench_startup import start_server
+    if os.path.exists(cache_path( path )):
+        os.remove(cache_path( path ))
+    proc, port, _, _ = start_server( env=dict(os.environ, HOUSE_ROCKET_DATA=path) )
+    try:
+        times = asyncio.run(session_runs( port, reruns + 1, timeout ))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return times[0], times[1:]
+
+
+def machine():
+    """ Where and on which commit the results were measured """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__}
+
+
+def compare( results, baseline, tolerance ):
+    """ Medians of the results against the same benchmark and size of the baseline
+    :param results: list of result dicts
+    :param baseline: list of result dicts
+    :param tolerance: relative slowdown allowed (0.2 = 20%)
+    :return: list of (result, baseline median, ratio, status), status in 'regression', 'faster', 'ok', 'new' """
+    base = {(r['benchmark'], r['rows']): r['median'] for r in baseline}
+    rows = []
+    for r in results:
+        before = base.get((r['benchmark'], r['rows']))
+        if before is None:
+            rows.append((r, None, None, 'new'))
+            continue
+        ratio = r['median'] / before if before > 0 else np.inf
+        if ratio > 1 + tolerance and r['median'] - before > NOISE_FLOOR:
+            status = 'regression'
+        elif ratio < 1 / ( 1 + tolerance ) and before - r['median'] > NOISE_FLOOR:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((r, before, ratio, status))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='kc_house_data.csv', help='base csv of the synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS) + ['full_rerun'], help='benchmarks to run')
+    parser.add_argument('--no-rerun', action='store_true', help='skip the full rerun of the dashboard')
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results', 'latest.json'))
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown flagged as regression')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    names = [n for n in BENCHMARKS if not args.only or n in args.only]
+    rerun = not args.no_rerun and ( not args.only or 'full_rerun' in args.only )
+    results = []
+    for rows in args.rows:
+        path = os.path.join(tempfile.gettempdir(), 'house_rocket_suite_{}_{}.csv'.format(rows, args.seed))
+        write_csv( path, rows, base_path=args.data, seed=args.seed )
+        try:
+            ctx = prepare( path )
+            for name in names:
+                results.append(result( name, rows, measure( BENCHMARKS[name], args.repeat, ctx ) ))
+                print('{:>10,}  {:<16} {:>9.4f} s'.format(rows, name, results[-1]['median']), flush=True)
+            del ctx
+            if rerun:
+                cold, warm = full_rerun( path, args.repeat )
+                results.append(result( 'full_rerun_cold', rows, [cold] ))
+                results.append(result( 'full_rerun', rows, warm ))
+                print('{:>10,}  {:<16} {:>9.4f} s'.format(rows, 'full_rerun_cold', cold))
+                print('{:>10,}  {:<16} {:>9.4f} s'.format(rows, 'full_rerun', results[-1]['median']), flush=True)
+        finally:
+            for f in [path, cache_path( path )]:
+                if os.path.exists(f):
+                    os.remove(f)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'machine': machine(), 'repeat': args.repeat, 'results': results}, f, indent=1)
+    print('results: {}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print('\nmedian seconds against {} ({}, commit {})'.format(
+            args.baseline, baseline['machine']['date'], baseline['machine']['commit'] or '?'))
+        rows = compare( results, baseline['results'], args.tolerance )
+        for r, before, ratio, status in rows:
+            print('{:>10,}  {:<16} {:>9.4f}  {:>9}  {:>6}  {}'.format(
+                r['rows'], r['benchmark'], r['median'], '-' if before is None else '{:.4f}'.format(before),
+                '-' if ratio is None else '{:.2f}x'.format(ratio), status))
+        regressions = [r for r, _, _, status in rows if status == 'regression']
+        if regressions:
+            print('{} regression(s) above {:.0%}'.format(len(regressions), args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+""" Synthetic King County-shaped house sales.
+
+fit() summarizes kc_house_data.csv by zipcode and sample() draws new sales from it:
+- zipcode: with the frequency of each zipcode in the base file;
+- house attributes (bedrooms, sqft_*, grade, yr_built...): taken together from a base
+  sale of the same zipcode, so their correlations are kept;
+- lat / long: the location of that base sale moved by a gaussian of LOCATION_SD degrees
+  (~100 m), which keeps the neighbourhood clusters without repeating coordinates;
+- price: the base price times a log-normal noise (PRICE_SIGMA), rounded to $1,000 like
+  most prices of the file, so prices follow the zipcode and the house size;
+- date: a base sale date moved by up to DATE_JITTER_DAYS days, clipped to the base range,
+  which keeps the seasonality;
+- id: new 10-digit ids, with the share of houses sold twice of the base file.
+
+write_csv() writes the csv in batches, with the columns and the date format of the base
+file (20141013T000000), so 10M rows never sit in memory at once.
+
+    python -m benchmarks.synthetic synthetic_1M.csv --rows 1000000
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+LOCATION_SD = 0.001
+PRICE_SIGMA = 0.1
+DATE_JITTER_DAYS = 15
+
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def fit( base_path='kc_house_data.csv' ):
+    """ Summary of the base file used by sample()
+    :param base_path: kc_house_data.csv
+    :return: dict with the base rows (sorted by zipcode), zipcode probabilities and row
+             ranges, date range and share of resales """
+    base = pd.read_csv(base_path)
+    base['date'] = pd.to_datetime(base['date'], format=DATE_FORMAT)
+    base = base.sort_values('zipcode', kind='stable').reset_index(drop=True)
+
+    zipcodes, starts, counts = np.unique(base['zipcode'].to_numpy(), return_index=True, return_counts=True)
+    return {'base': base,
+            'columns': list(base.columns),
+            'zipcodes': zipcodes,
+            'starts': starts,
+            'counts': counts,
+            'probabilities': counts / counts.sum(),
+            'first_date': base['date'].min(),
+            'last_date': base['date'].max(),
+            'resale_share': 1 - base['id'].nunique() / len(base)}
+
+
+def sample( model, rows, rng, first_id=1_000_000_000 ):
+    """ Draws synthetic sales
+    :param model: fit()
+    :param rows: number of rows
+    :param rng: numpy Generator
+    :param first_id: first id of the new houses
+    :return: dataframe with the columns of the base file (date as datetime) """
+    zipcode = rng.choice(len(model['zipcodes']), size=rows, p=model['probabilities'])
+    pick = model['starts'][zipcode] + ( rng.random(rows) * model['counts'][zipcode] ).astype('int64')
+    df = model['base'].iloc[pick].reset_index(drop=True)
+
+    df['lat'] = ( df['lat'] + rng.normal(0, LOCATION_SD, rows) ).round(4)
+    df['long'] = ( df['long'] + rng.normal(0, LOCATION_SD * 1.5, rows) ).round(3)
+    df['price'] = ( df['price'] * rng.lognormal(0, PRICE_SIGMA, rows) ).round(-3).clip(lower=1000).astype('int64')
+    jitter = pd.to_timedelta(rng.integers(-DATE_JITTER_DAYS, DATE_JITTER_DAYS + 1, rows), unit='D')
+    df['date'] = ( df['date'] + jitter ).clip(model['first_date'], model['last_date'])
+
+    # houses sold twice share an id
+    ids = first_id + np.arange(rows)
+    resale = np.flatnonzero(rng.random(rows) < model['resale_share'])
+    ids[resale] = ids[rng.integers(0, rows, len(resale))]
+    df['id'] = ids
+    return df[model['columns']]
+
+
+def write_csv( path, rows, base_path='kc_house_data.csv', batch_rows=1_000_000, seed=0 ):
+    """ Writes a synthetic csv with the format of the base file
+    :param path: output csv
+    :param rows: number of rows
+    :param base_path: kc_house_data.csv
+    :param batch_rows: rows generated and written at a time
+    :param seed: random seed (same seed, same file)
+    :return: path """
+    rng = np.random.default_rng(seed)
+    model = fit( base_path )
+    written = 0
+    with open(path, 'w', newline='') as f:
+        while written < rows:
+            n = min(batch_rows, rows - written)
+            df = sample( model, n, rng, first_id=1_000_000_000 + written )
+            df['date'] = df['date'].dt.strftime(DATE_FORMAT)
+            df.to_csv(f, index=False, header=written == 0)
+            written += n
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a synthetic csv shaped like kc_house_data.csv')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--base', default='kc_house_data.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write_csv( args.path, args.rows, base_path=args.base, seed=args.seed ))
@@ -0,0 +1,5 @@
+""" House Rocket data layer.
+
+Helpers used by the Streamlit dashboard (house_rocket_real_state.py). The modules in
+this package only depend on pandas/numpy, so they can be reused outside the UI.
+"""
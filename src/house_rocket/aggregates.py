@@ -0,0 +1,103 @@
+""" Aggregate cube shared by the dashboard sections.
+
+A cube is one groupby pass over the dataset, keyed by zipcode (optionally also by
+yr_built, sale month or season), with count, mean, median, std, min and max of the
+price metrics. The sections select rows of the cube instead of grouping the full
+dataset again, so a zipcode filter change only touches a few dozen rows.
+
+Selections that span several groups are combined with rollup(): count, sum, mean,
+std, min and max merge exactly from the group values; the median does not, so it is
+only kept when no groups are merged.
+"""
+import numpy as np
+import pandas as pd
+
+from house_rocket.recommendation import seasonality
+
+CUBE_METRICS = ('price', 'sqft_living', 'price_m2')
+CUBE_STATS = ('count', 'sum', 'mean', 'median', 'std', 'min', 'max')
+
+
+def cube_keys( data, by ):
+    """ Group keys of a cube. 'sale_month' and 'season' are derived from 'date'
+    :param data: dataset
+    :param by: key names
+    :return: list of Series to group by """
+    keys = []
+    for key in by:
+        if key == 'sale_month':
+            keys.append(data['date'].dt.month.rename('sale_month'))
+        elif key == 'season':
+            keys.append(pd.Series(seasonality( data['date'].dt.month ), index=data.index, name='season'))
+        else:
+            keys.append(data[key])
+    return keys
+
+
+def build_cube( data, by=('zipcode',), metrics=CUBE_METRICS ):
+    """ Aggregates the metrics by the given keys, in a single groupby
+    :param data: dataset with the key and metric columns
+    :param by: keys: dataset columns, 'sale_month' or 'season'
+    :param metrics: numeric columns to aggregate
+    :return: dataframe indexed by the keys, columns (metric, stat) for stat in CUBE_STATS """
+    grouped = data[list(metrics)].groupby(cube_keys( data, by ), sort=True)
+    return grouped.agg(list(CUBE_STATS))
+
+
+def select( cube, level, values ):
+    """ Rows of the cube whose key `level` is one of values
+    :param cube: cube from build_cube
+    :param level: key name
+    :param values: key values; empty selects everything
+    :return: cube rows """
+    if values is None or len(values) == 0:
+        return cube
+    keys = cube.index.get_level_values(level)
+    return cube.loc[keys.isin(values)]
+
+
+def rollup( cube, by=() ):
+    """ Merges cube groups into coarser ones (e.g. zipcode x season -> zipcode, or a
+    zipcode selection -> one row), without going back to the dataset
+    Means are weighted by count and std is merged with the parallel variance formula
+    (Chan et al.). Medians can't be merged and are NaN when groups were combined.
+    :param cube: cube from build_cube (or select)
+    :param by: key names kept; () merges everything into a single row
+    :return: cube with the same columns """
+    by = list(by)
+    keys = [cube.index.get_level_values(level).to_numpy() for level in by] or [np.zeros(len(cube), dtype='int8')]
+
+    out = {}
+    for metric in cube.columns.get_level_values(0).unique():
+        m = cube[metric]
+        n = m['count'].to_numpy(dtype='float64')
+        frame = pd.DataFrame({'count': n,
+                              'sum': m['sum'].to_numpy(),
+                              'mean': m['mean'].to_numpy(),
+                              'median': m['median'].to_numpy(),
+                              'min': m['min'].to_numpy(),
+                              'max': m['max'].to_numpy(),
+                              'm2': np.nan_to_num(m['std'].to_numpy()) ** 2 * np.clip(n - 1, 0, None)})
+        grouped = frame.groupby(keys, sort=True)
+
+        # m2 of the union = sum(m2_i) + sum(n_i * (mean_i - mean)^2)
+        union_mean = grouped['sum'].transform('sum') / grouped['count'].transform('sum')
+        frame['m2'] += n * ( frame['mean'] - union_mean ) ** 2
+
+        total = frame.groupby(keys, sort=True)[['count', 'sum', 'm2']].sum()
+        single = grouped.size() == 1
+
+        out[metric] = pd.DataFrame({'count': total['count'].astype('int64'),
+                                    'sum': total['sum'],
+                                    'mean': total['sum'] / total['count'],
+                                    'median': grouped['median'].first().where(single),
+                                    'std': np.sqrt(total['m2'] / (total['count'] - 1)),
+                                    'min': grouped['min'].min(),
+                                    'max': grouped['max'].max()})
+
+    result = pd.concat(out, axis=1)
+    if by:
+        result.index.names = by
+    else:
+        result.index = pd.RangeIndex(len(result))
+    return result
@@ -0,0 +1,157 @@
+""" Headless buy / sell reports, without the dashboard.
+
+Runs the ingestion (columnar cache) and the recommendation rules over one or more csv
+files and writes the purchasing and sales reports, e.g. for nightly jobs:
+
+    python -m house_rocket.batch kc_house_data.csv other.csv --format parquet --partitions 4
+
+Files, and zipcode partitions of each file (--partitions), are processed in parallel by
+a process pool. The reference prices of the reports are computed per file and zipcode:
+the zipcode median for the purchases, the mean price of the zipcode on the sale season
+(zipcode x season cube, as in the dashboard) for the sales. They only depend on the rows
+of the zipcode, so partitions give the same reports as a single pass; rows are written sorted by zipcode, then in
+file order, whatever the number of partitions.
+
+Only pandas, numpy and pyarrow are imported (no streamlit, plotly, folium or geopandas).
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.aggregates import build_cube
+from house_rocket.ingest import load_dataset
+from house_rocket.recommendation import buy_report, sell_report
+from house_rocket.scenarios import SEASONS
+
+# Columns read from the cache by the recommendation rules (date: season of the sales reference price)
+REPORT_COLUMNS = ['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long', 'date']
+
+FORMATS = ('csv', 'parquet')
+
+
+def partitions( path, count ):
+    """ Splits the zipcodes of a file into contiguous groups
+    Builds the columnar cache of the file when needed, before the workers read it.
+    :param path: csv path
+    :param count: number of partitions
+    :return: list of zipcode arrays, or [None] (whole file) when count is 1 """
+    zipcodes = np.unique(load_dataset( path, columns=['zipcode'] )['zipcode'])
+    if count <= 1:
+        return [None]
+    return [z for z in np.array_split(zipcodes, min(count, len(zipcodes))) if len(z)]
+
+
+def season_prices( data, season='winter' ):
+    """ Mean price of each zipcode on a season, from the zipcode x season cube
+    :param data: dataset with columns 'zipcode', 'date' and 'price'
+    :param season: 'winter' or 'summer'
+    :return: Series indexed by zipcode (NaN for a zipcode without sales on the season) """
+    cube = build_cube( data, by=('zipcode', 'season'), metrics=('price',) )
+    return cube[('price', 'mean')].unstack('season').reindex(columns=[season])[season]
+
+
+def run_partition( path, zipcodes=None, season='winter', season_price=None, markup=30, **rules ):
+    """ Purchasing and sales reports of the rows of some zipcodes
+    set_feature (m2_lot, price_m2) isn't run: the rules and reports don't read those columns.
+    :param path: csv path
+    :param zipcodes: zipcodes to keep. Default: all rows
+    :param season: season suggested for the sale
+    :param season_price: reference price of the sales report, the same for every zipcode.
+                         Default: mean price of each zipcode on the season (season_prices)
+    :param markup: markup (%) over the buy price
+    :param rules: keyword arguments forwarded to buy_recommendation
+    :return: buy report, sell report """
+    data = load_dataset( path, columns=REPORT_COLUMNS )
+    if zipcodes is not None:
+        data = data[data['zipcode'].isin(zipcodes)]
+    if season_price is None:
+        season_price = season_prices( data, season )
+
+    rep_buy = buy_report( data, **rules )
+    rep_sell = sell_report( rep_buy, season_price, season=season, markup=markup )
+    return rep_buy, rep_sell
+
+
+def merge_reports( reports ):
+    """ Concatenates partition reports, sorted by zipcode (stable: file order within a zipcode)
+    :param reports: list of dataframes
+    :return: dataframe """
+    df = pd.concat(reports, ignore_index=True)
+    return df.sort_values('zipcode', kind='stable').reset_index(drop=True)
+
+
+def write_report( df, path, fmt ):
+    """ Writes a report to a temporary file and renames it, so readers never see a partial file
+    :param df: report
+    :param path: output path
+    :param fmt: 'csv' or 'parquet' """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    if fmt == 'parquet':
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def run( paths, out_dir='reports', fmt='csv', partition_count=1, workers=None, **options ):
+    """ Writes the buy and sell reports of each file
+    :param paths: csv paths
+    :param out_dir: output folder
+    :param fmt: 'csv' or 'parquet'
+    :param partition_count: zipcode partitions per file
+    :param workers: processes. Default: number of CPUs; 1 runs everything in this process
+    :param options: keyword arguments forwarded to run_partition
+    :return: dict csv path -> (buy report path, sell report path) """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format {!r}, expected one of {}'.format(fmt, FORMATS))
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks = [(path, zipcodes) for path in paths for zipcodes in partitions( path, partition_count )]
+    if workers == 1 or len(tasks) == 1:
+        results = [run_partition( path, zipcodes, **options ) for path, zipcodes in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_partition, path, zipcodes, **options) for path, zipcodes in tasks]
+            results = [future.result() for future in futures]
+
+    outputs = {}
+    for path in paths:
+        parts = [result for (task_path, _), result in zip(tasks, results) if task_path == path]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        outputs[path] = []
+        for name, reports in zip(['buy', 'sell'], zip(*parts)):
+            out = os.path.join(out_dir, '{}_{}.{}'.format(stem, name, fmt))
+            write_report( merge_reports( list(reports) ), out, fmt )
+            outputs[path].append(out)
+        outputs[path] = tuple(outputs[path])
+    return outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes the purchasing and sales reports of house sales csv files')
+    parser.add_argument('paths', nargs='*', default=['kc_house_data.csv'])
+    parser.add_argument('--out-dir', default='reports')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--partitions', type=int, default=1, help='zipcode partitions per file')
+    parser.add_argument('--workers', type=int, help='processes (default: number of CPUs)')
+    parser.add_argument('--min-condition', type=int, default=4)
+    parser.add_argument('--max-price-ratio', type=float, default=1.0)
+    parser.add_argument('--no-waterfront', action='store_true', help="don't require water view")
+    parser.add_argument('--season', choices=SEASONS, default='winter')
+    parser.add_argument('--season-price', type=float,
+                        help='reference price of every sale (default: mean price of each zipcode on the season)')
+    parser.add_argument('--markup', type=float, default=30)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    outputs = run( args.paths, out_dir=args.out_dir, fmt=args.format, partition_count=args.partitions,
+                   workers=args.workers, min_condition=args.min_condition, max_price_ratio=args.max_price_ratio,
+                   waterfront=not args.no_waterfront, season=args.season, season_price=args.season_price,
+                   markup=args.markup )
+    for path, (buy, sell) in outputs.items():
+        print('{}: {}, {}'.format(path, buy, sell))
+    print('done in {:.2f} s'.format(time.perf_counter() - start))
@@ -0,0 +1,255 @@
+""" Payload budget of the charts and maps sent to the browser.
+
+Every chart is serialized (plotly figure JSON) before it is sent, and its size is
+checked against two budgets:
+- chart_bytes: the most one chart may weigh;
+- page_bytes: the most the charts and maps of one rerun may weigh together, split in equal
+  shares between the `elements` of the page. A chart gets the smaller of chart_bytes and
+  its share: the allowance doesn't depend on the order the elements are sent in, and is
+  the same for a chart rendered in the background (house_rocket.prefetch). With the
+  defaults and the 10 elements of the dashboard, the share (102 KB) is the allowance,
+  chart_bytes only applies to pages of 4 elements or less, or to a larger page budget.
+  More elements sent than declared is logged.
+
+A figure above its allowance is reduced, trace by trace, until it fits:
+1. WebGL: scatter traces of more than WEBGL_POINTS points become scattergl (the browser
+   draws them on the GPU: about the same bytes, much less time to paint);
+2. decimation: lines are downsampled with LTTB (timeseries.lttb_indices), which keeps
+   the peaks, and marker traces (scatter, maps) keep evenly spaced points;
+3. aggregation: bar traces merge runs of adjacent bars (heights added, the merged bar
+   spans the bars it replaces).
+The points kept are scaled by the bytes left for the points, a few rounds at most. A figure
+that can't fit is sent with MIN_POINTS points per trace. Maps (folium HTML) are reduced by
+the dashboard, which renders coarser versions of a map over its allowance (fewer clusters,
+more simplified polygons) and sends the first one that fits; their reductions are passed
+to spend() like the ones of a figure. A map or chart still over its allowance is logged,
+and so is a page whose elements went over page_bytes.
+
+A figure that fits is sent unchanged. A reduced one is logged (logger house_rocket.budget),
+carries its original size and the reductions in layout.meta, and is listed in the profile
+panel.
+
+    HOUSE_ROCKET_CHART_BUDGET_KB=256     per chart
+    HOUSE_ROCKET_PAGE_BUDGET_KB=1024     per rerun
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.timeseries import lttb_indices
+
+CHART_BUDGET_KB = 256
+PAGE_BUDGET_KB = 1024
+
+# Scatter traces above this number of points are drawn with WebGL when over budget
+WEBGL_POINTS = 1000
+
+# Points (or bars) a reduced trace keeps at least
+MIN_POINTS = 20
+
+# Reduction rounds before giving up on a figure
+MAX_ROUNDS = 4
+
+# Per-point arrays of a trace, and of its marker
+POINT_ARRAYS = ('x', 'y', 'lat', 'lon', 'text', 'hovertext', 'customdata', 'ids', 'width')
+MARKER_ARRAYS = ('size', 'color', 'symbol', 'opacity')
+
+# Trace types decimated point by point
+POINT_TYPES = ('scatter', 'scattergl', 'scattermapbox', 'scattergeo', 'scatterpolar', 'scatterpolargl')
+
+logger = logging.getLogger(__name__)
+
+
+def points( trace ):
+    """ Number of points of a trace (dict of the figure JSON) """
+    for name in ('x', 'y', 'lat', 'lon'):
+        if trace.get(name) is not None:
+            return len(trace[name])
+    return 0
+
+
+def _per_point( values, n ):
+    return values is not None and not isinstance(values, ( str, bytes )) and np.ndim(values) >= 1 and len(values) == n
+
+
+def take( trace, keep ):
+    """ Trace with only some of its points
+    :param trace: dict of the figure JSON
+    :param keep: index array of the points kept
+    :return: new dict """
+    n = points( trace )
+    trace = dict(trace)
+    for name in POINT_ARRAYS:
+        if _per_point( trace.get(name), n ):
+            trace[name] = np.asarray(trace[name])[keep]
+    if isinstance(trace.get('marker'), dict):
+        marker = trace['marker'] = dict(trace['marker'])
+        for name in MARKER_ARRAYS:
+            if _per_point( marker.get(name), n ):
+                marker[name] = np.asarray(marker[name])[keep]
+    return trace
+
+
+def webgl( trace ):
+    """ scatter trace as scattergl (properties scattergl doesn't have are dropped) """
+    import plotly.graph_objects as go
+    return go.Scattergl({k: v for k, v in trace.items() if k != 'type'}, skip_invalid=True).to_plotly_json()
+
+
+def decimate( trace, target ):
+    """ Trace reduced to about `target` points: LTTB for lines on a numeric / date axis,
+    evenly spaced points otherwise """
+    n = points( trace )
+    x = np.asarray(trace['x']) if trace.get('x') is not None else None
+    if 'lines' in trace.get('mode', '') and x is not None and x.dtype.kind in 'iufM' and trace.get('y') is not None:
+        keep = lttb_indices( x, np.asarray(trace['y'], dtype='float64'), max(target, 3) )
+    else:
+        keep = np.unique(np.linspace(0, n - 1, target).round().astype('int64'))
+    return take( trace, keep )
+
+
+def aggregate( trace, target ):
+    """ Bar trace with runs of adjacent bars merged into about `target` bars
+    Heights are added; with bar widths, the merged bar spans the bars it replaces,
+    otherwise it is placed at the mean x of the run. Other arrays keep the first bar of
+    each run. Only vertical bars on a numeric axis are merged. """
+    n = points( trace )
+    x = np.asarray(trace.get('x'))
+    if trace.get('orientation') == 'h' or x.dtype.kind not in 'iuf' or trace.get('y') is None:
+        return trace
+    first = np.arange(0, n, -(-n // target))
+    merged = take( trace, first )
+    merged['y'] = np.add.reduceat(np.asarray(trace['y'], dtype='float64'), first)
+    if _per_point( trace.get('width'), n ):
+        width = np.asarray(trace['width'], dtype='float64')
+        left = ( x - width / 2 )[first]
+        right = ( x + width / 2 )[np.r_[first[1:] - 1, n - 1]]
+        merged['x'], merged['width'] = ( left + right ) / 2, right - left
+    else:
+        merged['x'] = np.add.reduceat(x.astype('float64'), first) / np.diff(np.r_[first, n])
+    return merged
+
+
+def reduce_trace( trace, target ):
+    """ Trace reduced to about `target` points, or unchanged when it can't be reduced """
+    if trace.get('type', 'scatter') == 'bar':
+        return aggregate( trace, target )
+    if trace.get('type', 'scatter') in POINT_TYPES:
+        return decimate( trace, target )
+    return trace
+
+
+def fit_figure( fig, allowance, name='chart' ):
+    """ Figure JSON of a plotly figure, reduced if needed to fit in `allowance` bytes
+    :param fig: plotly figure
+    :param allowance: bytes
+    :param name: chart name, for the log
+    :return: figure JSON (unchanged when it fits) """
+    import plotly.io as pio
+    text = fig.to_json()
+    size = len(text)
+    if size <= allowance:
+        return text
+
+    spec = fig.to_plotly_json()
+    traces = spec['data']
+    original = [points( trace ) for trace in traces]
+    gl = [i for i, trace in enumerate(traces) if trace.get('type', 'scatter') == 'scatter' and original[i] > WEBGL_POINTS]
+    for i in gl:
+        traces[i] = webgl( traces[i] )
+
+    def describe( traces ):
+        # reductions of the traces, stored in layout.meta (part of the bytes sent)
+        steps = ['trace {}: scattergl'.format(i) for i in gl]
+        for i, trace in enumerate(traces):
+            if points( trace ) < original[i]:
+                bars = trace.get('type') == 'bar'
+                steps.append('trace {}: {} {:,} -> {:,} {}'.format(i, 'bars' if bars else 'points', original[i],
+                                                                    points( trace ), 'merged' if bars else 'kept'))
+        spec['layout'] = dict(spec.get('layout') or {}, meta={'payload_bytes': size, 'reductions': steps})
+        return steps
+
+    # bytes of everything but the points (layout, template, styles)
+    steps = describe( traces )
+    fixed = len(pio.to_json({**spec, 'data': [take( trace, [] ) for trace in traces]}, validate=False))
+    text = pio.to_json(spec, validate=False)
+    for _ in range(MAX_ROUNDS):
+        if len(text) <= allowance:
+            break
+        ratio = max(allowance - fixed, 0) / max(len(text) - fixed, 1)
+        reduced = [reduce_trace( trace, max(MIN_POINTS, int(points( trace ) * ratio * 0.95)) )
+                   if points( trace ) > MIN_POINTS else trace for trace in traces]
+        if [points( trace ) for trace in reduced] == [points( trace ) for trace in traces]:
+            break
+        traces = spec['data'] = reduced
+        steps = describe( traces )
+        text = pio.to_json(spec, validate=False)
+
+    logger.warning('%s: %s bytes over the %s bytes budget, sent %s bytes (%s)',
+                   name, format(size, ','), format(allowance, ','), format(len(text), ','), '; '.join(steps))
+    return text
+
+
+class PayloadBudget:
+    """ Per-chart and per-page payload budgets of one rerun
+    :param chart_bytes: most bytes of one chart. Default: HOUSE_ROCKET_CHART_BUDGET_KB
+    :param page_bytes: most bytes of the charts and maps of a rerun. Default: HOUSE_ROCKET_PAGE_BUDGET_KB
+    :param elements: number of charts and maps of a rerun, each one gets an equal share of page_bytes
+    """
+
+    def __init__( self, chart_bytes=None, page_bytes=None, elements=1 ):
+        if chart_bytes is None:
+            chart_bytes = int(os.environ.get('HOUSE_ROCKET_CHART_BUDGET_KB', CHART_BUDGET_KB)) * 1024
+        if page_bytes is None:
+            page_bytes = int(os.environ.get('HOUSE_ROCKET_PAGE_BUDGET_KB', PAGE_BUDGET_KB)) * 1024
+        self.chart_bytes = chart_bytes
+        self.page_bytes = page_bytes
+        self.elements = elements
+        self.sent = 0
+        self.spent = 0
+        self.reductions = []
+
+    def allowance( self ):
+        """ Bytes a chart may use: the chart budget, or its share of the page budget
+        The same for every chart of the rerun, whatever the order they are sent in. """
+        return min(self.chart_bytes, self.page_bytes // max(self.elements, 1))
+
+    def spend( self, element, text, meta=None ):
+        """ Counts a chart or map in the page budget
+        :param element: name shown on the profile panel
+        :param text: figure JSON or map HTML sent
+        :param meta: layout.meta of a figure (fit_figure records its reductions there), or the same dict
+                     ('payload_bytes', 'reductions') for a map sent in a coarser version """
+        allowance = self.allowance()
+        over = self.spent <= self.page_bytes < self.spent + len(text)
+        self.spent += len(text)
+        self.sent += 1
+        if self.sent == self.elements + 1:
+            logger.warning('page: %s sent more elements than the %s the page budget is split between',
+                           element, self.elements)
+        if over:
+            logger.warning('page: %s bytes over the %s bytes budget at %s',
+                           format(self.spent, ','), format(self.page_bytes, ','), element)
+        if isinstance(meta, dict) and meta.get('reductions'):
+            self.reductions.append({'element': element, 'payload_bytes': meta['payload_bytes'],
+                                    'sent_bytes': len(text), 'reductions': '; '.join(meta['reductions'])})
+            if len(text) > allowance:
+                logger.warning('%s: reduced to %s bytes, still over the %s bytes budget',
+                               element, format(len(text), ','), format(allowance, ','))
+        elif len(text) > allowance:
+            logger.warning('%s: %s bytes over the %s bytes budget, not reducible',
+                           element, format(len(text), ','), format(allowance, ','))
+            self.reductions.append({'element': element, 'payload_bytes': len(text),
+                                    'sent_bytes': len(text), 'reductions': 'over budget, not reduced'})
+
+    def stats( self ):
+        """ Budgets and bytes spent, for the profile panel """
+        return {'chart_bytes': self.chart_bytes, 'page_bytes': self.page_bytes, 'elements': self.elements,
+                'allowance': self.allowance(), 'sent': self.sent, 'spent_bytes': self.spent,
+                'reduced': len(self.reductions)}
+
+    def to_frame( self ):
+        """ Reduced (or over budget) elements of the rerun, one row each """
+        return pd.DataFrame(self.reductions, columns=['element', 'payload_bytes', 'sent_bytes', 'reductions'])
@@ -0,0 +1,154 @@
+""" Compact column encodings of the house dataset.
+
+Each column of the dataset is stored as small integer codes, chosen by ENCODINGS:
+- 'int': frame of reference, the value minus the column minimum, in the smallest
+  unsigned dtype that holds the range (yr_built: uint8, sqft_living: uint16...);
+- 'decimal': fixed-point, round(value * 10**decimals) as an 'int' column (price has
+  0 decimals, lat 4, long 3...). The decoded value is (code + base) / 10**decimals, the
+  same float64 as the csv parser gives for the same digits;
+- 'category': index in the sorted distinct values (zipcode: uint8 codes of 70 values);
+- 'date': days since the epoch as an 'int' column (sales are at midnight).
+
+Encodings are checked on the data: a column whose values don't round-trip exactly (a
+price with cents, a date with a time) is kept as it is, so decoding never changes a
+value. The parameters of a column (kind, base, decimals, categories, dtype) are plain
+JSON, stored with the codes in the feather cache.
+
+The derived columns (m2_lot, price_m2) are not stored: HouseDataset computes them from
+sqft_lot and price when they are read.
+"""
+import numpy as np
+
+# Encoding of each column of kc_house_data.csv: kind and decimals of 'decimal' columns
+ENCODINGS = {
+    'id': ('int', None),
+    'date': ('date', None),
+    'price': ('decimal', 0),
+    'bedrooms': ('int', None),
+    'bathrooms': ('decimal', 2),
+    'sqft_living': ('int', None),
+    'sqft_lot': ('int', None),
+    'floors': ('decimal', 1),
+    'waterfront': ('int', None),
+    'view': ('int', None),
+    'condition': ('int', None),
+    'grade': ('int', None),
+    'sqft_above': ('int', None),
+    'sqft_basement': ('int', None),
+    'yr_built': ('int', None),
+    'yr_renovated': ('int', None),
+    'zipcode': ('category', None),
+    'lat': ('decimal', 4),
+    'long': ('decimal', 3),
+    'sqft_living15': ('int', None),
+    'sqft_lot15': ('int', None),
+}
+
+# Columns computed from the stored ones (dataset.set_feature), and the columns they read
+DERIVED = ('m2_lot', 'price_m2')
+DERIVED_SOURCES = ('sqft_lot', 'price')
+
+# Categories above this count are stored as an 'int' column
+MAX_CATEGORIES = 2**16
+
+CODE_DTYPES = ('uint8', 'uint16', 'uint32', 'uint64')
+
+
+def code_dtype( span ):
+    """ Smallest unsigned dtype holding 0..span """
+    for dtype in CODE_DTYPES:
+        if span <= np.iinfo(dtype).max:
+            return dtype
+    raise OverflowError('range {} does not fit in 64 bits'.format(span))
+
+
+def _offsets( values ):
+    """ Frame-of-reference codes of an integer array: codes and base """
+    values = np.asarray(values, dtype='int64')
+    base = int(values.min()) if len(values) else 0
+    # the span is computed in Python ints: max - min may not fit in int64
+    span = int(values.max()) - base if len(values) else 0
+    return ( values - base ).astype(code_dtype( span )), base
+
+
+def encode( values, kind, decimals=None ):
+    """ Codes of a column
+    :param values: numpy array
+    :param kind: 'int', 'decimal', 'category' or 'date'
+    :param decimals: digits kept by a 'decimal' column
+    :return: codes array and parameters (dict), or the values unchanged and None when
+             the encoding would change a value """
+    values = np.asarray(values)
+    params = {'kind': kind, 'dtype': values.dtype.str}
+    try:
+        if kind == 'int':
+            if not np.issubdtype(values.dtype, np.integer):
+                return values, None
+            codes, params['base'] = _offsets( values )
+        elif kind == 'decimal':
+            if not np.issubdtype(values.dtype, np.number) or not np.isfinite(values).all():
+                return values, None
+            scaled = np.round(values.astype('float64') * 10**decimals)
+            codes, params['base'] = _offsets( scaled )
+            params['decimals'] = decimals
+        elif kind == 'category':
+            categories, codes = np.unique(values, return_inverse=True)
+            if len(categories) > MAX_CATEGORIES:
+                return encode( values, 'int' )
+            codes = codes.astype(code_dtype( max(len(categories) - 1, 0) ))
+            params['categories'] = categories.tolist()
+        elif kind == 'date':
+            if not np.issubdtype(values.dtype, np.datetime64):
+                return values, None
+            codes, params['base'] = _offsets( values.astype('datetime64[D]').astype('int64') )
+        else:
+            raise ValueError('Unknown encoding {!r}'.format(kind))
+    except OverflowError:
+        return values, None
+
+    # keep the encoding only if every value comes back unchanged
+    if not np.array_equal(decode( codes, params ), values):
+        return values, None
+    return codes, params
+
+
+def decode( codes, params ):
+    """ Values of a column from its codes
+    :param codes: codes array (or any subset of its rows)
+    :param params: parameters from encode(); None for a column stored as it is
+    :return: array with the dtype of the original column """
+    if params is None:
+        return codes
+    kind, dtype = params['kind'], np.dtype(params['dtype'])
+    if kind == 'category':
+        return np.asarray(params['categories'], dtype=dtype)[codes]
+    values = codes.astype('int64') + params['base']
+    if kind == 'decimal':
+        return ( values / 10**params['decimals'] ).astype(dtype)
+    if kind == 'date':
+        return values.astype('datetime64[D]').astype(dtype)
+    return values.astype(dtype)
+
+
+def compact( columns ):
+    """ Encodes the columns of ENCODINGS, the other ones are kept as they are
+    :param columns: dict name -> numpy array (or a dataframe)
+    :return: dict name -> codes array, dict name -> parameters (None: stored as is) """
+    arrays, encodings = {}, {}
+    for name in columns:
+        values = np.asarray(columns[name])
+        kind, decimals = ENCODINGS.get(name, (None, None))
+        if kind is None:
+            arrays[name], encodings[name] = values, None
+        else:
+            arrays[name], encodings[name] = encode( values, kind, decimals )
+    return arrays, encodings
+
+
+def nbytes( arrays, encodings ):
+    """ Bytes of compacted columns: codes and categories """
+    total = sum(values.nbytes for values in arrays.values())
+    for params in encodings.values():
+        if params and params['kind'] == 'category':
+            total += len(params['categories']) * np.dtype(params['dtype']).itemsize
+    return total
@@ -0,0 +1,162 @@
+""" Comparable properties: nearest neighbours on lat / long.
+
+ComparablesIndex builds a KD-tree (scipy cKDTree) on the coordinates of the properties,
+once per dataset. The coordinates are projected to metres on a local equirectangular
+plane (distances within a county are off by far less than 1%), so radii are given in
+metres. Queries are batched: the k nearest neighbours, or the neighbours within a
+radius, of every selected property in one call.
+
+The comparables median of a property is the median price and price_m2 of its
+neighbours, the property itself left out. It is a finer reference than the median of
+the whole zipcode for the buy rule (recommendation.buy_recommendation(reference_price=...)).
+
+scipy is imported when an index is built, so importing this module stays cheap.
+"""
+import numpy as np
+import pandas as pd
+
+# Mean earth radius (m)
+EARTH_RADIUS_M = 6_371_008.8
+
+# Neighbours of the k-nearest comparables
+DEFAULT_K = 10
+
+COMPARABLES_COLUMNS = ['comparables', 'distance_m', 'comparables_price', 'comparables_price_m2']
+
+
+def project( lat, long, lat0 ):
+    """ Local equirectangular projection
+    :param lat: array of latitudes (degrees)
+    :param long: array of longitudes (degrees)
+    :param lat0: latitude of the projection centre (degrees)
+    :return: array (n, 2) of x, y (metres) """
+    x = EARTH_RADIUS_M * np.radians(np.asarray(long, dtype='float64')) * np.cos(np.radians(lat0))
+    y = EARTH_RADIUS_M * np.radians(np.asarray(lat, dtype='float64'))
+    return np.column_stack([x, y])
+
+
+def positions( rows, size ):
+    """ Row positions of a selection (None: every row, boolean mask or index array) """
+    if rows is None:
+        return np.arange(size)
+    rows = np.asarray(rows)
+    return np.flatnonzero(rows) if rows.dtype == bool else rows.astype('int64')
+
+
+def group_median( group, values, groups ):
+    """ Median of the values of each group (np.median convention)
+    :param group: group of each value, int array
+    :param values: float array
+    :param groups: number of groups
+    :return: array of medians, NaN for the groups without values """
+    # sort by (group, value) on one integer key: value ranks, then group * len + rank
+    rank = np.empty(len(values), dtype='int64')
+    rank[np.argsort(values, kind='stable')] = np.arange(len(values))
+    values = values[np.argsort(np.asarray(group, dtype='int64') * len(values) + rank)]
+    counts = np.bincount(group, minlength=groups)
+    starts = np.cumsum(counts) - counts
+    median = np.full(groups, np.nan)
+    found = counts > 0
+    lower = starts[found] + ( counts[found] - 1 ) // 2
+    upper = starts[found] + counts[found] // 2
+    median[found] = ( values[lower] + values[upper] ) / 2
+    return median
+
+
+class ComparablesIndex:
+    """ KD-tree of the property locations
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :param leafsize: points per leaf of the tree
+    """
+
+    def __init__( self, lat, long, leafsize=32 ):
+        from scipy.spatial import cKDTree
+
+        lat = np.asarray(lat, dtype='float64')
+        self.lat0 = float(lat.mean()) if len(lat) else 0.0
+        self.points = project( lat, long, self.lat0 )
+        self._tree = cKDTree(self.points, leafsize=leafsize)
+
+    def __len__( self ):
+        return len(self.points)
+
+    def knn( self, k=DEFAULT_K, rows=None, workers=-1 ):
+        """ k nearest neighbours of the selected properties, each property left out
+        :param k: neighbours per property (at most len(self) - 1)
+        :param rows: boolean mask or index array of the properties. Default: all
+        :param workers: threads of the query (-1: every CPU)
+        :return: distances (metres) and row positions, arrays (rows, k), nearest first """
+        rows = positions( rows, len(self) )
+        k = max(0, min(k, len(self) - 1))
+        if k == 0 or len(rows) == 0:
+            return np.empty((len(rows), k)), np.empty((len(rows), k), dtype='int64')
+
+        dist, idx = self._tree.query(self.points[rows], k=k + 1, workers=workers)
+        # the property itself is usually the first neighbour, but not always when several
+        # properties share its coordinates: drop it wherever it is, keep the order
+        keep = np.argsort(idx == rows[:, None], axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(dist, keep, axis=1), np.take_along_axis(idx, keep, axis=1)
+
+    def radius( self, radius_m, rows=None ):
+        """ Neighbours within radius_m of the selected properties, each property left out
+        :param radius_m: distance (metres)
+        :param rows: boolean mask or index array of the properties. Default: all
+        :return: flat arrays, one item per (property, neighbour) pair, grouped by property:
+                 position of the property in rows, row position of the neighbour, distance (metres) """
+        from scipy.spatial import cKDTree
+
+        # the pairs come back as arrays, not as one Python list per property
+        if rows is None:
+            # every property: each pair is found once and used in both directions
+            pairs = self._tree.query_pairs(radius_m, output_type='ndarray').astype('int64')
+            owner, idx = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+            dist = np.linalg.norm(self.points[owner] - self.points[idx], axis=1)
+        else:
+            rows = positions( rows, len(self) )
+            query = cKDTree(self.points[rows])
+            pairs = query.sparse_distance_matrix(self._tree, radius_m, output_type='ndarray')
+            owner, idx, dist = pairs['i'].astype('int64'), pairs['j'].astype('int64'), pairs['v']
+            other = idx != rows[owner]
+            owner, idx, dist = owner[other], idx[other], dist[other]
+
+        order = np.argsort(owner, kind='stable')
+        return owner[order], idx[order], dist[order]
+
+
+def comparables( index, price, price_m2, k=DEFAULT_K, radius_m=None, rows=None ):
+    """ Comparables median price and price_m2 of the selected properties
+    :param index: ComparablesIndex of the dataset
+    :param price: prices of every row of the dataset
+    :param price_m2: price per square meter of every row of the dataset
+    :param k: neighbours of each property (k-nearest query)
+    :param radius_m: use the neighbours within this distance (metres) instead of the k nearest
+    :param rows: boolean mask or index array of the properties. Default: all
+    :return: dataframe indexed by row position with COMPARABLES_COLUMNS: number of
+             comparables, distance to the farthest one and median price / price_m2
+             (NaN when a property has no comparable) """
+    price = np.asarray(price, dtype='float64')
+    price_m2 = np.asarray(price_m2, dtype='float64')
+    selection, rows = rows, positions( rows, len(index) )
+
+    if radius_m is None:
+        dist, idx = index.knn( k, rows )
+        count = np.full(len(rows), idx.shape[1])
+        if idx.shape[1]:
+            farthest = dist[:, -1]
+            median_price = np.median(price[idx], axis=1)
+            median_price_m2 = np.median(price_m2[idx], axis=1)
+        else:
+            farthest = median_price = median_price_m2 = np.full(len(rows), np.nan)
+    else:
+        owner, idx, dist = index.radius( radius_m, selection )
+        count = np.bincount(owner, minlength=len(rows))
+        farthest = np.full(len(rows), np.nan)
+        farthest[count > 0] = 0.0
+        np.fmax.at(farthest, owner, dist)
+        median_price = group_median( owner, price[idx], len(rows) )
+        median_price_m2 = group_median( owner, price_m2[idx], len(rows) )
+
+    return pd.DataFrame({'comparables': count, 'distance_m': farthest,
+                         'comparables_price': median_price, 'comparables_price_m2': median_price_m2},
+                        index=rows)[COMPARABLES_COLUMNS]
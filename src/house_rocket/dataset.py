@@ -0,0 +1,135 @@
+""" Read-only house dataset shared by every session.
+
+HouseDataset keeps one read-only numpy array per column, in the compact encodings of
+house_rocket.compact (small integer codes, ~46 bytes per row instead of ~200 for the
+pandas frame of the csv). Built from ingest.load_compact, the codes are views of the
+memory-mapped cache file, shared by every worker process. Sections never receive the
+shared frame: they ask for the rows and columns they need, selected by a boolean mask or
+an index array, and get a new, small DataFrame: the rows are gathered on the codes, then
+decoded. The derived columns (m2_lot, price_m2) are computed from the decoded rows.
+Writing to a shared array raises ValueError instead of silently changing the data seen
+by the other sessions.
+"""
+import numpy as np
+import pandas as pd
+
+from house_rocket.compact import DERIVED, DERIVED_SOURCES, compact, decode, nbytes
+
+
+def set_feature ( data ):
+    """ Converts sqft_lot in m2_lot and creates price per m2
+    The input is not modified: the new columns are added to a shallow copy.
+    :param data: dataset with columns 'sqft_lot' and 'price'
+    :return: dataset with columns 'm2_lot' and 'price_m2'
+    """
+    data = data.copy(deep=False)
+    data['m2_lot'] = (data['sqft_lot'] / 10.764)
+    data['price_m2'] = data['price'] / data['m2_lot']
+    return data
+
+
+def read_only( values ):
+    """ Read-only view of an array
+    :param values: numpy array
+    :return: view that can't be written """
+    values = values.view()
+    values.flags.writeable = False
+    return values
+
+
+class HouseDataset:
+    """ Immutable dataset: one read-only array of codes per column
+    :param data: dataframe or dict of arrays (encoded here), or dict of codes from
+                 ingest.load_compact, used as they are (zero-copy views of the shared cache file)
+    :param encodings: parameters of each column of the codes (ingest.load_compact).
+                      Default: data holds values, not codes
+    """
+
+    def __init__( self, data, encodings=None ):
+        if encodings is None:
+            # derived columns of a loaded frame are computed again when read
+            data, encodings = compact( {name: data[name] for name in data if name not in DERIVED} )
+        self._codes = {name: read_only( values ) for name, values in data.items()}
+        self._encodings = dict(encodings)
+        self.columns = list(self._codes) + [name for name in DERIVED
+                                            if name not in self._codes and set(DERIVED_SOURCES) <= set(self._codes)]
+
+    def __len__( self ):
+        return len(self._codes['id'])
+
+    def __getitem__( self, name ):
+        """ Read-only array of a column """
+        return self.column( name )
+
+    def column( self, name, rows=None ):
+        """ Values of a column, decoded from its codes
+        :param name: column name
+        :param rows: slice, boolean mask or index array. Default: all rows
+        :return: read-only array """
+        if name in DERIVED and name not in self._codes:
+            sources = {source: self.column( source, rows ) for source in DERIVED_SOURCES}
+            return read_only( set_feature( pd.DataFrame(sources) )[name].to_numpy() )
+        codes = self._codes[name] if rows is None else self._codes[name][rows]
+        params = self._encodings.get(name)
+        return codes if params is None else read_only( decode( codes, params ) )
+
+    def codes( self, name ):
+        """ Stored array of a column (codes, or values stored as they are), None for a derived column """
+        return self._codes.get(name)
+
+    def encoding( self, name ):
+        """ Parameters of the encoding of a column (house_rocket.compact), None when stored as is """
+        return self._encodings.get(name)
+
+    @property
+    def nbytes( self ):
+        """ Bytes held by the columns (codes and categories) """
+        return nbytes( self._codes, self._encodings )
+
+    @property
+    def bytes_per_row( self ):
+        return self.nbytes / max(len(self), 1)
+
+    @property
+    def numeric_columns( self ):
+        return [name for name in self.columns if np.issubdtype(self.dtype( name ), np.number)]
+
+    def dtype( self, name ):
+        """ dtype of the decoded values of a column """
+        if name in DERIVED and name not in self._codes:
+            return np.dtype('float64')
+        params = self._encodings.get(name)
+        return self._codes[name].dtype if params is None else np.dtype(params['dtype'])
+
+    def rows( self, mask=None, limit=None ):
+        """ Positions of the selected rows
+        :param mask: boolean mask, index array or None (all rows)
+        :param limit: keep only the first `limit` rows
+        :return: index array, or a slice when every row is selected """
+        if mask is None:
+            return slice(0, limit)
+        rows = np.flatnonzero(mask) if mask.dtype == bool else np.asarray(mask)
+        return rows[:limit]
+
+    def frame( self, columns=None, mask=None, limit=None ):
+        """ New dataframe with the selected rows and columns
+        Only the requested columns and rows are gathered and decoded, so a two-column
+        chart doesn't pay for a copy of the whole dataset.
+        :param columns: column names. Default: all
+        :param mask: boolean mask or index array of the rows. Default: all
+        :param limit: keep only the first `limit` rows (e.g. a preview table)
+        :return: dataframe indexed by row position """
+        rows = self.rows( mask, limit )
+        index = pd.RangeIndex(len(self))[rows] if isinstance(rows, slice) else rows
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({name: self.column( name, rows ) for name in columns}, index=index, columns=columns)
+
+    def isin( self, name, values ):
+        """ Boolean mask of the rows whose column is one of values
+        Category columns are compared on their codes, without decoding the column. """
+        params = self._encodings.get(name)
+        if params and params['kind'] == 'category':
+            categories = np.asarray(params['categories'], dtype=params['dtype'])
+            codes = np.flatnonzero(np.isin(categories, list(values)))
+            return np.isin(self._codes[name], codes)
+        return np.isin(self.column( name ), list(values))
@@ -0,0 +1,289 @@
+""" Append-only delta ingestion of new sales into the partitioned store.
+
+A delta is a csv of new sales with the columns of kc_house_data.csv:
+- validate() checks it against SCHEMA: every column present, every value parsed and in
+  the range of its dtype. A delta with any invalid value is rejected as a whole;
+- the sales already in the store, or repeated in the delta, are dropped by (id, date).
+  Only the partitions of the months of the delta are read to find them;
+- the rows left are written as new partitions (<month>.delta-0001.feather...) and added
+  to the catalog. Existing partition files are never rewritten, so their caches (one per
+  partition file and version) stay valid.
+
+LiveAggregates keeps the cubes (house_rocket.aggregates) and the descriptive statistics
+(StatsEngine) of a selection of partitions up to date: when partitions are appended, only
+the groups that received rows are computed again, from their rows, in the same order as a
+full build. The zipcode FilterIndex, the House Attributes histograms and the map clusters
+are extended with the new rows, and the price time series of the zipcodes that received
+sales are rebuilt from their folded cube rows. The result is identical to a full recompute, medians
+included (tests/test_delta.py, benchmarks/bench_delta.py).
+
+    python -m house_rocket.delta new_sales.csv --dataset king-county --region king
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.aggregates import build_cube, cube_keys
+from house_rocket.filters import FilterIndex
+from house_rocket.histograms import build_histograms, extend_histograms
+from house_rocket.ingest import COLUMNS, DATE_FORMAT, SCHEMA
+from house_rocket.partitions import STORE_DIR, load_partition, read_catalog, write_catalog, write_partitions
+from house_rocket.spatial import cluster_levels
+from house_rocket.stats import DEFAULT_ACCURACY, StatsEngine
+from house_rocket.streaming import CUBES
+from house_rocket.timeseries import build_series, fold_series
+
+# A sale is identified by the house and the sale date (the same house can be sold again)
+KEY_COLUMNS = ('id', 'date')
+
+# Invalid rows listed in the error message of a column
+MAX_REPORTED = 5
+
+
+def validate( rows ):
+    """ Typed rows of a delta, checked against the schema
+    :param rows: dataframe read from the delta csv (strings or numbers)
+    :return: dataframe of COLUMNS with SCHEMA dtypes and datetime 'date'
+    :raise ValueError: missing columns, or values that don't parse or don't fit the dtype of their column """
+    missing = [name for name in COLUMNS if name not in rows.columns]
+    if missing:
+        raise ValueError('Missing columns: {}'.format(', '.join(missing)))
+
+    typed, errors = {}, []
+    for name in COLUMNS:
+        if name == 'date':
+            values = pd.to_datetime(rows[name].astype(str), format=DATE_FORMAT, errors='coerce')
+            invalid = values.isna().to_numpy(copy=True)
+        else:
+            dtype = np.dtype(SCHEMA[name])
+            values = pd.to_numeric(rows[name], errors='coerce')
+            invalid = values.isna().to_numpy(copy=True)
+            if dtype.kind in 'iu':
+                limits = np.iinfo(dtype)
+                invalid |= ( ( values % 1 != 0 ) | ( values < limits.min ) | ( values > limits.max ) ).to_numpy()
+            else:
+                invalid |= ~np.isfinite(values.to_numpy(dtype='float64', na_value=np.nan))
+            values = values.where(~invalid, 0).astype(dtype)
+        if invalid.any():
+            errors.append('{}: {} invalid values (rows {})'.format(
+                name, invalid.sum(), ', '.join(str(row) for row in np.flatnonzero(invalid)[:MAX_REPORTED])))
+        typed[name] = values.to_numpy()
+    if errors:
+        raise ValueError('Invalid delta:\n' + '\n'.join(errors))
+    return pd.DataFrame(typed, columns=COLUMNS)
+
+
+def duplicated( rows, parts ):
+    """ Rows of a delta already stored, or repeated earlier in the delta, by KEY_COLUMNS
+    :param rows: typed delta rows
+    :param parts: HouseDataset of the partitions that can hold the same sales
+    :return: boolean array """
+    keys = pd.MultiIndex.from_arrays([rows[name].to_numpy() for name in KEY_COLUMNS])
+    stored = pd.MultiIndex.from_arrays([np.concatenate([rows[name].to_numpy()[:0]] + [part[name] for part in parts])
+                                        for name in KEY_COLUMNS])
+    return keys.duplicated() | keys.isin(stored)
+
+
+def append_rows( rows, dataset, region=None, region_column=None, store_dir=STORE_DIR ):
+    """ Appends new sales to a dataset of the store, as new partitions
+    :param rows: dataframe read from the delta csv
+    :param dataset: name of a dataset of the store (partitions.add_dataset)
+    :param region: region of every row. Default: the dataset name
+    :param region_column: column of the delta holding the region of each row
+    :param store_dir: store folder
+    :return: catalog entries of the new partitions, number of duplicates dropped """
+    catalog = read_catalog( store_dir )
+    if dataset not in catalog['datasets']:
+        raise ValueError('Unknown dataset {!r}: add it with house_rocket.partitions first'.format(dataset))
+    info = catalog['datasets'][dataset]
+    if region_column and region_column not in rows.columns:
+        raise ValueError('Missing columns: {}'.format(region_column))
+
+    regions = rows[region_column].astype(str) if region_column else pd.Series(region or dataset, index=rows.index)
+    data = validate( rows )
+    regions = regions.to_numpy()
+
+    # a sale already stored is in a partition of its month (any region)
+    months = set(data['date'].dt.strftime('%Y-%m'))
+    parts = [load_partition( os.path.join(store_dir, entry['file']) ) for entry in info['partitions']
+             if entry['month'] in months]
+    repeated = duplicated( data, parts )
+    data = data.loc[~repeated].reset_index(drop=True)
+    if data.empty:
+        return [], int(repeated.sum())
+
+    number = info.get('deltas', 0) + 1
+    entries = write_partitions( data, pd.Series(regions[~repeated]), dataset, store_dir,
+                                suffix='.delta-{:04d}'.format(number) )
+
+    # the files are written before the catalog lists them
+    info['partitions'] = info['partitions'] + entries
+    info['deltas'] = number
+    write_catalog( catalog, store_dir )
+    return entries, int(repeated.sum())
+
+
+def append_delta( path, dataset, region=None, region_column=None, store_dir=STORE_DIR ):
+    """ Appends the sales of a delta csv to a dataset of the store (see append_rows)
+    :param path: csv path
+    :return: catalog entries of the new partitions, number of duplicates dropped """
+    return append_rows( pd.read_csv(path, dtype=str), dataset, region=region, region_column=region_column,
+                        store_dir=store_dir )
+
+
+def cube_columns( cubes=CUBES ):
+    """ Dataset columns read by the cubes ('season' and 'sale_month' come from 'date') """
+    columns = ['zipcode', 'date']
+    for keys, metrics in cubes.values():
+        columns += [name for name in keys + metrics if name not in columns and name not in ('season', 'sale_month')]
+    return columns
+
+
+def build_aggregates( data, cubes=CUBES, relative_accuracy=DEFAULT_ACCURACY ):
+    """ Cubes and descriptive statistics of a dataset, from every row
+    :param data: HouseDataset
+    :param cubes: dict name -> (keys, metrics)
+    :param relative_accuracy: error bound of the sketched medians
+    :return: dict name -> cube, StatsEngine of the numeric columns by zipcode """
+    df = data.frame( columns=cube_columns( cubes ) )
+    built = {name: build_cube( df, by=keys, metrics=metrics ) for name, (keys, metrics) in cubes.items()}
+    return built, StatsEngine( data, data.numeric_columns, by='zipcode', relative_accuracy=relative_accuracy )
+
+
+def fold_aggregates( built, stats, data, start, cubes=CUBES ):
+    """ Aggregates of a dataset whose rows from `start` on were appended since they were built
+    The groups of each cube holding new rows are built again from all their rows, the
+    other groups are kept; the new rows are added to the statistics (StatsEngine.extend).
+    The result is the one of build_aggregates( data ).
+    :param built: dict name -> cube of the rows before start
+    :param stats: StatsEngine of the rows before start
+    :param data: HouseDataset with every row, the new ones from `start` on
+    :param start: number of rows already aggregated
+    :param cubes: dict name -> (keys, metrics)
+    :return: new dict name -> cube, new StatsEngine (the inputs are not modified) """
+    columns = cube_columns( cubes )
+    delta = data.frame( columns=columns, mask=np.arange(start, len(data)) )
+    zipcodes = pd.unique(delta['zipcode'])
+
+    # every cube is keyed by zipcode first: only the rows of the zipcodes with new sales are read
+    df = data.frame( columns=columns, mask=data.isin( 'zipcode', zipcodes ) )
+    folded = {}
+    for name, (keys, metrics) in cubes.items():
+        touched = pd.MultiIndex.from_arrays(cube_keys( delta, keys ))
+        rows = pd.MultiIndex.from_arrays(cube_keys( df, keys )).isin(touched)
+        fresh = build_cube( df.loc[rows], by=keys, metrics=metrics )
+        cube = built[name]
+        folded[name] = pd.concat([cube.loc[~cube.index.isin(fresh.index)], fresh]).sort_index()
+    return folded, stats.extend( data, start )
+
+
+class LiveAggregates:
+    """ Aggregates of a selection of partitions, folded as delta partitions are appended
+    Holds what the sections need for the current partitions of the selection only: the
+    cubes, the statistics, the zipcode FilterIndex, the House Attributes histograms, the
+    map clusters and the price time series are folded (new rows, or the groups and zipcodes
+    they touch), anything else is memoized with cached() until the partitions change. In
+    the dashboard that is the paged table (sort orders over every row), the comparables
+    (KD-tree, a new sale changes the neighbours of the houses around it) and the scenario
+    grid (ranked over every property): they are built again from every row after a delta.
+    A delta replaces the previous version instead of adding a new one next to it, so
+    memory doesn't grow with the number of deltas.
+    :param cubes: dict name -> (keys, metrics) of the cubes
+    :param relative_accuracy: error bound of the sketched medians
+    """
+
+    def __init__( self, cubes=CUBES, relative_accuracy=DEFAULT_ACCURACY ):
+        self.layout = cubes
+        self.relative_accuracy = relative_accuracy
+        self._lock = threading.Lock()
+        self._files = []         # (file, version) of the partitions aggregated, in row order
+        self._rows = 0
+        self._aggregates = None
+        self._cached = {}        # key -> (value, files it depends on or None)
+        self.builds = self.folds = 0
+        self.seconds = 0.0       # time of the last build or fold
+
+    def update( self, data, entries ):
+        """ Aggregates of a selection: the partitions appended since the last call are folded
+        in, any other change (a partition replaced or removed) builds them again
+        :param data: PartitionedDataset of the selection
+        :param entries: catalog entries of its partitions, same order
+        :return: dict with 'cubes' (name -> cube), 'stats' (StatsEngine), 'index' (FilterIndex),
+                 'histograms' (name -> histogram), 'clusters' (ClusterLevels) and 'series' (period ->
+                 TimeSeriesStore), never modified afterwards """
+        files = [(entry['file'], entry['version']) for entry in entries]
+        with self._lock:
+            start = time.perf_counter()
+            if self._aggregates is None or files[:len(self._files)] != self._files:
+                cubes, stats = build_aggregates( data, self.layout, self.relative_accuracy )
+                self._aggregates = {'cubes': cubes, 'stats': stats,
+                                    'index': FilterIndex( data, member_columns=['zipcode'] ),
+                                    'histograms': build_histograms( data ),
+                                    'clusters': cluster_levels( data['lat'], data['long'], price=data['price'] ),
+                                    'series': build_series( cubes )}
+                self.builds += 1
+            elif len(files) > len(self._files):
+                previous, rows = self._aggregates, slice(self._rows, len(data))
+                cubes, stats = fold_aggregates( previous['cubes'], previous['stats'], data, self._rows, self.layout )
+                self._aggregates = {'cubes': cubes, 'stats': stats,
+                                    'index': previous['index'].extend( data ),
+                                    'histograms': extend_histograms( previous['histograms'], data, self._rows ),
+                                    'clusters': previous['clusters'].extend( data.column( 'lat', rows ),
+                                                                             data.column( 'long', rows ),
+                                                                             data.column( 'price', rows ) ),
+                                    'series': fold_series( previous['series'], cubes,
+                                                           pd.unique(data.column( 'zipcode', rows )) )}
+                self.folds += 1
+            else:
+                return self._aggregates
+            self.seconds = time.perf_counter() - start
+            self._files, self._rows = files, len(data)
+            # the memoized values of the previous partitions are dropped, except the ones of partitions still selected
+            self._cached = {key: (value, depends) for key, (value, depends) in self._cached.items()
+                            if depends is not None and set(depends) <= set(files)}
+            return self._aggregates
+
+    def cached( self, key, build, files=None ):
+        """ Value memoized for the current partitions of the selection
+        :param key: hashable key
+        :param build: function computing the value
+        :param files: (file, version) of the partitions the value depends on: it is kept while they are
+                      selected. Default: every partition, the value is dropped when they change
+        :return: value """
+        with self._lock:
+            if key in self._cached:
+                return self._cached[key][0]
+            current = self._files
+        value = build()
+        with self._lock:
+            # not kept when the partitions changed while it was built
+            if self._files is current or ( files is not None and set(files) <= set(self._files) ):
+                self._cached[key] = (value, None if files is None else list(files))
+        return value
+
+    def stats( self ):
+        """ Counters of the aggregates, for the profile panel """
+        return {'rows': self._rows, 'partitions': len(self._files), 'builds': self.builds, 'folds': self.folds,
+                'cached': len(self._cached), 'seconds': round(self.seconds, 4)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Appends new sales to a dataset of the partitioned store')
+    parser.add_argument('path')
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--region', help='region of every row (default: the dataset name)')
+    parser.add_argument('--region-column', help='column of the csv with the region of each row')
+    parser.add_argument('--store', default=STORE_DIR)
+    args = parser.parse_args()
+    try:
+        parts, dropped = append_delta( args.path, args.dataset, region=args.region,
+                                       region_column=args.region_column, store_dir=args.store )
+    except ValueError as e:
+        sys.exit('{}: {}'.format(args.path, e))
+    print('{}: {} partitions added, {:,} rows ({:,} duplicates dropped)'.format(
+        args.dataset, len(parts), sum(p['rows'] for p in parts), dropped))
@@ -0,0 +1,103 @@
+""" Indexed evaluation of the sidebar filters.
+
+FilterIndex is built once per dataset version. Membership columns (zipcode) keep one
+bitmap per distinct value, so `column in values` is an OR of a few bitmaps instead of a
+scan of the column.
+
+Results are packed bitmaps (1 bit per row, np.packbits), cached by filter (column,
+values): when another widget changes, the zipcode filter is served from the cache.
+
+Rows appended to the dataset (house_rocket.delta) are folded in with extend(): only the
+new rows are indexed, and the bitmaps are the ones a build over every row gives.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FilterIndex:
+    """ Bitmap indexes over the membership filter columns
+    :param data: HouseDataset (or dict of arrays)
+    :param member_columns: low-cardinality columns filtered by membership
+    :param cache_size: number of filter results kept (LRU)
+    """
+
+    def __init__( self, data, member_columns=(), cache_size=256 ):
+        self.size = len(data['id'])
+        self._bitmaps = {}
+        for name in member_columns:
+            values, inverse = np.unique(data[name], return_inverse=True)
+            inverse = inverse.ravel()
+            self._bitmaps[name] = {value.item(): np.packbits(inverse == i) for i, value in enumerate(values)}
+        self._cache_size = cache_size
+        self._clear()
+
+    def extend( self, data ):
+        """ Index of the dataset after rows were appended to it, from the new rows only
+        :param data: dataset with every row, the new ones after the `size` rows indexed here
+        :return: new FilterIndex, with an empty result cache (this one is not modified) """
+        index = copy.copy(self)
+        index.size = len(data['id'])
+        index._bitmaps = {}
+        for name, bitmaps in self._bitmaps.items():
+            new = np.asarray(data[name][self.size:])
+            values = set(bitmaps) | {value.item() for value in np.unique(new)}
+            index._bitmaps[name] = {value: np.packbits(np.concatenate([
+                np.unpackbits(bitmaps[value], count=self.size) if value in bitmaps else np.zeros(self.size, dtype='uint8'),
+                new == value])) for value in sorted(values)}
+        index._clear()
+        return index
+
+    # Bitmaps ---------------------------------------------------------------
+    def all( self ):
+        """ Bitmap with every row """
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    def none( self ):
+        """ Bitmap without rows """
+        return np.zeros(( self.size + 7 ) // 8, dtype='uint8')
+
+    def rows( self, bitmap ):
+        """ Sorted row positions of a bitmap """
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.size))
+
+    # Filters ---------------------------------------------------------------
+    def member( self, name, values ):
+        """ Rows where the column is one of values, from the bitmap index
+        :param name: membership column
+        :param values: accepted values; empty accepts every row
+        :return: bitmap """
+        values = (values,) if np.ndim(values) == 0 else tuple(sorted(values))
+        return self._cached( (name, 'in', values), lambda: self._member( name, values ) )
+
+    # Internals -------------------------------------------------------------
+    def _clear( self ):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _member( self, name, values ):
+        if not values:
+            return self.all()
+        bitmaps = self._bitmaps[name]
+        selected = [bitmaps[v] for v in values if v in bitmaps]
+        return np.bitwise_or.reduce(selected) if selected else self.none()
+
+    def _cached( self, key, compute ):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        bitmap = compute()
+        bitmap.flags.writeable = False
+        with self._lock:
+            self._cache[key] = bitmap
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return bitmap
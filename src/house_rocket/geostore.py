@@ -0,0 +1,149 @@
+""" Local store of the zipcode polygons used by the Price Density map.
+
+The zipcode GeoJSON is fetched (or imported from a local file) once, saved under
+STORE_DIR and pre-simplified at several tolerances. Each level is saved as a JSON
+index ZIP -> GeoJSON feature, so the choropleth only pulls the polygons of the
+zipcodes it shows, and the dashboard starts offline, without geopandas, once the
+store exists. Build it ahead of time (Procfile) with:
+
+    python -m house_rocket.geostore [--source local_file.geojson]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import urllib.request
+
+GEOFILE_URL = 'https://opendata.arcgis.com/datasets/83fc2e72903343aabff6de8cb445b81c_2.geojson'
+STORE_DIR = 'geo_cache'
+
+# Bump when the store layout changes, to rebuild existing stores
+STORE_VERSION = 1
+
+# Simplification tolerances, in degrees (0.001 ~ 100 m); 0 keeps the original polygons
+TOLERANCES = (0.0, 0.0005, 0.001, 0.005)
+DEFAULT_TOLERANCE = 0.001
+
+ZIP_KEY = 'ZIP'
+
+
+def store_path( url, store_dir=STORE_DIR ):
+    """ Folder of the store of one geofile url
+    :param url: geofile url
+    :param store_dir: root folder of the stores
+    :return: folder path """
+    return os.path.join(store_dir, hashlib.sha1(url.encode()).hexdigest()[:12])
+
+
+def level_path( path, tolerance ):
+    return os.path.join(path, 'zip_{:g}.json'.format(tolerance))
+
+
+def read_manifest( path ):
+    """ Manifest of a store, or None when it doesn't exist or is outdated
+    :param path: store folder
+    :return: dict or None """
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == STORE_VERSION else None
+
+
+def write_json( obj, path ):
+    """ Writes json to a temporary file and renames it, so readers never see a partial file """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def build_store( url=GEOFILE_URL, source=None, store_dir=STORE_DIR, tolerances=TOLERANCES ):
+    """ Fetches (or imports) the geofile and writes the simplified levels
+    :param url: geofile url, also the store identity
+    :param source: local file to import instead of downloading url
+    :param store_dir: root folder of the stores
+    :param tolerances: simplification tolerances (degrees)
+    :return: store folder """
+    import geopandas # only needed to build the store
+
+    path = store_path( url, store_dir )
+    os.makedirs(path, exist_ok=True)
+
+    raw = os.path.join(path, 'source.geojson')
+    tmp = '{}.{}.tmp'.format(raw, os.getpid())
+    if source is not None:
+        shutil.copyfile(source, tmp)
+    else:
+        urllib.request.urlretrieve(url, tmp)
+    os.replace(tmp, raw)
+
+    geofile = geopandas.read_file( raw )[[ZIP_KEY, 'geometry']]
+    for tolerance in tolerances:
+        level = geofile.copy()
+        if tolerance:
+            level['geometry'] = level.geometry.simplify(tolerance, preserve_topology=True)
+        features = json.loads(level.to_json())['features']
+        write_json({str(f['properties'][ZIP_KEY]): f for f in features}, level_path( path, tolerance ))
+
+    with open(raw, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    write_json({'version': STORE_VERSION,
+                'url': url,
+                'source_sha256': sha256,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'tolerances': list(tolerances),
+                'zipcodes': len(geofile)}, os.path.join(path, 'manifest.json'))
+    return path
+
+
+def load_geometries( url=GEOFILE_URL, tolerance=DEFAULT_TOLERANCE, store_dir=STORE_DIR ):
+    """ Zipcode polygons simplified at one tolerance, building the store if needed
+    :param url: geofile url
+    :param tolerance: one of the store tolerances
+    :param store_dir: root folder of the stores
+    :return: dict ZIP (str) -> GeoJSON feature """
+    path = store_path( url, store_dir )
+    manifest = read_manifest( path )
+    if manifest is None or tolerance not in manifest['tolerances']:
+        build_store( url, store_dir=store_dir, tolerances=sorted(set(TOLERANCES) | {tolerance}) )
+
+    with open(level_path( path, tolerance )) as f:
+        return json.load(f)
+
+
+def geometries_version( url=GEOFILE_URL, tolerance=DEFAULT_TOLERANCE, store_dir=STORE_DIR ):
+    """ Identity of the polygons returned by load_geometries (e.g. a render cache key)
+    :param url: geofile url
+    :param tolerance: one of the store tolerances
+    :param store_dir: root folder of the stores
+    :return: string: store folder, sha256 of the source and tolerance """
+    path = store_path( url, store_dir )
+    manifest = read_manifest( path ) or {}
+    return '{}:{}:{:g}'.format(path, manifest.get('source_sha256'), tolerance)
+
+
+def feature_collection( geometries, zipcodes ):
+    """ GeoJSON with only the polygons of the given zipcodes
+    :param geometries: dict from load_geometries
+    :param zipcodes: zipcodes to keep
+    :return: GeoJSON FeatureCollection (dict) """
+    features = [geometries[str(z)] for z in zipcodes if str(z) in geometries]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the local zipcode geometry store')
+    parser.add_argument('--url', default=GEOFILE_URL)
+    parser.add_argument('--source', help='local geojson to import instead of downloading the url')
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    args = parser.parse_args()
+
+    path = store_path( args.url, args.store_dir )
+    if args.source is None and read_manifest( path ) is not None:
+        print('{}: up to date'.format(path))
+    else:
+        print('{}: built'.format(build_store( args.url, source=args.source, store_dir=args.store_dir )))
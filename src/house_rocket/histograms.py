@@ -0,0 +1,136 @@
+""" Server-side histograms for the House Attributes charts.
+
+Histograms are built once per dataset version from the column arrays and keep
+cumulative counts (prefix sums), so a "Max ..." threshold is answered with a few
+binary searches and array slices, whatever the number of rows. Only bin edges and
+counts are sent to the browser.
+
+- ContinuousHistogram (price): cumulative counts on a fine grid; the chart bins are
+  snapped to that grid and re-aggregated to ~nbins bins over [min, threshold].
+- DiscreteHistogram (bedrooms, bathrooms, floors, waterfront): one bin per distinct value.
+
+Rows appended to the dataset (house_rocket.delta) are folded in with extend(), which
+gives the histogram of a build over every row.
+"""
+import copy
+
+import numpy as np
+
+
+class ContinuousHistogram:
+    """ Prefix-sum histogram of a continuous column
+    :param values: column array
+    :param resolution: number of fine bins of the cumulative grid
+    """
+
+    def __init__( self, values, resolution=4096 ):
+        self.resolution = resolution
+        self._set( np.sort(np.asarray(values, dtype='float64')) )
+
+    def extend( self, values ):
+        """ Histogram with new values added (merged into the sorted values)
+        :param values: new values
+        :return: new ContinuousHistogram (this one is not modified) """
+        new = np.sort(np.asarray(values, dtype='float64'))
+        histogram = copy.copy(self)
+        histogram._set( np.insert(self._sorted, np.searchsorted(self._sorted, new, side='right'), new) )
+        return histogram
+
+    def _set( self, values ):
+        self._sorted = values
+        self.min = self._sorted[0]
+        self.max = self._sorted[-1]
+        self.edges = np.linspace(self.min, self.max, self.resolution + 1)
+        # cumulative[i] = number of values < edges[i]
+        self.cumulative = np.searchsorted(self._sorted, self.edges, side='left')
+
+    def __len__( self ):
+        return len(self._sorted)
+
+    def count_upto( self, threshold ):
+        """ Number of values <= threshold """
+        return int(np.searchsorted(self._sorted, threshold, side='right'))
+
+    def bins( self, nbins=50, upto=None ):
+        """ Histogram of the values <= upto, with about nbins bins over [min, upto]
+        :param nbins: number of bins
+        :param upto: threshold (inclusive). Default: max
+        :return: edges (nbins + 1) and counts (nbins) arrays """
+        upto = self.max if upto is None else min(upto, self.max)
+        if upto < self.min:
+            return np.array([self.min]), np.array([], dtype='int64')
+
+        # chart edges snapped to the fine grid, the last one is the threshold itself
+        target = np.linspace(self.min, upto, nbins + 1)[:-1]
+        idx = np.unique(np.searchsorted(self.edges, target, side='right') - 1)
+        edges = np.append(self.edges[idx], upto)
+        cumulative = np.append(self.cumulative[idx], self.count_upto( upto ))
+        return edges, np.diff(cumulative)
+
+
+class DiscreteHistogram:
+    """ Histogram of a low-cardinality column, one bin per value
+    :param values: column array
+    """
+
+    def __init__( self, values ):
+        self.values, counts = np.unique(np.asarray(values), return_counts=True)
+        self.cumulative = np.concatenate([[0], np.cumsum(counts)])
+
+    def extend( self, values ):
+        """ Histogram with new values added
+        :param values: new values
+        :return: new DiscreteHistogram (this one is not modified) """
+        new, new_counts = np.unique(np.asarray(values), return_counts=True)
+        histogram = copy.copy(self)
+        histogram.values = np.union1d(self.values, new)
+        counts = np.zeros(len(histogram.values), dtype=self.cumulative.dtype)
+        counts[np.searchsorted(histogram.values, self.values)] += self.counts
+        counts[np.searchsorted(histogram.values, new)] += new_counts
+        histogram.cumulative = np.concatenate([[0], np.cumsum(counts)])
+        return histogram
+
+    def __len__( self ):
+        return int(self.cumulative[-1])
+
+    @property
+    def counts( self ):
+        return np.diff(self.cumulative)
+
+    def count_upto( self, threshold ):
+        """ Number of values <= threshold """
+        return int(self.cumulative[np.searchsorted(self.values, threshold, side='right')])
+
+    def bins( self, upto=None, only=None ):
+        """ Counts of the values <= upto, or of the `only` values
+        :param upto: threshold (inclusive). Default: all values
+        :param only: values to keep (e.g. [1] for waterfront)
+        :return: values and counts arrays """
+        end = len(self.values) if upto is None else np.searchsorted(self.values, upto, side='right')
+        values, counts = self.values[:end], self.counts[:end]
+        if only is not None:
+            keep = np.isin(values, only)
+            values, counts = values[keep], counts[keep]
+        return values, counts
+
+
+# House Attributes columns and their histogram
+HISTOGRAMS = {'price': ContinuousHistogram, 'bedrooms': DiscreteHistogram, 'bathrooms': DiscreteHistogram,
+              'floors': DiscreteHistogram, 'waterfront': DiscreteHistogram}
+
+
+def build_histograms( data ):
+    """ Histograms of the House Attributes columns
+    :param data: HouseDataset
+    :return: dict column -> ContinuousHistogram / DiscreteHistogram """
+    return {name: histogram( data[name] ) for name, histogram in HISTOGRAMS.items()}
+
+
+def extend_histograms( histograms, data, start ):
+    """ Histograms of a dataset whose rows from `start` on were appended since they were built
+    :param histograms: dict from build_histograms, of the rows before start
+    :param data: HouseDataset with every row
+    :param start: number of rows already counted
+    :return: new dict (the inputs are not modified) """
+    rows = slice(start, len(data))
+    return {name: histogram.extend( data.column( name, rows ) ) for name, histogram in histograms.items()}
@@ -0,0 +1,239 @@
+""" Columnar cache of the house sales csv.
+
+The csv is parsed once into a typed Feather (Arrow IPC) file next to it, e.g.
+kc_house_data.csv -> kc_house_data.feather. The file is written uncompressed, so it can
+be memory-mapped: every worker process reads the same pages from the OS cache instead of
+parsing the csv again.
+
+The columns are stored in their compact encodings (house_rocket.compact: small integer
+codes, the encoding parameters in the schema metadata), each one contiguous Arrow buffer,
+so load_compact() gives numpy views of the mapped file: every Streamlit process attaches
+the same physical pages instead of holding a copy. The derived columns (m2_lot,
+price_m2) are computed when read. load_arrays() and load_dataset() decode the columns.
+
+The cache stores the size, mtime and sha256 of the csv it came from, and is rebuilt when
+the csv changes. It can be built ahead of time (Procfile) with:
+
+    python -m house_rocket.ingest kc_house_data.csv
+"""
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from house_rocket.compact import DERIVED, DERIVED_SOURCES, compact, decode
+from house_rocket.dataset import set_feature
+
+# Bump when SCHEMA, the encodings or the parsing changes, to invalidate existing cache files
+SCHEMA_VERSION = '3'
+
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+
+# dtype of each column of kc_house_data.csv ('date' is parsed to datetime64[ns])
+SCHEMA = {
+    'id': 'int64',
+    'price': 'float64',
+    'bedrooms': 'uint8',
+    'bathrooms': 'float64',
+    'sqft_living': 'int32',
+    'sqft_lot': 'int32',
+    'floors': 'float64',
+    'waterfront': 'uint8',
+    'view': 'uint8',
+    'condition': 'uint8',
+    'grade': 'uint8',
+    'sqft_above': 'int32',
+    'sqft_basement': 'int32',
+    'yr_built': 'int16',
+    'yr_renovated': 'int16',
+    'zipcode': 'int32',
+    'lat': 'float64',
+    'long': 'float64',
+    'sqft_living15': 'int32',
+    'sqft_lot15': 'int32',
+}
+
+# Columns of kc_house_data.csv, in file order
+COLUMNS = ['id', 'date'] + [name for name in SCHEMA if name != 'id']
+
+
+def cache_path( path ):
+    """ Path of the columnar cache of a csv file
+    :param path: csv path
+    :return: path with .feather extension """
+    return os.path.splitext(path)[0] + '.feather'
+
+
+def file_sha256( path, block_size=1 << 20 ):
+    """ sha256 hex digest of a file, read in blocks
+    :param path: file path
+    :param block_size: bytes read at a time
+    :return: hex digest """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_csv( path, **kwargs ):
+    """ Reads the house sales csv with the typed schema
+    :param path: csv path
+    :param kwargs: extra pd.read_csv arguments
+    :return: dataframe with SCHEMA dtypes and datetime 'date' """
+    return parse_dates( pd.read_csv(path, dtype={**SCHEMA, 'date': str}, **kwargs) )
+
+
+def parse_dates( data ):
+    """ Converts the csv 'date' strings (20141013T000000) to datetime64
+    :param data: dataset read from the csv
+    :return: same dataset, 'date' as datetime """
+    data['date'] = pd.to_datetime(data['date'], format=DATE_FORMAT)
+    return data
+
+
+def source_metadata( path, sha256=None ):
+    """ Identifies the version of a csv: size, mtime and sha256
+    :param path: csv path
+    :param sha256: digest, when already known
+    :return: dict of bytes, as stored on the Arrow schema metadata """
+    stat = os.stat(path)
+    return {b'schema_version': SCHEMA_VERSION.encode(),
+            b'source_size': str(stat.st_size).encode(),
+            b'source_mtime_ns': str(stat.st_mtime_ns).encode(),
+            b'source_sha256': (sha256 or file_sha256(path)).encode()}
+
+
+def cached_metadata( cache ):
+    """ Metadata stored on a cache file, or None when it does not exist / can't be read
+    :param cache: feather path
+    :return: dict of bytes or None """
+    try:
+        return pa.ipc.open_file(pa.memory_map(cache)).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def is_fresh( path, cache ):
+    """ Checks if the cache was built from the current csv
+    Size and mtime are checked first; the sha256 is only computed when they differ
+    (e.g. the file was touched or copied), so unchanged files are never hashed.
+    :param path: csv path
+    :param cache: feather path
+    :return: True if the cache can be used """
+    meta = cached_metadata( cache )
+    if not meta or meta.get(b'schema_version') != SCHEMA_VERSION.encode():
+        return False
+
+    stat = os.stat(path)
+    if meta.get(b'source_size') != str(stat.st_size).encode():
+        return False
+    if meta.get(b'source_mtime_ns') == str(stat.st_mtime_ns).encode():
+        return True
+    return meta.get(b'source_sha256') == file_sha256(path).encode()
+
+
+def build_cache( path, cache=None ):
+    """ Converts the csv to the compact, uncompressed feather file
+    :param path: csv path
+    :param cache: feather path. Default: cache_path(path)
+    :return: feather path """
+    cache = cache or cache_path( path )
+    return write_compact( read_csv( path ), cache, source_metadata( path ) )
+
+
+def write_compact( data, cache, metadata=None ):
+    """ Writes a dataset in its compact encodings to an uncompressed feather file
+    The file is written to a temporary name and renamed, so workers never read a
+    partial file.
+    :param data: dataframe with SCHEMA dtypes
+    :param cache: feather path
+    :param metadata: dict of bytes stored on the schema
+    :return: feather path """
+    arrays, encodings = compact( data )
+    table = pa.table(arrays)
+    table = table.replace_schema_metadata({**(metadata or {}), b'encodings': json.dumps(encodings).encode()})
+
+    # a single record batch: each column is one buffer, mapped without copies by read_compact
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    feather.write_feather(table, tmp, compression='uncompressed', chunksize=max(len(table), 1))
+    os.replace(tmp, cache)
+    return cache
+
+
+def load_compact( path, columns=None ):
+    """ Zero-copy codes of the house sales dataset, building the cache if needed
+    Each array is a read-only view of the memory-mapped feather file: the pages are
+    shared by every process that maps the file (OS page cache), nothing is copied.
+    :param path: csv path
+    :param columns: stored columns to read. Default: all
+    :return: dict column -> read-only codes array, dict column -> encoding parameters
+             (HouseDataset( *load_compact( path ) )) """
+    cache = cache_path( path )
+    if not is_fresh( path, cache ):
+        build_cache( path, cache )
+    return read_compact( cache, columns )
+
+
+def read_compact( cache, columns=None ):
+    """ Zero-copy codes of a feather file written by write_compact
+    :param cache: feather path
+    :param columns: stored columns to read. Default: all
+    :return: dict column -> read-only codes array, dict column -> encoding parameters """
+    table = feather.read_table(cache, columns=columns, memory_map=True)
+    encodings = json.loads(table.schema.metadata[b'encodings'])
+    arrays = {}
+    for name, column in zip(table.column_names, table.columns):
+        # write_compact writes one chunk: a view of the mapped buffer (only strings are copied)
+        chunk = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        arrays[name] = chunk.to_numpy(zero_copy_only=pa.types.is_primitive(chunk.type))
+    return arrays, {name: encodings[name] for name in arrays}
+
+
+def load_arrays( path, columns=None ):
+    """ Decoded columns of the house sales dataset, building the cache if needed
+    :param path: csv path
+    :param columns: columns to read, derived ones included. Default: all
+    :return: dict column -> numpy array with SCHEMA dtypes (one private copy per call) """
+    stored = None
+    if columns is not None:
+        stored = [name for name in columns if name not in DERIVED]
+        if len(stored) < len(columns):
+            stored += [name for name in DERIVED_SOURCES if name not in stored]
+    codes, encodings = load_compact( path, stored )
+    arrays = {name: decode( values, encodings[name] ) for name, values in codes.items()}
+    wanted = list(arrays) + list(DERIVED) if columns is None else list(columns)
+    if any(name in DERIVED for name in wanted):
+        derived = set_feature( pd.DataFrame({name: arrays[name] for name in DERIVED_SOURCES}) )
+        arrays.update({name: derived[name].to_numpy() for name in DERIVED})
+    return {name: arrays[name] for name in wanted}
+
+
+def load_dataset( path, columns=None ):
+    """ Loads the house sales dataset from its columnar cache, building it if needed
+    :param path: csv path
+    :param columns: columns to read, derived ones included. Default: all
+    :return: dataframe with SCHEMA dtypes """
+    return pd.DataFrame(load_arrays( path, columns ))
+
+
+def dataset_version( path ):
+    """ sha256 of the csv the current cache was built from, used as cache key
+    :param path: csv path
+    :return: hex digest """
+    cache = cache_path( path )
+    if not is_fresh( path, cache ):
+        build_cache( path, cache )
+    return cached_metadata( cache )[b'source_sha256'].decode()
+
+
+if __name__ == '__main__':
+    for csv in sys.argv[1:] or ['kc_house_data.csv']:
+        if is_fresh( csv, cache_path( csv ) ):
+            print('{}: up to date'.format(cache_path( csv )))
+        else:
+            print('{}: built'.format(build_cache( csv )))
@@ -0,0 +1,209 @@
+""" Per-section instrumentation of a dashboard rerun.
+
+MemoryReport measures, with tracemalloc, the bytes allocated by each section of the
+script (numpy and pandas buffers included). It is opt-in, since tracing slows the
+rerun down:
+
+    HOUSE_ROCKET_MEMORY_REPORT=1 streamlit run house_rocket_real_state.py
+
+tracemalloc is global to the process: the traced sections of all sessions run one at a
+time (a lock), and the numbers include whatever other threads allocate meanwhile (the
+prefetch jobs, HOUSE_ROCKET_PREFETCH=0 turns them off). Meant for one session at a time.
+
+RerunProfile records, for each section, wall time, CPU time and rows processed, and for
+each chart, map or table the bytes sent to the browser. It is opt-in too (measuring a
+payload serializes it once more):
+
+    HOUSE_ROCKET_PROFILE=1               debug panel at the bottom of the page
+    HOUSE_ROCKET_PROFILE_LOG=profile.log one JSON line per rerun appended to the file
+    HOUSE_ROCKET_PROFILE_DUMP=profiles   one cProfile dump per rerun in the folder
+                                         (python -m pstats profiles/<file>.prof)
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# One traced section at a time in the process (tracemalloc start / stop are global)
+_TRACE_LOCK = threading.Lock()
+
+
+class MemoryReport:
+    """ Peak and retained bytes allocated by each section of a rerun
+    :param enabled: trace allocations. Default: HOUSE_ROCKET_MEMORY_REPORT=1
+    """
+
+    def __init__( self, enabled=None ):
+        if enabled is None:
+            enabled = os.environ.get('HOUSE_ROCKET_MEMORY_REPORT') == '1'
+        self.enabled = enabled
+        self.sections = []
+
+    @contextmanager
+    def track( self, section ):
+        """ Measures the allocations of the code run inside the block
+        Tracing is restarted for each section, so the peak is relative to the
+        memory in use when the section starts. The sections of other sessions wait
+        for this one to finish.
+        :param section: name shown on the report """
+        if not self.enabled:
+            yield
+            return
+
+        with _TRACE_LOCK:
+            # tracing started outside the report (python -X tracemalloc) is left running,
+            # the section is measured from the memory traced when it starts
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                if started:
+                    tracemalloc.stop()
+                self.sections.append({'section': section, 'peak_bytes': max(peak - base, 0),
+                                      'retained_bytes': current - base})
+
+    def to_frame( self ):
+        """ Report as a dataframe, one row per section """
+        return pd.DataFrame(self.sections, columns=['section', 'peak_bytes', 'retained_bytes'])
+
+
+def payload_bytes( obj ):
+    """ Size of what the browser receives for a chart, map or table
+    - plotly figure: the figure JSON
+    - folium map: the rendered HTML page
+    - dataframe: the Arrow IPC stream (streamlit's dataframe serialization)
+    :param obj: element passed to streamlit
+    :return: bytes """
+    if hasattr(obj, 'to_plotly_json'):
+        return len(obj.to_json())
+    if hasattr(obj, 'get_root'):
+        return len(obj.get_root().render().encode())
+    if isinstance(obj, pd.DataFrame):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(obj)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().size
+    return len(str(obj).encode())
+
+
+class RerunProfile:
+    """ Wall time, CPU time, rows and payload bytes of the sections of one rerun
+    :param panel: show the debug panel. Default: HOUSE_ROCKET_PROFILE=1
+    :param log_path: JSON lines file. Default: HOUSE_ROCKET_PROFILE_LOG
+    :param dump_dir: cProfile dumps folder. Default: HOUSE_ROCKET_PROFILE_DUMP
+    """
+
+    def __init__( self, panel=None, log_path=None, dump_dir=None ):
+        if panel is None:
+            panel = os.environ.get('HOUSE_ROCKET_PROFILE') == '1'
+        self.panel = panel
+        self.log_path = log_path or os.environ.get('HOUSE_ROCKET_PROFILE_LOG')
+        self.dump_dir = dump_dir or os.environ.get('HOUSE_ROCKET_PROFILE_DUMP')
+        self.enabled = bool(self.panel or self.log_path or self.dump_dir)
+
+        self.sections = []
+        self.elements = []
+        self._current = None
+        self._profiler = None
+        self._started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def start( self ):
+        """ Starts the rerun clock, and cProfile when a dump folder is set """
+        self._started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self.dump_dir:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def section( self, section ):
+        """ Measures the code run inside the block
+        :param section: name shown on the report """
+        if not self.enabled:
+            yield
+            return
+
+        record = {'section': section, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0, 'payload_bytes': 0}
+        self._current = record
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            # payload() already took its measuring time off wall_s / cpu_s
+            record['wall_s'] += time.perf_counter() - wall
+            record['cpu_s'] += time.process_time() - cpu
+            self._current = None
+            self.sections.append(record)
+
+    def rows( self, count ):
+        """ Adds rows processed by the current section """
+        if self.enabled and self._current is not None:
+            self._current['rows'] += int(count)
+
+    def payload( self, element, obj ):
+        """ Records the bytes sent to the browser by a chart, map or table
+        :param element: name shown on the report
+        :param obj: plotly figure, folium map or dataframe """
+        if not self.enabled:
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        size = payload_bytes( obj )
+        section = None
+        if self._current is not None:
+            # measuring is not part of the section time
+            self._current['wall_s'] -= time.perf_counter() - wall
+            self._current['cpu_s'] -= time.process_time() - cpu
+            self._current['payload_bytes'] += size
+            section = self._current['section']
+        self.elements.append({'section': section, 'element': element,
+                              'kind': type(obj).__name__, 'payload_bytes': size})
+
+    def to_frame( self ):
+        """ Report as a dataframe, one row per section """
+        return pd.DataFrame(self.sections, columns=['section', 'wall_s', 'cpu_s', 'rows', 'payload_bytes'])
+
+    def elements_frame( self ):
+        """ Payloads as a dataframe, one row per chart, map or table """
+        return pd.DataFrame(self.elements, columns=['section', 'element', 'kind', 'payload_bytes'])
+
+    def to_dict( self ):
+        """ Report of the rerun, JSON serializable """
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._started)),
+                'pid': os.getpid(),
+                'wall_s': time.perf_counter() - self._wall,
+                'cpu_s': time.process_time() - self._cpu,
+                'sections': self.sections,
+                'elements': self.elements}
+
+    def finish( self ):
+        """ Stops cProfile and writes the dump and the log line
+        :return: report of the rerun (dict) """
+        report = self.to_dict()
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(self.dump_dir, exist_ok=True)
+            path = os.path.join(self.dump_dir, 'rerun-{}-{}.prof'.format(
+                time.strftime('%Y%m%dT%H%M%S', time.localtime(self._started)), os.getpid()))
+            self._profiler.dump_stats(path)
+            self._profiler = None
+            report['profile_dump'] = path
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(report) + '\n')
+        return report
@@ -0,0 +1,326 @@
+""" Partitioned store of several house sales datasets (markets).
+
+Each dataset added to the store is split by region (a county column of the csv, or one
+region per file) and by sale month, and each partition is written in the compact
+encodings of house_rocket.compact to its own feather file:
+
+    house_store/catalog.json
+    house_store/<dataset>/<region>/<YYYY-MM>.feather
+    house_store/<dataset>/<region>/<YYYY-MM>.delta-0001.feather   (new sales, house_rocket.delta)
+
+The catalog lists the partitions of every dataset with their number of rows, the
+min / max of a few columns (date, price, yr_built, lat, long) and their zipcodes, and
+a version (sha256 of the file). Queries are pruned on the catalog alone: a zipcode or
+date filter only opens the partitions whose zipcodes / date range can match.
+
+A partition is memory-mapped zero-copy (load_partition) and cached on its own, so
+switching between datasets or regions only loads the partitions not seen yet.
+PartitionedDataset reads the partitions of a selection as one HouseDataset without
+copying them, and keeps the row range of each partition, so where() scans only the
+partitions a date filter can't rule out. Zipcode filters go through the bitmaps of
+house_rocket.filters: every sale month holds most zipcodes, the catalog can't prune them.
+
+    python -m house_rocket.partitions kc_house_data.csv --dataset king-county --region king
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.dataset import HouseDataset, read_only
+from house_rocket.geostore import GEOFILE_URL
+from house_rocket.ingest import COLUMNS, file_sha256, read_compact, read_csv, write_compact
+
+STORE_DIR = 'house_store'
+
+# Bump when the store layout changes, to rebuild existing stores
+STORE_VERSION = 1
+
+# Columns with min / max statistics in the catalog
+STAT_COLUMNS = ('date', 'price', 'yr_built', 'lat', 'long')
+
+CATALOG_FILE = 'catalog.json'
+
+
+def catalog_path( store_dir=STORE_DIR ):
+    """ Path of the catalog of a store """
+    return os.path.join(store_dir, CATALOG_FILE)
+
+
+def read_catalog( store_dir=STORE_DIR ):
+    """ Catalog of a store; an empty catalog when the store doesn't exist or is outdated
+    :param store_dir: store folder
+    :return: dict with 'datasets': name -> {'geofile', 'source_sha256', 'partitions'} """
+    try:
+        with open(catalog_path( store_dir ), encoding='utf-8') as f:
+            catalog = json.load(f)
+    except (OSError, ValueError):
+        catalog = {}
+    if catalog.get('store_version') != STORE_VERSION:
+        catalog = {'store_version': STORE_VERSION, 'datasets': {}}
+    return catalog
+
+
+def write_catalog( catalog, store_dir=STORE_DIR ):
+    """ Writes the catalog to a temporary file and renames it """
+    os.makedirs(store_dir, exist_ok=True)
+    path = catalog_path( store_dir )
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, indent=1)
+    os.replace(tmp, path)
+
+
+def statistics( part ):
+    """ Catalog statistics of a partition: min / max of STAT_COLUMNS and the zipcodes """
+    low, high = {}, {}
+    for name in STAT_COLUMNS:
+        if name == 'date':
+            low[name], high[name] = str(part[name].min().date()), str(part[name].max().date())
+        else:
+            low[name], high[name] = part[name].min().item(), part[name].max().item()
+    return {'min': low, 'max': high, 'zipcodes': sorted(part['zipcode'].unique().tolist())}
+
+
+def write_partitions( data, regions, dataset, store_dir=STORE_DIR, suffix='' ):
+    """ Writes the rows of a dataset by region and sale month, one feather file per partition
+    :param data: dataframe with SCHEMA dtypes
+    :param regions: region of each row (Series aligned with data)
+    :param dataset: name of the dataset
+    :param store_dir: store folder
+    :param suffix: added to the file names (<month><suffix>.feather), e.g. the number of a delta
+    :return: catalog entries of the partitions written """
+    months = data['date'].dt.strftime('%Y-%m')
+    entries = []
+    for (name, month), rows in data.groupby([regions, months], sort=True).indices.items():
+        part = data.iloc[rows].reset_index(drop=True)
+        file = os.path.join(dataset, name, month + suffix + '.feather')
+        os.makedirs(os.path.join(store_dir, dataset, name), exist_ok=True)
+        write_compact( part, os.path.join(store_dir, file) )
+        entries.append({'region': name, 'month': month, 'file': file, 'rows': len(part),
+                        'version': file_sha256( os.path.join(store_dir, file) ), **statistics( part )})
+    return entries
+
+
+def add_dataset( path, dataset, region=None, region_column=None, geofile=GEOFILE_URL, store_dir=STORE_DIR ):
+    """ Adds (or replaces) a dataset in the store, one partition per region and sale month
+    :param path: csv with the columns of kc_house_data.csv (other columns are not stored)
+    :param dataset: name of the dataset (market), a folder name
+    :param region: region of every row. Default: the dataset name
+    :param region_column: column of the csv holding the region of each row (e.g. a county); the region
+                          is kept in the catalog, not in the partition files
+    :param geofile: zipcode GeoJSON of the dataset (Price Density map)
+    :param store_dir: store folder
+    :return: catalog entries of the partitions """
+    data = read_csv( path )
+    regions = data[region_column].astype(str) if region_column else pd.Series(region or dataset, index=data.index)
+    entries = write_partitions( data[COLUMNS], regions, dataset, store_dir )
+
+    # files of a previous version of the dataset that are not partitions anymore
+    files = {os.path.normpath(os.path.join(store_dir, entry['file'])) for entry in entries}
+    for folder, _, names in os.walk(os.path.join(store_dir, dataset)):
+        for file in names:
+            if file.endswith('.feather') and os.path.normpath(os.path.join(folder, file)) not in files:
+                os.remove(os.path.join(folder, file))
+
+    catalog = read_catalog( store_dir )
+    catalog['datasets'][dataset] = {'geofile': geofile, 'source_sha256': file_sha256( path ), 'partitions': entries}
+    write_catalog( catalog, store_dir )
+    return entries
+
+
+def prune( entries, regions=None, zipcodes=None, start=None, end=None ):
+    """ Partitions that can hold rows matching the filters, from their catalog entries
+    :param entries: catalog entries
+    :param regions: regions kept; empty keeps every region
+    :param zipcodes: zipcodes of the filter; empty keeps every partition
+    :param start: first sale date (inclusive)
+    :param end: last sale date (inclusive)
+    :return: list of entries """
+    start = None if start is None else pd.Timestamp(start).normalize()
+    end = None if end is None else pd.Timestamp(end)
+    zipcodes = set(int(z) for z in zipcodes) if zipcodes is not None and len(zipcodes) else None
+    kept = []
+    for entry in entries:
+        if regions and entry['region'] not in regions:
+            continue
+        if zipcodes is not None and zipcodes.isdisjoint(entry['zipcodes']):
+            continue
+        if start is not None and pd.Timestamp(entry['max']['date']) < start:
+            continue
+        if end is not None and pd.Timestamp(entry['min']['date']) > end:
+            continue
+        kept.append(entry)
+    return kept
+
+
+class Catalog:
+    """ Datasets and partitions of a store
+    :param store_dir: store folder
+    """
+
+    def __init__( self, store_dir=STORE_DIR ):
+        self.store_dir = store_dir
+        self._mtime = None
+        self.refresh()
+
+    def refresh( self ):
+        """ Reads the catalog again when catalog.json changed (e.g. a delta was appended)
+        :return: self """
+        try:
+            mtime = os.stat(catalog_path( self.store_dir )).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._mtime is None or mtime != self._mtime:
+            self._datasets = read_catalog( self.store_dir )['datasets']
+            self._mtime = mtime
+        return self
+
+    def datasets( self ):
+        """ Names of the datasets """
+        return list(self._datasets)
+
+    def geofile( self, dataset ):
+        """ Zipcode GeoJSON of a dataset """
+        return self._datasets[dataset].get('geofile') or GEOFILE_URL
+
+    def entries( self, dataset ):
+        """ Catalog entries of every partition of a dataset """
+        return self._datasets[dataset]['partitions']
+
+    def regions( self, dataset ):
+        """ Regions of a dataset """
+        return sorted({entry['region'] for entry in self.entries( dataset )})
+
+    def partitions( self, dataset, regions=None, zipcodes=None, start=None, end=None ):
+        """ Pruned partitions of a dataset (see prune) """
+        return prune( self.entries( dataset ), regions, zipcodes, start, end )
+
+    def path( self, entry ):
+        """ Feather file of a partition """
+        return os.path.join(self.store_dir, entry['file'])
+
+    @staticmethod
+    def version( entries ):
+        """ Version of a selection of partitions, used as cache key """
+        digest = hashlib.blake2b(digest_size=20)
+        for entry in entries:
+            digest.update('{}:{}\n'.format(entry['file'], entry['version']).encode())
+        return digest.hexdigest()
+
+
+def load_partition( path ):
+    """ One partition, memory-mapped zero-copy
+    :param path: feather file of the partition
+    :return: HouseDataset """
+    return HouseDataset( *read_compact( path ) )
+
+
+class PartitionedDataset( HouseDataset ):
+    """ Several partitions read as one dataset, each one keeping its range of rows
+    The partitions stay memory-mapped: nothing is copied when a selection is opened, a
+    column or a set of rows is decoded partition by partition and only the result is a
+    new array. Every selection (a version of the catalog) shares the same mapped files.
+    :param parts: HouseDataset of each partition (load_partition)
+    :param entries: catalog entries of the partitions, same order
+    """
+
+    def __init__( self, parts, entries ):
+        if not parts:
+            raise ValueError('No partition selected')
+        self.parts = list(parts)
+        self.entries = list(entries)
+        self.columns = list(self.parts[0].columns)
+        sizes = [len(part) for part in self.parts]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype('int64')
+        self._size = int(sum(sizes))
+        self.scanned = 0
+
+    def __len__( self ):
+        return self._size
+
+    def column( self, name, rows=None ):
+        """ Values of a column, decoded from the codes of each partition
+        :param name: column name
+        :param rows: slice, boolean mask or index array (any order). Default: all rows
+        :return: read-only array """
+        if rows is None:
+            return read_only( np.concatenate([part.column( name ) for part in self.parts]) )
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(self._size))
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if len(self.parts) == 1:
+            return self.parts[0].column( name, rows )
+        # rows grouped by partition (stable), decoded there, then put back in the requested order
+        owner = np.searchsorted(self.offsets, rows, side='right') - 1
+        order = np.argsort(owner, kind='stable')
+        bounds = np.searchsorted(owner[order], np.arange(len(self.parts) + 1))
+        values = np.concatenate([self.parts[i].column( name, rows[order[lo:hi]] - self.offsets[i] )
+                                 for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))])
+        result = np.empty_like(values)
+        result[order] = values
+        return read_only( result )
+
+    def codes( self, name ):
+        """ None: the codes are stored per partition (parts), each one with its own encoding """
+        return None
+
+    def encoding( self, name ):
+        """ None: the codes are stored per partition (parts), each one with its own encoding """
+        return None
+
+    @property
+    def nbytes( self ):
+        """ Bytes held by the columns of the partitions """
+        return sum(part.nbytes for part in self.parts)
+
+    def dtype( self, name ):
+        """ dtype of the decoded values of a column """
+        return self.parts[0].dtype( name )
+
+    def isin( self, name, values ):
+        """ Boolean mask of the rows whose column is one of values, compared in each partition """
+        return np.concatenate([part.isin( name, values ) for part in self.parts])
+
+    def where( self, zipcodes=None, start=None, end=None ):
+        """ Rows matching the filters, scanning only the partitions the catalog can't rule out
+        Partitions are sale months: a date range prunes them, a zipcode alone rarely does
+        (FilterIndex.member answers it from bitmaps).
+        :param zipcodes: accepted zipcodes; empty accepts every zipcode
+        :param start: first sale date (inclusive)
+        :param end: last sale date (inclusive)
+        :return: sorted row positions """
+        kept = {id(entry) for entry in prune( self.entries, zipcodes=zipcodes, start=start, end=end )}
+        rows = [np.empty(0, dtype='int64')]
+        for part, entry, offset in zip(self.parts, self.entries, self.offsets):
+            if id(entry) not in kept:
+                continue
+            self.scanned += 1
+            mask = np.ones(len(part), dtype=bool)
+            if zipcodes is not None and len(zipcodes):
+                mask &= part.isin( 'zipcode', zipcodes )
+            if start is not None:
+                mask &= part['date'] >= np.datetime64(pd.Timestamp(start).normalize())
+            if end is not None:
+                mask &= part['date'] <= np.datetime64(pd.Timestamp(end))
+            rows.append(offset + np.flatnonzero(mask))
+        return np.concatenate(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds a csv to the partitioned store, by region and sale month')
+    parser.add_argument('path')
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--region', help='region of every row (default: the dataset name)')
+    parser.add_argument('--region-column', help='column of the csv with the region of each row')
+    parser.add_argument('--geofile', default=GEOFILE_URL)
+    parser.add_argument('--store', default=STORE_DIR)
+    args = parser.parse_args()
+    parts = add_dataset( args.path, args.dataset, region=args.region, region_column=args.region_column,
+                         geofile=args.geofile, store_dir=args.store )
+    print('{}: {} partitions, {:,} rows'.format(args.dataset, len(parts), sum(p['rows'] for p in parts)))
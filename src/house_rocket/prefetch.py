@@ -0,0 +1,166 @@
+""" Background prefetch of the likely next widget values.
+
+After a rerun, the sessions list the charts of the neighbouring widget positions (the
+previous / next year of the year slider, the next price bins, the adjacent options of a
+selectbox...) and the Prefetcher renders them in a small thread pool, while the user
+looks at the page. Each job computes the data slice of its chart and builds the figure
+JSON into the render cache (RenderCache: bounded LRU), under the key the foreground would
+use, so a rerun on one of these values finds its chart ready.
+
+- prefetch(kind, prepare): queues a chart; prepare() returns its inputs and build
+  function, like the foreground call. Jobs above max_pending are dropped, a chart already
+  cached or being built isn't built twice;
+- submit(fn, *args): queues any other warm-up (e.g. the filter bitmaps of the top zipcodes);
+- render(kind, inputs, build, parse): foreground rendering. Returns the cached text, or
+  waits for the job building the same key, or builds it; with parse, also the object
+  parsed from the text, kept by the render cache (RenderCache.parsed).
+
+Counters: hits (foreground served by a prefetched chart, ready or in flight), misses
+(foreground had to build), waits (part of the hits that waited for their job), cached
+(served by a chart the foreground itself rendered before), and submitted / done / dropped /
+failed jobs. A failed job is only counted: the foreground builds the chart again.
+
+The jobs run outside the streamlit script thread: they must not call st.*.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from house_rocket.rendercache import input_key
+
+# Zipcodes with the most houses, prefetched as the next zipcode selection
+TOP_ZIPCODES = 5
+
+
+def neighbours( options, value, steps=(-1, 1) ):
+    """ Options next to the selected one (previous / next selectbox item, adjacent year...)
+    :param options: sorted options of the widget
+    :param value: selected option
+    :param steps: offsets from the position of value
+    :return: list of options, without value and without duplicates """
+    options = list(options)
+    position = options.index(value) if value in options else None
+    found = []
+    if position is not None:
+        for step in steps:
+            if 0 <= position + step < len(options) and options[position + step] not in found:
+                found.append(options[position + step])
+    return found
+
+
+class Prefetcher:
+    """ Thread pool rendering charts into a render cache ahead of the reruns
+    :param cache: RenderCache shared with the foreground
+    :param workers: threads of the pool
+    :param max_pending: jobs queued or running at most, the next ones are dropped
+    :param wait_timeout: seconds the foreground waits for a job in flight before building itself
+    :param max_tracked: prefetched keys remembered for the hit counter
+    """
+
+    def __init__( self, cache, workers=2, max_pending=32, wait_timeout=5.0, max_tracked=1024 ):
+        self.cache = cache
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self.max_tracked = max_tracked
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._inflight = {}               # render key -> Future, set when its job is done
+        self._prefetched = OrderedDict()  # render keys built by a job, not read yet
+        self.hits = self.waits = self.misses = self.cached = 0
+        self.submitted = self.done = self.dropped = self.failed = 0
+
+    # Background ------------------------------------------------------------
+    def submit( self, fn, *args ):
+        """ Runs fn(*args) in the pool, unless max_pending jobs are already waiting
+        :return: True if the job was queued """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self.submitted += 1
+        self._pool.submit(self._run, fn, args)
+        return True
+
+    def prefetch( self, kind, prepare ):
+        """ Renders a chart in the pool
+        :param kind: name of the chart (part of the key)
+        :param prepare: function returning the inputs list and the build function of the chart
+        :return: True if the job was queued """
+        return self.submit( self._render, kind, prepare )
+
+    def _run( self, fn, args ):
+        try:
+            fn(*args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+        else:
+            with self._lock:
+                self.done += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _render( self, kind, prepare ):
+        inputs, build = prepare()
+        key = input_key( kind, *inputs )
+        with self._lock:
+            if key in self._inflight:
+                return
+            future = self._inflight[key] = Future()
+        try:
+            if key not in self.cache:
+                self.cache.put( key, build() )
+                with self._lock:
+                    self._prefetched[key] = True
+                    while len(self._prefetched) > self.max_tracked:
+                        self._prefetched.popitem(last=False)
+            future.set_result(None)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # Foreground ------------------------------------------------------------
+    def render( self, kind, inputs, build, parse=None ):
+        """ Rendered text of a component: prefetched, cached or built now
+        :param kind: name of the component (part of the key)
+        :param inputs: list of the data slices and parameters the component is built from
+        :param build: function returning the text (figure JSON, map HTML)
+        :param parse: function text -> object (e.g. plotly.io.from_json), parsed once per cached text
+        :return: text, or text and the parsed object with parse """
+        key = input_key( kind, *inputs )
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is not None:
+            try:
+                future.result(timeout=self.wait_timeout)
+            except Exception:
+                pass  # failed or too slow: read the cache, or build below
+            else:
+                with self._lock:
+                    self.waits += 1
+
+        text = self.cache.get( key )
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            elif self._prefetched.pop(key, None):
+                self.hits += 1
+            else:
+                self.cached += 1
+        if text is None:
+            text = build()
+            self.cache.put( key, text )
+        return text if parse is None else ( text, self.cache.parsed( key, text, parse ) )
+
+    def stats( self ):
+        """ Counters of the prefetcher, for the profile panel """
+        with self._lock:
+            return {'hits': self.hits, 'waits': self.waits, 'misses': self.misses, 'cached': self.cached,
+                    'pending': self._pending, 'submitted': self.submitted, 'done': self.done,
+                    'dropped': self.dropped, 'failed': self.failed}
@@ -0,0 +1,114 @@
+""" Buy / sell recommendation rules.
+
+Whole-column version of the rules used by the "Business Recommendations" session.
+Every decision is computed as a numpy/pandas column operation, so the cost grows with
+the number of columns touched, not with a Python loop over the rows.
+"""
+import numpy as np
+import pandas as pd
+
+# Labels shown on the reports
+BUY = 'compra'
+NO_BUY = 'não compra'
+
+CONDITION_STATUS = {5: 'excelente', 4: 'muito bom'}
+
+# Month -> season used on the sales report (only winter and summer are analysed)
+WINTER_MONTHS = (12, 1, 2)
+SUMMER_MONTHS = (6, 7, 8)
+
+# Reference price of the sales report: winter median price of zipcode 98070
+WINTER_MEDIAN_PRICE = 537730.7692
+
+# Columns returned by the reports
+BUY_REPORT_COLUMNS = ['id', 'zipcode', 'buy_price', 'median_price', 'condition_status', 'recommendation', 'lat', 'long']
+SELL_REPORT_COLUMNS = ['id', 'zipcode', 'seasonality', 'winter_median_price', 'buy_price', 'sale_price', 'profit']
+
+
+def zipcode_median_price( data ):
+    """ Median price of each zipcode
+    :param data: dataset with columns 'zipcode' and 'price'
+    :return: dataframe with columns 'zipcode' and 'price' """
+    return data[['price', 'zipcode']].groupby('zipcode').median().reset_index()
+
+
+def seasonality( month ):
+    """ Translates sale months into 'winter', 'summer' or 'NA'
+    :param month: array-like of months (1 to 12)
+    :return: numpy array of season labels """
+    month = np.asarray(month)
+    return np.select([np.isin(month, WINTER_MONTHS), np.isin(month, SUMMER_MONTHS)],
+                     ['winter', 'summer'], default='NA')
+
+
+def buy_recommendation( data, median_price=None, max_price_ratio=1.0, min_condition=4, waterfront=True,
+                        reference_price=None ):
+    """ Flags the properties House Rocket should buy
+    A property is recommended when its price is below max_price_ratio * median price
+    of its zipcode (or its own reference_price), its condition is at least
+    min_condition and, when waterfront is True, it has water view.
+    :param data: dataset with columns 'id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long'
+    :param median_price: dataframe with 'zipcode' and 'price' (reference price). Default: zipcode_median_price(data)
+    :param max_price_ratio: buy only below this fraction of the reference price
+    :param min_condition: minimum condition (1 to 5)
+    :param waterfront: require water view
+    :param reference_price: reference price of each row of data (e.g. the comparables median,
+                            house_rocket.comparables), used instead of the zipcode median
+    :return: dataset with 'buy_price', 'median_price' and 'recommendation' for every property """
+    cols = ['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long']
+    if reference_price is not None:
+        df = data[cols].rename(columns={'price': 'buy_price'}).reset_index(drop=True)
+        df['median_price'] = np.asarray(reference_price, dtype='float64')
+    else:
+        if median_price is None:
+            median_price = zipcode_median_price( data )
+        df = pd.merge(data[cols], median_price, on='zipcode', how='inner')
+        df = df.rename(columns={'price_x': 'buy_price', 'price_y': 'median_price'})
+
+    buy = ( df['buy_price'].to_numpy() < df['median_price'].to_numpy() * max_price_ratio ) & \
+          ( df['condition'].to_numpy() >= min_condition )
+    if waterfront:
+        buy &= df['waterfront'].to_numpy() == 1
+
+    df['recommendation'] = np.where(buy, BUY, NO_BUY)
+    return df
+
+
+def buy_report( data, **rules ):
+    """ Purchasing recommendation report, only with recommended properties
+    :param data: dataset accepted by buy_recommendation
+    :param rules: keyword arguments forwarded to buy_recommendation
+    :return: dataframe with BUY_REPORT_COLUMNS """
+    df = buy_recommendation( data, **rules )
+    rep_buy = df.loc[df['recommendation'] == BUY].copy()
+    rep_buy['condition_status'] = rep_buy['condition'].map(CONDITION_STATUS)
+    return rep_buy[BUY_REPORT_COLUMNS].reset_index(drop=True)
+
+
+def sell_report( rep_buy, season_price, season='winter', markup=30, markup_above_median=None ):
+    """ Sales recommendation report: sale price and profit of each bought property
+    Sale price is buy_price + markup %. When markup_above_median is given, properties
+    bought above the season reference price use that markup instead.
+    :param rep_buy: purchasing report (buy_report)
+    :param season_price: reference price on the sale season, a number or a Series indexed by zipcode
+    :param season: season suggested for the sale
+    :param markup: markup (%) over the buy price
+    :param markup_above_median: markup (%) when buy_price > season_price. Default: markup
+    :return: dataframe with SELL_REPORT_COLUMNS """
+    recom_sell = rep_buy[['id', 'zipcode', 'buy_price']].reset_index(drop=True)
+    recom_sell['seasonality'] = season
+
+    if isinstance(season_price, pd.Series):
+        recom_sell['winter_median_price'] = recom_sell['zipcode'].map(season_price)
+    else:
+        recom_sell['winter_median_price'] = season_price
+
+    buy_price = recom_sell['buy_price'].to_numpy(dtype='float64')
+    perc = np.full(len(recom_sell), markup, dtype='float64')
+    if markup_above_median is not None:
+        above = buy_price > recom_sell['winter_median_price'].to_numpy(dtype='float64')
+        perc[above] = markup_above_median
+
+    recom_sell['sale_price'] = ( buy_price * perc / 100 ) + buy_price
+    recom_sell['profit'] = recom_sell['sale_price'] - buy_price
+    return recom_sell[SELL_REPORT_COLUMNS]
@@ -0,0 +1,204 @@
+""" Cache of rendered charts and maps.
+
+RenderCache keeps the serialized output of a chart (plotly figure JSON) or of a map
+(folium HTML page) under a key hashed from its inputs: the data slice it is drawn from
+and its parameters. A rerun whose inputs didn't change gets the stored text back, and
+skips building the figure and serializing it. Moving a slider only re-renders the
+charts that read it.
+
+- memory tier: LRU, bounded by the total size of the stored texts (max_bytes). The
+  object parsed from a text (parsed(): the plotly figure of a figure JSON) is kept with
+  it, so a hit doesn't parse the figure again; it leaves with its text (its own size is
+  not counted);
+- disk tier (optional, store_dir): every entry is also written to a file named by its
+  key (written to a temporary name and renamed), read back on a memory miss, e.g. after
+  a restart or by another worker process. The folder is bounded by max_disk_bytes, the
+  least recently used files are removed first.
+
+Keys hash the values, not the objects: arrays and dataframes by their bytes (and dtypes,
+shape, labels), so any change of a data slice or of a parameter gives a new key.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Bump when the rendering code changes, to ignore the entries of older versions
+RENDER_VERSION = '1'
+
+
+def _update( digest, obj ):
+    """ Feeds the value of obj to a hash """
+    if isinstance(obj, pd.DataFrame):
+        digest.update(repr(( 'frame', list(obj.columns), [str(t) for t in obj.dtypes] )).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, ( pd.Series, pd.Index )):
+        digest.update(repr(( 'series', obj.name, str(obj.dtype) )).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=isinstance(obj, pd.Series)).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(repr(( 'array', obj.dtype.str, obj.shape )).encode())
+        if obj.dtype == object:
+            digest.update(pd.util.hash_array(obj.ravel()).tobytes())
+        else:
+            digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, ( list, tuple )):
+        digest.update('{}{}'.format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            _update( digest, item )
+    elif isinstance(obj, dict):
+        digest.update(json.dumps(obj, sort_keys=True, default=str).encode())
+    else:
+        digest.update(repr(( type(obj).__name__, obj )).encode())
+
+
+def input_key( *inputs ):
+    """ Hash of the inputs of a rendering
+    :param inputs: arrays, dataframes, series, dicts, lists and scalars
+    :return: hex string """
+    digest = hashlib.blake2b(RENDER_VERSION.encode(), digest_size=20)
+    for obj in inputs:
+        _update( digest, obj )
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """ LRU cache of rendered texts (figure JSON, map HTML) by input hash
+    :param max_bytes: size of the memory tier
+    :param store_dir: folder of the disk tier. Default: memory only
+    :param max_disk_bytes: size of the disk tier
+    """
+
+    def __init__( self, max_bytes=64 * 2**20, store_dir=None, max_disk_bytes=256 * 2**20 ):
+        self.max_bytes = max_bytes
+        self.store_dir = store_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._parsed = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+
+    def __len__( self ):
+        return len(self._entries)
+
+    def __contains__( self, key ):
+        """ Key stored in memory or on disk (the counters and the LRU order are left as they are) """
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.store_dir) and os.path.exists(self._path( key ))
+
+    @property
+    def nbytes( self ):
+        return self._bytes
+
+    def _path( self, key ):
+        return os.path.join(self.store_dir, key + '.txt')
+
+    def _remember( self, key, text ):
+        size = len(text)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+                self._parsed.pop(key, None)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = text
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self._parsed.pop(old_key, None)
+                self._bytes -= len(old)
+
+    def get( self, key ):
+        """ Stored text of a key (memory, then disk), or None """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.store_dir:
+            path = self._path( key )
+            try:
+                with open(path, encoding='utf-8') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                os.utime(path)  # access time of the disk LRU
+                self._remember( key, text )
+                with self._lock:
+                    self.disk_hits += 1
+                return text
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put( self, key, text ):
+        """ Stores the text of a key in memory and, with a disk tier, on disk """
+        self._remember( key, text )
+        if self.store_dir:
+            tmp = '{}.{}.{}.tmp'.format(self._path( key ), os.getpid(), threading.get_ident())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, self._path( key ))
+            self._trim_disk()
+
+    def parsed( self, key, text, parse ):
+        """ Object parsed from the text of a key, parsed once while the text is in the memory tier
+        The object is shared by every caller: it must not be modified.
+        :param key: key of the text
+        :param text: stored text of the key (get / render)
+        :param parse: function text -> object (e.g. plotly.io.from_json)
+        :return: object """
+        with self._lock:
+            obj = self._parsed.get(key)
+        if obj is None:
+            obj = parse(text)
+            with self._lock:
+                if self._entries.get(key) is text:
+                    self._parsed[key] = obj
+        return obj
+
+    def _trim_disk( self ):
+        """ Removes the least recently used files above max_disk_bytes """
+        files = []
+        for entry in os.scandir(self.store_dir):
+            if entry.name.endswith('.txt'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def render( self, kind, inputs, build ):
+        """ Rendered text of a component, built only when its inputs are new
+        :param kind: name of the component (part of the key)
+        :param inputs: list of the data slices and parameters the component is built from
+        :param build: function returning the text (figure JSON, map HTML)
+        :return: text """
+        key = input_key( kind, *inputs )
+        text = self.get( key )
+        if text is None:
+            text = build()
+            self.put( key, text )
+        return text
+
+    def stats( self ):
+        """ Counters of the cache, for the profile panel """
+        return {'entries': len(self), 'bytes': self._bytes, 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses}
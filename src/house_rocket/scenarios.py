@@ -0,0 +1,182 @@
+""" Sell strategy scenarios.
+
+A scenario is a buy rule (minimum condition, water view required or not, maximum
+price / zipcode median ratio) and a sale rule (sale season, markup when the property
+was bought at or below the season median price of its zipcode, markup when bought
+above it). The season medians are taken from the data for every zipcode.
+
+Every buy rule is a boolean mask over the candidate properties and every sale rule a
+profit vector, so the total profit of all B x S scenarios is one matrix product
+(masks @ profits.T). Buy rules can be split across a process pool:
+
+    python -m house_rocket.scenarios kc_house_data.csv --workers 4 --top 20
+
+run_scenarios(...) gives the same profit as buy_report + sell_report(...,
+markup_above_median=...) of each scenario.
+"""
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.recommendation import seasonality, zipcode_median_price
+
+SEASONS = ('winter', 'summer')
+
+BUY_RULES = ('min_condition', 'waterfront', 'max_price_ratio')
+SALE_RULES = ('season', 'markup', 'markup_above_median')
+
+# Default grid: 3 x 2 x 4 buy rules x 2 x 5 x 5 sale rules = 1200 scenarios
+DEFAULT_GRID = {'min_condition': (3, 4, 5),
+                'waterfront': (True, False),
+                'max_price_ratio': (0.7, 0.8, 0.9, 1.0),
+                'season': SEASONS,
+                'markup': (10, 20, 30, 40, 50),
+                'markup_above_median': (0, 5, 10, 20, 30)}
+
+SCENARIO_COLUMNS = ['rank', *BUY_RULES, *SALE_RULES, 'houses', 'invested', 'profit', 'roi']
+
+
+def season_medians( data ):
+    """ Median price of each zipcode on each sale season
+    :param data: dataset with columns 'zipcode', 'price' and 'date'
+    :return: dataframe indexed by zipcode, one column per season of SEASONS """
+    season = pd.Series(seasonality( data['date'].dt.month ), index=data.index, name='season')
+    medians = data['price'].groupby([data['zipcode'], season]).median().unstack()
+    return medians.reindex(columns=list(SEASONS))
+
+
+def rule_grid( grid, names ):
+    """ Every combination of the given grid entries
+    :param grid: dict rule -> values
+    :param names: rules to combine
+    :return: dataframe, one row per combination """
+    return pd.DataFrame(list(itertools.product(*(grid[n] for n in names))), columns=list(names))
+
+
+def buy_masks( candidates, buy_rules ):
+    """ One boolean row per buy rule: the candidates bought by that rule
+    :param candidates: dict of arrays 'price', 'median_price', 'condition', 'waterfront'
+    :param buy_rules: dataframe of BUY_RULES
+    :return: array (rules, candidates) """
+    limit = candidates['median_price'] * buy_rules['max_price_ratio'].to_numpy()[:, None]
+    masks = ( candidates['price'] < limit ) & \
+            ( candidates['condition'] >= buy_rules['min_condition'].to_numpy()[:, None] )
+    masks &= ~buy_rules['waterfront'].to_numpy(dtype=bool)[:, None] | ( candidates['waterfront'] == 1 )
+    return masks
+
+
+def sale_profits( candidates, sale_rules ):
+    """ One profit row per sale rule: profit of each candidate if it is bought
+    :param candidates: dict of arrays 'price' and one '<season>_price' per season
+    :param sale_rules: dataframe of SALE_RULES
+    :return: array (rules, candidates) """
+    price = candidates['price']
+    season_price = np.stack([candidates['{}_price'.format(s)] for s in sale_rules['season']])
+    perc = np.where(price > season_price,
+                    sale_rules['markup_above_median'].to_numpy(dtype='float64')[:, None],
+                    sale_rules['markup'].to_numpy(dtype='float64')[:, None])
+    return price * perc / 100
+
+
+def evaluate( candidates, buy_rules, sale_rules ):
+    """ Houses bought, money invested and total profit of every buy x sale rule
+    :param candidates: dict of candidate arrays
+    :param buy_rules: dataframe of BUY_RULES
+    :param sale_rules: dataframe of SALE_RULES
+    :return: houses (B), invested (B), profit (B x S) """
+    masks = buy_masks( candidates, buy_rules ).astype('float64')
+    profits = sale_profits( candidates, sale_rules )
+    return masks.sum(axis=1), masks @ candidates['price'], masks @ profits.T
+
+
+def prepare( data, median_price=None, season_prices=None, grid=DEFAULT_GRID ):
+    """ Candidate properties with their reference prices: only the rows that at least
+    one buy rule of the grid may buy
+    :param data: dataset with 'zipcode', 'price', 'condition', 'waterfront' (and 'date'
+                 when season_prices is not given)
+    :param median_price: dataframe with 'zipcode' and 'price'. Default: zipcode_median_price(data)
+    :param season_prices: dataframe zipcode x season. Default: season_medians(data)
+    :param grid: scenario grid
+    :return: dict of arrays """
+    if median_price is None:
+        median_price = zipcode_median_price( data )
+    if season_prices is None:
+        season_prices = season_medians( data )
+
+    median = median_price.set_index('zipcode')['price']
+    zipcode = data['zipcode'].to_numpy()
+    price = data['price'].to_numpy(dtype='float64')
+    median = median.reindex(zipcode).to_numpy(dtype='float64')
+
+    keep = ( price < median * max(grid['max_price_ratio']) ) & \
+           ( data['condition'].to_numpy() >= min(grid['min_condition']) )
+    if all(grid['waterfront']):
+        keep &= data['waterfront'].to_numpy() == 1
+
+    candidates = {'zipcode': zipcode[keep], 'price': price[keep], 'median_price': median[keep],
+                  'condition': data['condition'].to_numpy()[keep], 'waterfront': data['waterfront'].to_numpy()[keep]}
+    for season in grid['season']:
+        # zipcodes without sales on a season use their overall median
+        prices = season_prices[season].reindex(candidates['zipcode']).to_numpy(dtype='float64')
+        candidates['{}_price'.format(season)] = np.where(np.isnan(prices), candidates['median_price'], prices)
+    return candidates
+
+
+def run_scenarios( data, grid=DEFAULT_GRID, median_price=None, season_prices=None, workers=1 ):
+    """ Evaluates every scenario of the grid and ranks them by total profit
+    :param data: dataset accepted by prepare
+    :param grid: dict rule -> values, with every entry of BUY_RULES and SALE_RULES
+    :param median_price: buy reference price by zipcode. Default: zipcode medians of data
+    :param season_prices: sale reference price by zipcode x season. Default: season_medians(data)
+    :param workers: processes; the buy rules are split among them
+    :return: dataframe with SCENARIO_COLUMNS, best scenario first """
+    candidates = prepare( data, median_price, season_prices, grid )
+    buy_rules = rule_grid( grid, BUY_RULES )
+    sale_rules = rule_grid( grid, SALE_RULES )
+
+    if workers > 1 and len(buy_rules) > 1:
+        chunks = np.array_split(np.arange(len(buy_rules)), min(workers, len(buy_rules)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(evaluate, itertools.repeat(candidates),
+                                  [buy_rules.iloc[c] for c in chunks], itertools.repeat(sale_rules)))
+        houses, invested, profit = (np.concatenate(p) for p in zip(*parts))
+    else:
+        houses, invested, profit = evaluate( candidates, buy_rules, sale_rules )
+
+    # buy rule b x sale rule s -> row b * S + s
+    scenarios = pd.concat([buy_rules.loc[buy_rules.index.repeat(len(sale_rules))].reset_index(drop=True),
+                           pd.concat([sale_rules] * len(buy_rules), ignore_index=True)], axis=1)
+    scenarios['houses'] = np.repeat(houses, len(sale_rules)).astype('int64')
+    scenarios['invested'] = np.repeat(invested, len(sale_rules))
+    scenarios['profit'] = profit.ravel()
+    scenarios['roi'] = np.divide(scenarios['profit'], scenarios['invested'],
+                                 out=np.zeros(len(scenarios)), where=scenarios['invested'].to_numpy() > 0)
+
+    scenarios = scenarios.sort_values('profit', ascending=False, kind='stable').reset_index(drop=True)
+    scenarios['rank'] = np.arange(1, len(scenarios) + 1)
+    return scenarios[SCENARIO_COLUMNS]
+
+
+if __name__ == '__main__':
+    from house_rocket.ingest import load_dataset
+
+    parser = argparse.ArgumentParser(description='Ranks the buy / sell scenarios of a house sales csv by profit')
+    parser.add_argument('path', nargs='?', default='kc_house_data.csv')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--out', help='csv with every scenario')
+    args = parser.parse_args()
+
+    data = load_dataset( args.path, columns=['zipcode', 'price', 'condition', 'waterfront', 'date'] )
+    start = time.perf_counter()
+    scenarios = run_scenarios( data, workers=args.workers )
+    elapsed = time.perf_counter() - start
+
+    print(scenarios.head(args.top).to_string(index=False))
+    print('{} scenarios in {:.3f} s'.format(len(scenarios), elapsed))
+    if args.out:
+        scenarios.to_csv(args.out, index=False)
@@ -0,0 +1,251 @@
+""" Spatial aggregation for the portfolio density map.
+
+Properties are binned into a square grid on the Web Mercator plane (the projection of
+the map tiles): at zoom z the world is 256 * 2^z pixels wide and each cell is
+CELL_PX pixels, so one cell is roughly what a marker cluster covers on screen. Each
+zoom level keeps one row per non-empty cell (count, centroid, bounding box, mean
+price), computed with numpy from the coordinate arrays.
+
+The map payload is then bounded by the number of cells, not by the number of
+properties. Full-resolution points are sent only where the clusters hide the most
+properties: the densest cells of the finest zoom level, as many as fit in MAX_POINTS
+(dense_points), as one GeoJSON layer built in bulk (points_geojson). Properties appended to the dataset (house_rocket.delta) are folded into the
+cells with ClusterLevels.extend().
+"""
+import copy
+import json
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+TILE_PX = 256
+CELL_PX = 64
+ZOOM_LEVELS = (9, 10, 11, 12, 13)
+MAX_POINTS = 250
+
+
+def mercator( lat, long, zoom ):
+    """ Pixel coordinates on the Web Mercator plane
+    :param lat: array of latitudes (degrees)
+    :param long: array of longitudes (degrees)
+    :param zoom: zoom level
+    :return: x, y arrays (pixels from the top-left corner) """
+    size = TILE_PX * 2.0 ** zoom
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    x = ( np.asarray(long, dtype='float64') + 180.0 ) / 360.0 * size
+    y = ( 1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi ) / 2.0 * size
+    return x, y
+
+
+def inverse_mercator( x, y, zoom ):
+    """ Latitude / longitude of Web Mercator pixel coordinates
+    :param x: array of x pixels
+    :param y: array of y pixels
+    :param zoom: zoom level
+    :return: lat, long arrays (degrees) """
+    size = TILE_PX * 2.0 ** zoom
+    long = np.asarray(x, dtype='float64') / size * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * ( 1.0 - 2.0 * np.asarray(y, dtype='float64') / size ))))
+    return lat, long
+
+
+def cell_keys( lat, long, zoom, cell_px=CELL_PX ):
+    """ Grid cell of each property at one zoom level
+    :return: int64 array, cell_x * 2^32 + cell_y """
+    x, y = mercator( lat, long, zoom )
+    return ( x // cell_px ).astype('int64') * ( 1 << 32 ) + ( y // cell_px ).astype('int64')
+
+
+class ClusterLevels( Mapping ):
+    """ Clusters of every zoom level: zoom -> dataframe of cluster_grid
+    Each level keeps the sums of its cells (count, lat, long, price) and their bounding
+    boxes, so properties appended to the dataset are folded in with extend(), adding the
+    new rows in order: the clusters are the ones of a build over every row.
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :param price: optional array of prices, averaged per cell
+    :param zooms: zoom levels
+    :param cell_px: cell size in screen pixels
+    """
+
+    def __init__( self, lat, long, price=None, zooms=ZOOM_LEVELS, cell_px=CELL_PX ):
+        self.cell_px = cell_px
+        self.priced = price is not None
+        self._cells = {}
+        for zoom in zooms:
+            # one integer key per cell, then group the rows by key
+            cells, group = np.unique(cell_keys( lat, long, zoom, cell_px ), return_inverse=True)
+            self._cells[zoom] = self._add( self._empty( cells ), group.ravel(), lat, long, price )
+        self._levels = {zoom: self._frame( zoom, cells ) for zoom, cells in self._cells.items()}
+
+    def __getitem__( self, zoom ):
+        return self._levels[zoom]
+
+    def __iter__( self ):
+        return iter(self._levels)
+
+    def __len__( self ):
+        return len(self._levels)
+
+    def extend( self, lat, long, price=None ):
+        """ Clusters with new properties added
+        :param lat: array of latitudes of the new properties
+        :param long: array of longitudes
+        :param price: array of prices, when the clusters have a mean price
+        :return: new ClusterLevels (this one is not modified) """
+        levels = copy.copy(self)
+        levels._cells = {}
+        for zoom, cells in self._cells.items():
+            keys = cell_keys( lat, long, zoom, self.cell_px )
+            merged = self._empty( np.union1d(cells['key'], keys) )
+            kept = np.searchsorted(merged['key'], cells['key'])
+            for name, values in cells.items():
+                if name != 'key':
+                    merged[name][kept] = values
+            levels._cells[zoom] = self._add( merged, np.searchsorted(merged['key'], keys), lat, long, price )
+        levels._levels = {zoom: levels._frame( zoom, cells ) for zoom, cells in levels._cells.items()}
+        return levels
+
+    def _empty( self, keys ):
+        cells = {'key': keys,
+                 'count': np.zeros(len(keys), dtype='int64'),
+                 'sum_lat': np.zeros(len(keys)),
+                 'sum_long': np.zeros(len(keys)),
+                 'min_lat': np.full(len(keys), np.inf),
+                 'max_lat': np.full(len(keys), -np.inf),
+                 'min_long': np.full(len(keys), np.inf),
+                 'max_long': np.full(len(keys), -np.inf)}
+        if self.priced:
+            cells['sum_price'] = np.zeros(len(keys))
+        return cells
+
+    @staticmethod
+    def _add( cells, group, lat, long, price ):
+        # sums accumulated row by row, in row order (as np.bincount does)
+        lat = np.asarray(lat, dtype='float64')
+        long = np.asarray(long, dtype='float64')
+        np.add.at(cells['count'], group, 1)
+        np.add.at(cells['sum_lat'], group, lat)
+        np.add.at(cells['sum_long'], group, long)
+        np.minimum.at(cells['min_lat'], group, lat)
+        np.maximum.at(cells['max_lat'], group, lat)
+        np.minimum.at(cells['min_long'], group, long)
+        np.maximum.at(cells['max_long'], group, long)
+        if 'sum_price' in cells:
+            np.add.at(cells['sum_price'], group, np.asarray(price, dtype='float64'))
+        return cells
+
+    @staticmethod
+    def _frame( zoom, cells ):
+        count = cells['count']
+        clusters = {'zoom': np.full(len(count), zoom, dtype='int8'),
+                    'cell_x': cells['key'] >> 32,
+                    'cell_y': cells['key'] & 0xFFFFFFFF,
+                    'count': count,
+                    'lat': cells['sum_lat'] / count,
+                    'long': cells['sum_long'] / count,
+                    'min_lat': cells['min_lat'],
+                    'max_lat': cells['max_lat'],
+                    'min_long': cells['min_long'],
+                    'max_long': cells['max_long']}
+        if 'sum_price' in cells:
+            clusters['mean_price'] = cells['sum_price'] / count
+        return pd.DataFrame(clusters)
+
+
+def cluster_grid( lat, long, zoom, price=None, cell_px=CELL_PX ):
+    """ Clusters the properties in the grid cells of one zoom level
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :param zoom: zoom level
+    :param price: optional array of prices, averaged per cell
+    :param cell_px: cell size in screen pixels
+    :return: dataframe, one row per non-empty cell: zoom, cell_x, cell_y, count, lat, long
+             (centroid), min_lat, max_lat, min_long, max_long (bounding box of the properties)
+             and mean_price when price is given """
+    return ClusterLevels( lat, long, price=price, zooms=(zoom,), cell_px=cell_px )[zoom]
+
+
+def cluster_levels( lat, long, price=None, zooms=ZOOM_LEVELS, cell_px=CELL_PX ):
+    """ Clusters of every zoom level
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :param price: optional array of prices
+    :param zooms: zoom levels
+    :param cell_px: cell size in screen pixels
+    :return: ClusterLevels, zoom -> cluster_grid dataframe """
+    return ClusterLevels( lat, long, price=price, zooms=zooms, cell_px=cell_px )
+
+
+def pick_zoom( levels, max_clusters ):
+    """ Finest zoom level whose number of clusters fits the budget
+    :param levels: dict from cluster_levels
+    :param max_clusters: maximum number of clusters
+    :return: zoom level (the coarsest one if none fits) """
+    fitting = [zoom for zoom, clusters in levels.items() if len(clusters) <= max_clusters]
+    return max(fitting) if fitting else min(levels)
+
+
+def dense_points( lat, long, levels, max_points=MAX_POINTS ):
+    """ Properties of the densest cells of the finest zoom level, densest first, as long as they fit
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :param levels: ClusterLevels built from the same properties
+    :param max_points: maximum number of properties
+    :return: boolean mask """
+    zoom = max(levels)
+    clusters = levels[zoom].sort_values('count', ascending=False, kind='mergesort')
+    kept = clusters[clusters['count'].cumsum().to_numpy() <= max_points]
+    cells = kept['cell_x'].to_numpy() * ( 1 << 32 ) + kept['cell_y'].to_numpy()
+    return np.isin(cell_keys( lat, long, zoom, levels.cell_px ), cells)
+
+
+def cells_geojson( clusters, cell_px=CELL_PX ):
+    """ GeoJSON of the cluster cells, as polygons with the cluster attributes
+    :param clusters: dataframe from cluster_grid (single zoom level)
+    :param cell_px: cell size used to build the clusters
+    :return: GeoJSON FeatureCollection (dict) """
+    if len(clusters) == 0:
+        return {'type': 'FeatureCollection', 'features': []}
+
+    zoom = int(clusters['zoom'].iloc[0])
+    x0 = clusters['cell_x'].to_numpy() * cell_px
+    y0 = clusters['cell_y'].to_numpy() * cell_px
+    top, left = inverse_mercator( x0, y0, zoom )
+    bottom, right = inverse_mercator( x0 + cell_px, y0 + cell_px, zoom )
+
+    # ring (long, lat) of each cell: shape (cells, 5, 2)
+    rings = np.stack([np.column_stack([left, top]), np.column_stack([right, top]),
+                      np.column_stack([right, bottom]), np.column_stack([left, bottom]),
+                      np.column_stack([left, top])], axis=1).round(6).tolist()
+    props = records( clusters.drop(columns=['cell_x', 'cell_y']) )
+
+    features = [{'type': 'Feature', 'properties': p, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+                for p, ring in zip(props, rings)]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def records( data ):
+    """ Rows of a dataframe as JSON-ready dicts (python scalars, ISO dates)
+    :param data: dataframe
+    :return: list of dicts """
+    return json.loads(data.to_json(orient='records', date_format='iso', double_precision=6))
+
+
+
+def points_geojson( data, properties=(), max_points=None ):
+    """ GeoJSON of full-resolution points, built in bulk from the columns
+    :param data: dataframe with 'lat', 'long' and the property columns
+    :param properties: columns copied to each feature
+    :param max_points: keep only the first max_points rows (payload bound)
+    :return: GeoJSON FeatureCollection (dict) """
+    if max_points is not None:
+        data = data.iloc[:max_points]
+
+    coords = np.column_stack([data['long'].to_numpy(), data['lat'].to_numpy()]).round(6).tolist()
+    props = records( data[list(properties)] ) if properties else [{}] * len(data)
+
+    features = [{'type': 'Feature', 'properties': p, 'geometry': {'type': 'Point', 'coordinates': c}}
+                for p, c in zip(props, coords)]
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,203 @@
+""" Descriptive statistics by zipcode partition, merged for any zipcode selection.
+
+StatsEngine scans the numeric columns once, grouped by zipcode, and keeps for each
+(zipcode, column):
+- count, shifted sum and sum of squares, min and max: mean and std of any selection are
+  exact, merged from the partition sums;
+- a quantile summary, a row of bucket counts that merges by addition:
+  - columns with few distinct values (bedrooms, grade, zipcode...) count every value,
+    so their median is exact;
+  - the other columns use DDSketch buckets (value -> ceil(log_gamma(|value|))), so
+    their median has a relative error of at most `relative_accuracy`.
+
+A zipcode filter change sums the summaries of the selected zipcodes instead of scanning
+the rows again. When rows are appended (house_rocket.delta), extend() adds the new rows
+to the summaries instead of scanning the dataset again.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+# Relative error bound of the sketched medians (0.01 = 1%)
+DEFAULT_ACCURACY = 0.01
+
+# Columns with at most this number of distinct values are counted exactly
+MAX_EXACT_VALUES = 512
+
+STATS_COLUMNS = ['max', 'min', 'mean', 'median', 'std']
+
+
+def sketch_keys( values, relative_accuracy ):
+    """ DDSketch bucket representative of each value
+    Values v with gamma^(k-1) < |v| <= gamma^k share the bucket k, represented by
+    2 * gamma^k / (gamma + 1): the relative distance to any value of the bucket is at
+    most relative_accuracy. Zero is kept exact.
+    :param values: float array
+    :param relative_accuracy: error bound, 0 < relative_accuracy < 1
+    :return: representative of each value """
+    gamma = ( 1 + relative_accuracy ) / ( 1 - relative_accuracy )
+    magnitude = np.abs(values)
+    nonzero = magnitude > 0
+    k = np.ceil(np.log(magnitude, where=nonzero, out=np.zeros_like(magnitude)) / np.log(gamma))
+    representative = 2 * gamma ** k / ( gamma + 1 )
+    return np.where(nonzero, np.sign(values) * representative, 0.0)
+
+
+def _values( data, name, rows=None ):
+    """ float64 values of a column, only the selected rows (HouseDataset.column gathers the codes first) """
+    if hasattr(data, 'column'):
+        return np.asarray(data.column( name, rows ), dtype='float64')
+    values = np.asarray(data[name], dtype='float64')
+    return values if rows is None else values[rows]
+
+
+class ColumnSummary:
+    """ Partition summaries of one column
+    :param keys: sorted bucket values (exact values or sketch representatives)
+    :param counts: rows of each partition in each bucket, array (partitions, buckets)
+    :param exact: True if keys are the exact values
+    """
+
+    def __init__( self, keys, counts, exact ):
+        self.keys = keys
+        self.counts = counts
+        self.exact = exact
+
+    def quantile( self, rows, q ):
+        """ q-quantile of the selected partitions (np.median convention for q=0.5:
+        average of the two middle values when the count is even)
+        :param rows: partition rows (index array or mask)
+        :param q: quantile, 0 to 1
+        :return: value """
+        cumulative = np.cumsum(self.counts[rows].sum(axis=0))
+        n = cumulative[-1] if len(cumulative) else 0
+        if n == 0:
+            return np.nan
+        position = q * ( n - 1 )
+        lower = np.searchsorted(cumulative, np.floor(position), side='right')
+        upper = np.searchsorted(cumulative, np.ceil(position), side='right')
+        frac = position - np.floor(position)
+        return self.keys[lower] * ( 1 - frac ) + self.keys[upper] * frac
+
+
+class StatsEngine:
+    """ Mergeable descriptive statistics of the numeric columns by zipcode
+    :param data: HouseDataset (or dict of arrays with a .columns list)
+    :param columns: numeric columns
+    :param by: partition column
+    :param relative_accuracy: error bound of the sketched medians
+    :param max_exact_values: columns with at most this number of distinct values are counted exactly
+    """
+
+    def __init__( self, data, columns, by='zipcode', relative_accuracy=DEFAULT_ACCURACY,
+                  max_exact_values=MAX_EXACT_VALUES ):
+        self.columns = list(columns)
+        self.by = by
+        self.relative_accuracy = relative_accuracy
+        self.max_exact_values = max_exact_values
+        self.partitions, part = np.unique(data[by], return_inverse=True)
+        part = part.ravel()
+        size = len(self.partitions)
+
+        # one scan: count, sums and sums of squares (shifted by the first value, which
+        # keeps the variance exact in float64), min and max of every partition
+        values = np.column_stack([_values( data, c ) for c in self.columns])
+        self._shift = values[0].copy() if len(values) else np.zeros(len(self.columns))
+        shifted = values - self._shift
+        self._count = np.bincount(part, minlength=size).astype('float64')
+        self._sum = np.stack([np.bincount(part, shifted[:, j], minlength=size) for j in range(len(self.columns))], axis=1)
+        self._sumsq = np.stack([np.bincount(part, shifted[:, j] ** 2, minlength=size) for j in range(len(self.columns))], axis=1)
+        self._min = np.full((size, len(self.columns)), np.inf)
+        self._max = np.full((size, len(self.columns)), -np.inf)
+        np.minimum.at(self._min, part, values)
+        np.maximum.at(self._max, part, values)
+
+        # quantile summaries
+        self.summaries = {}
+        for j, name in enumerate(self.columns):
+            keys, inverse = np.unique(values[:, j], return_inverse=True)
+            exact = len(keys) <= max_exact_values
+            if not exact:
+                keys, inverse = np.unique(sketch_keys( values[:, j], relative_accuracy ), return_inverse=True)
+            counts = np.bincount(part * len(keys) + inverse.ravel(), minlength=size * len(keys))
+            self.summaries[name] = ColumnSummary( keys, counts.reshape(size, len(keys)), exact )
+
+    def extend( self, data, start ):
+        """ Engine with the rows of data from `start` on added (e.g. new sales appended)
+        The new rows are added one at a time, in row order, to the sums of their partition
+        (ufunc.at), like the scan of a new engine on data adds every row: the result is
+        identical to StatsEngine( data, ... ), for the cost of the new rows only.
+        :param data: HouseDataset with every row, the rows of this engine first
+        :param start: number of rows of this engine
+        :return: new StatsEngine; self is not modified (other sessions may read it) """
+        rows = np.arange(start, len(data))
+        keys = np.asarray(data.column( self.by, rows ) if hasattr(data, 'column') else np.asarray(data[self.by])[rows])
+        values = np.column_stack([_values( data, c, rows ) for c in self.columns])
+
+        engine = copy.copy(self)
+        engine.partitions = np.union1d(self.partitions, keys)
+        old = np.searchsorted(engine.partitions, self.partitions)
+        part = np.searchsorted(engine.partitions, keys)
+        size = len(engine.partitions)
+
+        def expand( array, fill ):
+            out = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+            out[old] = array
+            return out
+
+        shifted = values - self._shift
+        engine._count = expand( self._count, 0 )
+        engine._sum, engine._sumsq = expand( self._sum, 0 ), expand( self._sumsq, 0 )
+        engine._min, engine._max = expand( self._min, np.inf ), expand( self._max, -np.inf )
+        np.add.at(engine._count, part, 1)
+        np.add.at(engine._sum, part, shifted)
+        np.add.at(engine._sumsq, part, shifted ** 2)
+        np.minimum.at(engine._min, part, values)
+        np.maximum.at(engine._max, part, values)
+
+        engine.summaries = {}
+        for j, name in enumerate(self.columns):
+            summary = self.summaries[name]
+            old_keys, column = summary.keys, values[:, j]
+            exact = summary.exact and len(np.union1d(old_keys, column)) <= self.max_exact_values
+            if not exact:
+                column = sketch_keys( column, self.relative_accuracy )
+            keys = np.union1d(sketch_keys( old_keys, self.relative_accuracy ) if summary.exact and not exact
+                              else old_keys, column)
+            counts = np.zeros((size, len(keys)), dtype=summary.counts.dtype)
+            if summary.exact and not exact:
+                # too many values now: the exact counts go to the buckets of their values
+                positions = np.searchsorted(keys, sketch_keys( old_keys, self.relative_accuracy ))
+                np.add.at(counts, ( old[:, None], positions[None, :] ), summary.counts)
+            else:
+                counts[np.ix_(old, np.searchsorted(keys, old_keys))] = summary.counts
+            np.add.at(counts, ( part, np.searchsorted(keys, column) ), 1)
+            engine.summaries[name] = ColumnSummary( keys, counts, exact )
+        return engine
+
+    def rows( self, partitions=None ):
+        """ Partition rows of a selection (None or empty: every partition) """
+        if partitions is None or len(partitions) == 0:
+            return np.arange(len(self.partitions))
+        return np.flatnonzero(np.isin(self.partitions, list(partitions)))
+
+    def describe( self, partitions=None ):
+        """ max, min, mean, median and std (ddof=0) of every column on the selected partitions
+        :param partitions: zipcodes. Default: all
+        :return: dataframe indexed by column, with STATS_COLUMNS """
+        rows = self.rows( partitions )
+        n = self._count[rows].sum()
+        total = self._sum[rows].sum(axis=0)
+        mean = total / n
+        var = self._sumsq[rows].sum(axis=0) / n - mean ** 2
+        medians = [self.summaries[c].quantile( rows, 0.5 ) for c in self.columns]
+        return pd.DataFrame({'max': self._max[rows].max(axis=0),
+                             'min': self._min[rows].min(axis=0),
+                             'mean': mean + self._shift,
+                             'median': medians,
+                             'std': np.sqrt(np.maximum(var, 0))}, index=self.columns)[STATS_COLUMNS]
+
+    def error_bound( self, column ):
+        """ Relative error bound of the median of a column (0 when exact) """
+        return 0.0 if self.summaries[column].exact else self.relative_accuracy
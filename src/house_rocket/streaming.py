@@ -0,0 +1,155 @@
+""" Chunked ingestion for datasets larger than memory.
+
+The csv is read in batches of bounded size. Each batch gets m2_lot / price_m2
+(set_feature) and is folded into running aggregates with the same layout as the cubes
+of house_rocket.aggregates (by zipcode, zipcode x season, zipcode x yr_built and
+zipcode x date), merged with aggregates.rollup. A uniform random sample of rows is kept
+on the side (smallest random keys, so it is exact and independent of the batch size)
+for the sections that need rows.
+
+Cube medians can't be merged across batches: they are taken from the sample.
+
+The batch and sample sizes are derived from a memory ceiling:
+
+    result = stream_dataset( 'kc_house_data.csv', memory_limit=256 * 2**20 )
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from house_rocket.aggregates import build_cube, rollup
+from house_rocket.dataset import set_feature
+from house_rocket.ingest import SCHEMA, parse_dates
+
+# Memory per row of a parsed batch: csv parser buffers, the 'date' strings before
+# parsing, and the typed + derived columns (measured, see benchmarks/bench_streaming.py)
+BATCH_BYTES_PER_ROW = 350
+
+# Memory per row of the kept sample while merging it with a batch (the sample itself is
+# ~120 bytes per row; concat and partition make transient copies)
+SAMPLE_BYTES_PER_ROW = 400
+
+# Memory used whatever the batch size (parser state, cube merges)
+FIXED_BYTES = 40 * 2**20
+
+# Cubes maintained while streaming: name -> (keys, metrics)
+CUBES = {'zipcode': (('zipcode',), ('price', 'sqft_living', 'price_m2')),
+         'zipcode_season': (('zipcode', 'season'), ('price',)),
+         'zipcode_yr_built': (('zipcode', 'yr_built'), ('price',)),
+         'zipcode_date': (('zipcode', 'date'), ('price',))}
+
+
+class StreamResult:
+    """ Output of stream_dataset
+    :param cubes: dict name -> cube (same layout as aggregates.build_cube)
+    :param sample: dataframe, uniform sample of the rows
+    :param rows: number of rows read
+    """
+
+    def __init__( self, cubes, sample, rows ):
+        self.cubes = cubes
+        self.sample = sample
+        self.rows = rows
+
+
+def plan( memory_limit ):
+    """ Batch and sample sizes for a memory ceiling: once the fixed cost is taken, half of
+    it for the batch being parsed, 40% for the sample, the rest for the aggregates
+    :param memory_limit: bytes
+    :return: batch_rows, sample_rows """
+    available = max(memory_limit - FIXED_BYTES, 0)
+    batch_rows = max(1000, int(available * 0.5 / BATCH_BYTES_PER_ROW))
+    sample_rows = max(1000, int(available * 0.4 / SAMPLE_BYTES_PER_ROW))
+    return batch_rows, sample_rows
+
+
+def file_version( path ):
+    """ Cheap version of a large csv (size and mtime), used as cache key instead of a hash
+    :param path: csv path
+    :return: version string """
+    stat = os.stat(path)
+    return '{}-{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def read_batches( path, batch_rows ):
+    """ Typed batches of the csv, with the derived columns
+    :param path: csv path
+    :param batch_rows: rows per batch
+    :return: iterator of dataframes """
+    reader = pd.read_csv(path, dtype={**SCHEMA, 'date': str}, chunksize=batch_rows)
+    for batch in reader:
+        yield set_feature( parse_dates( batch ) )
+
+
+def merge_cube( running, batch_cube, by ):
+    """ Folds the cube of a batch into the running cube
+    :param running: running cube or None
+    :param batch_cube: cube of the batch
+    :param by: cube keys
+    :return: merged cube """
+    if running is None:
+        return batch_cube
+    return rollup( pd.concat([running, batch_cube]), by=by )
+
+
+def merge_sample( sample, batch, size, rng ):
+    """ Keeps the `size` rows with the smallest random keys among sample and batch
+    :param sample: current sample (with a '_key' column) or None
+    :param batch: new rows
+    :param size: sample size
+    :param rng: numpy Generator
+    :return: new sample """
+    batch = batch.assign(_key=rng.random(len(batch)))
+    if len(batch) > size:
+        batch = batch.iloc[np.argpartition(batch['_key'].to_numpy(), size - 1)[:size]]
+    if sample is not None:
+        batch = pd.concat([sample, batch], ignore_index=True)
+    if len(batch) > size:
+        batch = batch.iloc[np.argpartition(batch['_key'].to_numpy(), size - 1)[:size]]
+    return batch.reset_index(drop=True)
+
+
+def sample_medians( cube, sample, by ):
+    """ Replaces the (unmergeable) cube medians by the medians of the sample
+    :param cube: streamed cube
+    :param sample: sample of the rows
+    :param by: cube keys
+    :return: cube with median columns from the sample """
+    metrics = cube.columns.get_level_values(0).unique()
+    medians = build_cube( sample, by=by, metrics=list(metrics) )
+    for metric in metrics:
+        cube[(metric, 'median')] = medians[(metric, 'median')].reindex(cube.index)
+    return cube
+
+
+def stream_dataset( path, memory_limit=256 * 2**20, cubes=CUBES, seed=0 ):
+    """ Reads the csv in bounded batches, maintaining cubes and a row sample
+    :param path: csv path
+    :param memory_limit: memory ceiling of the data being processed, in bytes
+    :param cubes: dict name -> (keys, metrics)
+    :param seed: random seed of the sample
+    :return: StreamResult """
+    batch_rows, sample_rows = plan( memory_limit )
+    rng = np.random.default_rng(seed)
+
+    running = dict.fromkeys(cubes)
+    sample = None
+    rows = 0
+    for batch in read_batches( path, batch_rows ):
+        for name, (by, metrics) in cubes.items():
+            running[name] = merge_cube( running[name], build_cube( batch, by=by, metrics=metrics ), by )
+
+        # '_row' keeps the file order of the sampled rows
+        batch['_row'] = np.arange(rows, rows + len(batch))
+        sample = merge_sample( sample, batch, sample_rows, rng )
+        rows += len(batch)
+
+    if sample is None:
+        return StreamResult( running, None, 0 )
+
+    sample = sample.sort_values('_row').drop(columns=['_key', '_row']).reset_index(drop=True)
+    for name, (by, metrics) in cubes.items():
+        running[name] = sample_medians( running[name], sample, by )
+
+    return StreamResult( running, sample, rows )
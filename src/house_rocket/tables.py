@@ -0,0 +1,174 @@
+""" Paginated tables over the cached dataset and the reports.
+
+PagedTable serves one page of a table at a time: the rows are sorted (and filtered) on
+the server and only the columns and rows of the visible window are gathered into a
+dataframe, so the browser never receives the whole table. Sort orders are cached per
+(column, direction), so paging through a sorted table doesn't sort it again.
+
+export() writes the whole table in chunks to a csv / parquet file, or to a file object
+(io.BytesIO for a download): only one chunk is materialized at a time besides the
+source.
+"""
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EXPORT_FORMATS = ('csv', 'parquet')
+
+
+class PagedTable:
+    """ Server-side pagination, sorting and column projection
+    :param source: HouseDataset or dataframe (anything with .columns and source[name])
+    :param cache_size: number of sort orders kept (LRU)
+    """
+
+    def __init__( self, source, cache_size=8 ):
+        self.source = source
+        self.columns = list(source.columns)
+        self._size = len(source)
+        self._orders = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__( self ):
+        return self._size
+
+    def _column( self, name, positions=None ):
+        # HouseDataset gathers the rows on its codes and decodes only those
+        if hasattr(self.source, 'column'):
+            return self.source.column( name, positions )
+        values = np.asarray(self.source[name])
+        return values if positions is None else values[positions]
+
+    def order( self, sort_by=None, ascending=True ):
+        """ Row positions of the whole table in display order
+        :param sort_by: column name. Default: source order
+        :param ascending: sort direction
+        :return: index array (stable: ties keep the source order) """
+        if sort_by is None:
+            return np.arange(self._size)
+
+        key = (sort_by, ascending)
+        with self._lock:
+            if key in self._orders:
+                self._orders.move_to_end(key)
+                return self._orders[key]
+
+        values = pd.Series(self._column( sort_by ))
+        order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        order.flags.writeable = False
+        with self._lock:
+            self._orders[key] = order
+            while len(self._orders) > self._cache_size:
+                self._orders.popitem(last=False)
+        return order
+
+    def positions( self, rows=None, sort_by=None, ascending=True ):
+        """ Positions of the selected rows in display order
+        :param rows: boolean mask or index array of the rows to show. Default: all
+        :param sort_by: column name. Default: source order
+        :param ascending: sort direction
+        :return: index array """
+        order = self.order( sort_by, ascending )
+        if rows is None:
+            return order
+        rows = np.asarray(rows)
+        if rows.dtype != bool:
+            mask = np.zeros(self._size, dtype=bool)
+            mask[rows] = True
+            rows = mask
+        return order[rows[order]]
+
+    def count( self, rows=None ):
+        """ Number of selected rows """
+        if rows is None:
+            return self._size
+        rows = np.asarray(rows)
+        return int(np.count_nonzero(rows)) if rows.dtype == bool else len(rows)
+
+    def pages( self, page_size, rows=None ):
+        """ Number of pages (at least 1) """
+        return max(1, -( -self.count( rows ) // page_size ))
+
+    def frame( self, positions, columns=None ):
+        """ Dataframe of the given rows and columns, indexed by row position """
+        columns = self.columns if columns is None else list(columns)
+        return pd.DataFrame({name: self._column( name, positions ) for name in columns},
+                            index=positions, columns=columns)
+
+    def window( self, page=1, page_size=50, rows=None, sort_by=None, ascending=True, columns=None ):
+        """ One page of the table
+        :param page: page number, from 1
+        :param page_size: rows per page
+        :param rows: boolean mask or index array of the rows to show. Default: all
+        :param sort_by: column name. Default: source order
+        :param ascending: sort direction
+        :param columns: columns to show. Default: all
+        :return: dataframe of at most page_size rows, indexed by row position """
+        positions = self.positions( rows, sort_by, ascending )
+        start = ( max(page, 1) - 1 ) * page_size
+        return self.frame( positions[start:start + page_size], columns )
+
+    def chunks( self, chunk_rows=50_000, rows=None, sort_by=None, ascending=True, columns=None ):
+        """ The whole selection as consecutive dataframes of at most chunk_rows rows """
+        positions = self.positions( rows, sort_by, ascending )
+        for start in range(0, len(positions), chunk_rows):
+            yield self.frame( positions[start:start + chunk_rows], columns )
+
+    def export( self, target, fmt='csv', chunk_rows=50_000, **selection ):
+        """ Writes the selection to a file, one chunk at a time
+        A path is written to a temporary file of the same folder (unique name) and renamed,
+        so readers never see a partial file.
+        :param target: output path, or binary file object (e.g. io.BytesIO)
+        :param fmt: 'csv' or 'parquet'
+        :param chunk_rows: rows materialized at a time
+        :param selection: rows, sort_by, ascending and columns, as in window()
+        :return: target """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError('Unknown format {!r}, expected one of {}'.format(fmt, EXPORT_FORMATS))
+        if not isinstance(target, ( str, os.PathLike )):
+            self._write( target, fmt, chunk_rows, selection )
+            return target
+
+        tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(target)),
+                                          prefix=os.path.basename(target) + '.', suffix='.tmp', delete=False)
+        try:
+            with tmp:
+                self._write( tmp, fmt, chunk_rows, selection )
+            os.replace(tmp.name, target)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+        return target
+
+    def _write( self, f, fmt, chunk_rows, selection ):
+        # the file object is left open: a BytesIO is read after the export
+        columns = selection.get('columns') or self.columns
+        if fmt == 'parquet':
+            writer = None
+            for chunk in self.chunks( chunk_rows, **selection ):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = writer or pq.ParquetWriter(pa.PythonFile(f, mode='w'), table.schema)
+                writer.write_table(table)
+            if writer is None:
+                pq.write_table(pa.Table.from_pandas(pd.DataFrame(columns=columns), preserve_index=False),
+                               pa.PythonFile(f, mode='w'))
+            else:
+                writer.close()
+        else:
+            text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+            header = True
+            for chunk in self.chunks( chunk_rows, **selection ):
+                chunk.to_csv(text, index=False, header=header)
+                header = False
+            if header:
+                pd.DataFrame(columns=columns).to_csv(text, index=False)
+            text.flush()
+            text.detach()
@@ -0,0 +1,197 @@
+""" Time-series store of the Commercial Attributes price charts.
+
+A TimeSeriesStore keeps, for every zipcode, the running sums of price and of the number
+of sales along a sorted time key (sale day, week or month, or yr_built). It is built
+once per dataset version from a zipcode x time cube, so:
+- the average price over a range ("since X") is two binary searches and a difference
+  of running sums, whatever the number of rows or days;
+- the per-period averages of a range are slices of the running sums.
+
+Charts are downsampled with LTTB (Largest-Triangle-Three-Buckets), which keeps the
+peaks and the shape of the line, so the payload stays bounded as the range grows.
+
+When sales are appended (house_rocket.delta), fold_series() rebuilds the running sums of
+the zipcodes that received sales only, from the folded cubes; the other zipcodes keep
+theirs (new periods add nothing to them). The stores are the ones of a full build.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+# Frequencies of the date stores (pandas period aliases)
+FREQUENCIES = {'Day': 'D', 'Week': 'W', 'Month': 'M'}
+
+# Points sent to a line chart, above that the series is downsampled
+MAX_POINTS = 500
+
+
+class TimeSeriesStore:
+    """ Running sums of a metric by zipcode along a sorted time key
+    :param keys: sorted time keys (T)
+    :param zipcodes: sorted zipcodes (Z)
+    :param sums: metric sums, array (Z, T)
+    :param counts: number of rows, array (Z, T)
+    """
+
+    def __init__( self, keys, zipcodes, sums, counts ):
+        self.keys = np.asarray(keys)
+        self.zipcodes = np.asarray(zipcodes)
+        zero = np.zeros((len(self.zipcodes), 1))
+        # cumulative[:, i] = sum of the first i periods
+        self._sums = np.hstack([zero, np.cumsum(sums, axis=1)])
+        self._counts = np.hstack([zero, np.cumsum(counts, axis=1)]).astype('int64')
+        self._total_sums = self._sums.sum(axis=0)
+        self._total_counts = self._counts.sum(axis=0)
+
+    def __len__( self ):
+        return len(self.keys)
+
+    def merge( self, other ):
+        """ Store with the zipcodes of other taken from other, the others from this one
+        :param other: TimeSeriesStore of some zipcodes (e.g. the ones that received sales)
+        :return: new TimeSeriesStore over the keys of both (this one is not modified) """
+        keys = np.union1d(self.keys, other.keys)
+        zipcodes = np.union1d(self.zipcodes, other.zipcodes)
+        merged = copy.copy(self)
+        merged.keys, merged.zipcodes = keys, zipcodes
+        merged._sums = np.empty((len(zipcodes), len(keys) + 1))
+        merged._counts = np.empty((len(zipcodes), len(keys) + 1), dtype='int64')
+        for store in (self, other):
+            # running sums at the new keys: a key the store doesn't have adds nothing
+            columns = np.append(np.searchsorted(store.keys, keys, side='left'), len(store.keys))
+            rows = np.searchsorted(zipcodes, store.zipcodes)
+            merged._sums[rows] = store._sums[:, columns]
+            merged._counts[rows] = store._counts[:, columns]
+        merged._total_sums = merged._sums.sum(axis=0)
+        merged._total_counts = merged._counts.sum(axis=0)
+        return merged
+
+    def _bounds( self, start, end ):
+        i0 = 0 if start is None else np.searchsorted(self.keys, start, side='left')
+        i1 = len(self.keys) if end is None else np.searchsorted(self.keys, end, side='right')
+        return i0, max(i0, i1)
+
+    def _cumulative( self, zipcodes ):
+        if zipcodes is None or len(zipcodes) == 0:
+            return self._total_sums, self._total_counts
+        rows = np.isin(self.zipcodes, zipcodes)
+        return self._sums[rows].sum(axis=0), self._counts[rows].sum(axis=0)
+
+    def range_mean( self, start=None, end=None, zipcodes=None ):
+        """ Average of the metric over [start, end]
+        :param start: first key (inclusive). Default: first key
+        :param end: last key (inclusive). Default: last key
+        :param zipcodes: zipcodes to include. Default: all
+        :return: mean (NaN when the range is empty), number of rows """
+        i0, i1 = self._bounds( start, end )
+        sums, counts = self._cumulative( zipcodes )
+        count = int(counts[i1] - counts[i0])
+        return ( sums[i1] - sums[i0] ) / count if count else np.nan, count
+
+    def series( self, start=None, end=None, zipcodes=None, max_points=None ):
+        """ Average of the metric on each period of [start, end]
+        :param start: first key (inclusive). Default: first key
+        :param end: last key (inclusive). Default: last key
+        :param zipcodes: zipcodes to include. Default: all
+        :param max_points: downsample with LTTB to at most this number of points
+        :return: keys and means arrays (periods without rows are left out) """
+        i0, i1 = self._bounds( start, end )
+        sums, counts = self._cumulative( zipcodes )
+        sums, counts = np.diff(sums[i0:i1 + 1]), np.diff(counts[i0:i1 + 1])
+        keep = counts > 0
+        keys, means = self.keys[i0:i1][keep], sums[keep] / counts[keep]
+        if max_points is not None:
+            keys, means = lttb( keys, means, max_points )
+        return keys, means
+
+
+def from_cube( cube, level, metric='price' ):
+    """ Store of a zipcode x time cube (aggregates.build_cube)
+    :param cube: cube indexed by ('zipcode', level), with (metric, 'sum') and (metric, 'count')
+    :param level: time key of the cube
+    :param metric: aggregated metric
+    :return: TimeSeriesStore """
+    sums = cube[(metric, 'sum')].unstack(level, fill_value=0).sort_index().sort_index(axis=1)
+    counts = cube[(metric, 'count')].unstack(level, fill_value=0).reindex_like(sums)
+    return TimeSeriesStore( sums.columns.to_numpy(), sums.index.to_numpy(),
+                            sums.to_numpy(dtype='float64'), counts.to_numpy(dtype='int64') )
+
+
+def resample( cube, level, freq, metric='price' ):
+    """ Store of a zipcode x date cube with the dates grouped by period
+    :param cube: cube indexed by ('zipcode', level)
+    :param level: date key of the cube
+    :param freq: pandas period alias ('D', 'W', 'M')
+    :param metric: aggregated metric
+    :return: TimeSeriesStore keyed by the first day of each period """
+    df = cube[[(metric, 'sum'), (metric, 'count')]].droplevel(0, axis=1).reset_index()
+    df[level] = pd.DatetimeIndex(df[level]).to_period(freq).start_time
+    df = df.groupby(['zipcode', level]).sum()
+    return from_cube( pd.concat({metric: df}, axis=1), level, metric )
+
+
+def build_series( cubes, metric='price' ):
+    """ Stores of the Commercial Attributes charts: per day / week / month (FREQUENCIES) and per yr_built
+    :param cubes: dict with the 'zipcode_date' and 'zipcode_yr_built' cubes
+    :param metric: aggregated metric
+    :return: dict period -> TimeSeriesStore """
+    series = {period: resample( cubes['zipcode_date'], 'date', freq, metric ) for period, freq in FREQUENCIES.items()}
+    series['yr_built'] = from_cube( cubes['zipcode_yr_built'], 'yr_built', metric )
+    return series
+
+
+def fold_series( series, cubes, zipcodes, metric='price' ):
+    """ Stores of build_series after sales were appended, from the cube rows of their zipcodes only
+    :param series: dict from build_series, before the sales
+    :param cubes: cubes with the sales (delta.fold_aggregates)
+    :param zipcodes: zipcodes that received sales
+    :param metric: aggregated metric
+    :return: new dict (the inputs are not modified) """
+    touched = {name: cube.loc[cube.index.get_level_values('zipcode').isin(zipcodes)] for name, cube in cubes.items()}
+    fresh = build_series( touched, metric )
+    return {period: store.merge( fresh[period] ) for period, store in series.items()}
+
+
+def lttb( x, y, max_points ):
+    """ Largest-Triangle-Three-Buckets downsampling of a line
+    The first and last points are kept; every bucket in between keeps the point that
+    makes the largest triangle with the previous kept point and the next bucket average.
+    :param x: sorted x values (numbers or datetime64)
+    :param y: y values
+    :param max_points: number of points kept (>= 3)
+    :return: x and y of the kept points """
+    x, y = np.asarray(x), np.asarray(y)
+    kept = lttb_indices( x, y, max_points )
+    return x[kept], y[kept]
+
+
+def lttb_indices( x, y, max_points ):
+    """ Positions of the points kept by lttb(), to downsample other arrays of the same points
+    :param x: sorted x values (numbers or datetime64)
+    :param y: y values
+    :param max_points: number of points kept (>= 3)
+    :return: sorted index array """
+    x, y = np.asarray(x), np.asarray(y)
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    xf = x.astype('datetime64[ns]').astype('int64') if np.issubdtype(x.dtype, np.datetime64) else x
+    xf, yf = xf.astype('float64'), y.astype('float64')
+
+    every = ( n - 2 ) / ( max_points - 2 )
+    kept = np.empty(max_points, dtype='int64')
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        # next bucket average
+        lo, hi = int(( i + 1 ) * every) + 1, min(int(( i + 2 ) * every) + 1, n)
+        avg_x, avg_y = xf[lo:hi].mean(), yf[lo:hi].mean()
+
+        # point of this bucket with the largest triangle
+        lo, hi = int(i * every) + 1, int(( i + 1 ) * every) + 1
+        area = np.abs(( xf[a] - avg_x ) * ( yf[lo:hi] - yf[a] ) - ( xf[a] - xf[lo:hi] ) * ( avg_y - yf[a] ))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
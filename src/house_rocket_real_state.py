@@ -1,28 +1,196 @@
+import os
+import tempfile
 import pandas as pd
 import streamlit as st
 import numpy as np
-import folium
-from streamlit_folium import folium_static
-from folium.plugins   import MarkerCluster
-import geopandas
-import plotly.express as px
-from datetime import datetime
-from PIL import Image
+# folium, streamlit_folium, branca and plotly are imported by the sessions that draw maps and
+# charts, after the header is painted (they take ~1 s to import on a cold container)
+
+from house_rocket.aggregates import build_cube, rollup, select
+from house_rocket.budget import PayloadBudget, fit_figure
+from house_rocket.comparables import ComparablesIndex, comparables
+from house_rocket.dataset import HouseDataset
+from house_rocket.delta import LiveAggregates
+from house_rocket.filters import FilterIndex
+from house_rocket.geostore import load_geometries, geometries_version, feature_collection, DEFAULT_TOLERANCE, TOLERANCES
+from house_rocket.histograms import build_histograms
+from house_rocket.ingest import load_compact, dataset_version
+from house_rocket.instrumentation import MemoryReport, RerunProfile
+from house_rocket.partitions import Catalog, PartitionedDataset, load_partition, prune
+from house_rocket.prefetch import Prefetcher, neighbours, TOP_ZIPCODES
+from house_rocket.recommendation import buy_report, sell_report
+from house_rocket.rendercache import RenderCache
+from house_rocket.scenarios import run_scenarios, SEASONS
+from house_rocket.spatial import cluster_levels, pick_zoom, cells_geojson, dense_points, points_geojson
+from house_rocket.stats import StatsEngine
+from house_rocket.streaming import stream_dataset, file_version
+from house_rocket.tables import PagedTable
+from house_rocket.timeseries import build_series, FREQUENCIES, MAX_POINTS
 
 # ============================================================================================================================================
     # DATA EXTRACTION
 # ============================================================================================================================================
 # Extract data
-@st.cache(allow_output_mutation=True) # Speed up reading with cache
+@st.experimental_singleton # Compact columnar cache of the csv, memory-mapped zero-copy: every process shares the same pages, read-only
 def get_data(path):
-    data = pd.read_csv( path )
+    data = HouseDataset( *load_compact( path ) )
     return data
 
+# Partitioned store
+@st.experimental_singleton # Datasets and partitions of the store (HOUSE_ROCKET_STORE), one per store: read again when catalog.json changes
+def get_catalog( store ):
+    catalog = Catalog( store )
+    return catalog
+
+@st.experimental_singleton # One partition, memory-mapped zero-copy: switching datasets only loads the partitions not seen yet
+def get_partition( path, version ):
+    part = load_partition( path )
+    return part
+
+def store_data( catalog, entries ):
+    """ Partitions of the selected dataset and regions read as one dataset, without copying them
+    :param catalog: Catalog of the store
+    :param entries: catalog entries of the partitions
+    :return: PartitionedDataset """
+    parts = [get_partition( catalog.path( entry ), entry['version'] ) for entry in entries]
+    return PartitionedDataset( parts, entries )
+
+@st.experimental_singleton # Cubes, statistics, filter index, histograms, clusters... of a market / regions selection: the partitions appended by house_rocket.delta are folded in, the previous version is dropped
+def get_live_aggregates( dataset, regions ):
+    live = LiveAggregates()
+    return live
+
+def date_series( live, data, start ):
+    """ Price time series of the partitions with sales since start (catalog pruning)
+    The cubes of each partition are kept while it is selected, the series until a delta is appended.
+    :param live: LiveAggregates of the selection
+    :param data: PartitionedDataset of the selection
+    :param start: first sale date
+    :return: time-series stores (build_series) """
+    kept = prune( data.entries, start=start )
+    parts = {id(entry): part for part, entry in zip(data.parts, data.entries)}
+    def build():
+        cubes = [live.cached( ('cubes', entry['file'], entry['version']), lambda e=entry: build_cubes( parts[id(e)] ),
+                              files=[(entry['file'], entry['version'])] ) for entry in kept]
+        merged = {name: rollup( pd.concat([c[name] for c in cubes]), by=('zipcode', key) )
+                  for name, key in [('zipcode_date', 'date'), ('zipcode_yr_built', 'yr_built')]}
+        return build_series( merged )
+    return live.cached( ('since', Catalog.version( kept )), build )
+
+# Header image
+@st.experimental_singleton # Read once per process; st.image takes the bytes (no PIL needed)
+def get_header_image( path ):
+    with open(path, 'rb') as f:
+        image = f.read()
+    return image
+
 # Extract geofile
-@st.cache( allow_output_mutation=True ) # Read geopandas file, used on Price Density Map
-def get_geofile( url ):
-    geofile = geopandas.read_file( url )
-    return geofile
+@st.experimental_singleton # Local, pre-simplified zipcode polygons (fetched once), used on Price Density Map, and their store version (render cache key)
+def get_geofile( url, tolerance=DEFAULT_TOLERANCE ):
+    geofile = load_geometries( url, tolerance=tolerance )
+    return geofile, geometries_version( url, tolerance=tolerance )
+
+# Paginated dataset table
+@st.experimental_singleton # Sort orders of the dataset columns are cached with the table, once per dataset version
+def get_dataset_table( version, _data ):
+    table = PagedTable( _data )
+    return table
+
+# Descriptive statistics
+@st.experimental_singleton # Moments and median sketches of the numeric columns by zipcode, once per dataset version
+def get_stats( version, _data ):
+    stats = StatsEngine( _data, _data.numeric_columns, by='zipcode', relative_accuracy=0.01 )
+    return stats
+
+# Aggregate cubes
+def build_cubes( data ):
+    """ Cubes by zipcode, zipcode x season, zipcode x yr_built and zipcode x date
+    :param data: HouseDataset
+    :return: dict name -> cube """
+    df = data.frame( columns=['zipcode', 'yr_built', 'date', 'price', 'sqft_living', 'price_m2'] )
+    return {'zipcode': build_cube( df, by=('zipcode',) ),
+            'zipcode_season': build_cube( df, by=('zipcode', 'season'), metrics=('price',) ),
+            'zipcode_yr_built': build_cube( df, by=('zipcode', 'yr_built'), metrics=('price',) ),
+            'zipcode_date': build_cube( df, by=('zipcode', 'date'), metrics=('price',) )}
+
+@st.experimental_singleton # Built once per dataset version, shared by all sections
+def get_cubes( version, _data ):
+    cubes = build_cubes( _data )
+    return cubes
+
+# Extract data larger than memory
+@st.experimental_singleton # Cubes and a row sample, read in batches bounded by memory_limit (bytes)
+def get_streamed_data( version, path, memory_limit ):
+    result = stream_dataset( path, memory_limit=memory_limit )
+    return HouseDataset( result.sample ), result.cubes
+
+# Filter index
+@st.experimental_singleton # Bitmap index of the zipcode filter, built once per dataset version
+def get_filter_index( version, _data ):
+    index = FilterIndex( _data, member_columns=['zipcode'] )
+    return index
+
+# Histograms
+@st.experimental_singleton # Cumulative counts of the House Attributes columns, built once per dataset version
+def get_histograms( version, _data ):
+    histograms = build_histograms( _data )
+    return histograms
+
+# Price time series
+@st.experimental_singleton # Running sums of price by zipcode per day / week / month and per yr_built, once per dataset version
+def get_timeseries( version, _cubes ):
+    series = build_series( _cubes )
+    return series
+
+# Sell scenarios
+def build_scenarios( data, zip_cube, season_cube ):
+    """ Every buy x sale rule of the scenario grid, ranked by profit (run_scenarios)
+    :param data: HouseDataset
+    :param zip_cube: cube by zipcode
+    :param season_cube: cube by zipcode x season
+    :return: dataframe of the scenarios """
+    df = data.frame( columns=['zipcode', 'price', 'condition', 'waterfront'] )
+    median_price = zip_cube[('price', 'median')].rename('price').reset_index()
+    season_prices = season_cube[('price', 'median')].unstack('season').reindex(columns=list(SEASONS))
+    return run_scenarios( df, median_price=median_price, season_prices=season_prices )
+
+@st.experimental_singleton # Every buy x sale rule of the scenario grid, ranked by profit, once per dataset version
+def get_scenarios( version, _data, _zip_cube, _season_cube ):
+    scenarios = build_scenarios( _data, _zip_cube, _season_cube )
+    return scenarios
+
+# Comparable properties
+def build_comparables( data, k ):
+    """ Comparables median of every property (KD-tree of lat / long)
+    :param data: HouseDataset
+    :param k: number of neighbours
+    :return: comparables prices """
+    index = ComparablesIndex( data['lat'], data['long'] )
+    return comparables( index, data['price'], data['price_m2'], k=k )
+
+@st.experimental_singleton # KD-tree of lat / long, and the comparables median of every property per number of neighbours
+def get_comparables( version, _data, k ):
+    prices = build_comparables( _data, k )
+    return prices
+
+# Render cache
+@st.experimental_singleton # Figure JSON / map HTML by hash of their inputs, shared by every session (HOUSE_ROCKET_RENDER_CACHE_DIR: disk tier)
+def get_render_cache():
+    cache = RenderCache( max_bytes=int(os.environ.get('HOUSE_ROCKET_RENDER_CACHE_MB', 64)) * 2**20,
+                         store_dir=os.environ.get('HOUSE_ROCKET_RENDER_CACHE_DIR') )
+    return cache
+
+# Prefetch
+@st.experimental_singleton # Threads rendering the charts of the neighbouring widget values into the render cache (HOUSE_ROCKET_PREFETCH=0: off)
+def get_prefetcher():
+    prefetcher = Prefetcher( get_render_cache(), workers=int(os.environ.get('HOUSE_ROCKET_PREFETCH_WORKERS', 2)) )
+    return prefetcher
+
+# Map clusters
+@st.experimental_singleton # Grid clusters of every zoom level, built once per dataset version
+def get_clusters( version, _data ):
+    clusters = cluster_levels( _data['lat'], _data['long'], price=_data['price'] )
+    return clusters
 
 # ============================================================================================================================================
     # DATA TRANSFORMATION
@@ -32,7 +200,7 @@ st.set_page_config(	layout="wide")
 c1, c2 = st.columns((1,3))
 # image
 with c1:
-    photo = Image.open('house_rocket_img.jpg')
+    photo = get_header_image( 'house_rocket_img.jpg' )
     st.image(photo, width=300)
 
 #headers
@@ -62,19 +230,156 @@ def perc_diff(bigger, smaller):
     dif_perc = round(((bigger - smaller) / smaller * 100), 2)
     return dif_perc
 
-def set_feature ( data ):
-    """ Converts sqft_lot in m2_lot
-    :param data: dataset with column 'sqft_lot'
-    :return: dataset with column 'price_m2'
-    """""
-    data['m2_lot'] = (data['sqft_lot'] / 10.764)
-    data['price_m2'] = data['price'] / data['m2_lot']
-    return data
+def histogram_figure( x, counts, name, widths=None ):
+    """ Bar chart of pre-computed histogram counts (only bins and counts are sent to the browser)
+    :param x: bin centers or values
+    :param counts: number of houses of each bin
+    :param name: x axis title
+    :param widths: bar widths, for continuous bins
+    :return: plotly figure """
+    import plotly.express as px
+    fig = px.bar(x=x, y=counts, labels={'x': name, 'y': 'count'})
+    if widths is not None:
+        fig.update_traces(width=widths)
+        fig.update_layout(bargap=0)
+    return fig
+
+def year_built_chart( series, start ):
+    """ Average price of each yr_built since start, from the running sums
+    :param series: time-series stores
+    :param start: first year built
+    :return: inputs list and build function of the chart """
+    import plotly.express as px
+    years, prices = series['yr_built'].series( start=start, max_points=MAX_POINTS )
+    df = pd.DataFrame({'yr_built': years, 'price': prices})
+    return [df], lambda: px.line(df, x='yr_built', y='price')
+
+def period_chart( series, period, start ):
+    """ Average price of each period since start, downsampled to MAX_POINTS points
+    :param series: time-series stores
+    :param period: Day, Week or Month
+    :param start: first date (datetime)
+    :return: inputs list and build function of the chart """
+    import plotly.express as px
+    dates, prices = series[period].series( start=np.datetime64(start), max_points=MAX_POINTS )
+    df = pd.DataFrame({'date': dates, 'price': prices})
+    return [df], lambda: px.line(df, x='date', y='price')
+
+def price_chart( histograms, upto ):
+    """ Histogram of the prices <= upto, from the cumulative counts (nbins = número de barras)
+    :param histograms: histograms of the dataset
+    :param upto: max price
+    :return: inputs list and build function of the chart """
+    edges, counts = histograms['price'].bins( nbins=50, upto=upto )
+    return [edges, counts], lambda: histogram_figure( ( edges[:-1] + edges[1:] ) / 2, counts, 'price', widths=np.diff(edges) )
+
+def attribute_chart( histograms, name, upto=None, only=None ):
+    """ Histogram of a discrete attribute (bedrooms, bathrooms, floors, waterfront)
+    :param histograms: histograms of the dataset
+    :param name: attribute
+    :param upto: max value
+    :param only: values to keep
+    :return: inputs list and build function of the chart """
+    values, counts = histograms[name].bins( upto=upto, only=only )
+    return [values, counts, name], lambda: histogram_figure( values, counts, name )
+
+def prefetch_chart( kind, chart, *args ):
+    """ Queues a chart of a likely next widget value, rendered in the background after this rerun
+    :param kind: name of the chart
+    :param chart: function returning the inputs and build function of the chart
+    :param args: arguments of chart (the widget values) """
+    # same allowance, so the same render key, as the chart would get in the foreground (plotly_cached)
+    limit = budget.allowance()
+    def prepare():
+        inputs, build = chart( *args )
+        return inputs + [limit], lambda: fit_figure( build(), limit, kind )
+    upcoming.append(( kind, prepare ))
+
+def plotly_cached( target, kind, inputs, build, use_container_width=True ):
+    """ Shows a plotly chart, built and serialized only when its inputs change (render cache),
+    reduced when it doesn't fit in the payload budget
+    :param target: st or a column
+    :param kind: name of the chart
+    :param inputs: list of the data and parameters the figure is built from
+    :param build: function returning the plotly figure
+    :return: figure JSON """
+    import plotly.io as pio
+    limit = budget.allowance()
+    # the figure parsed from the JSON is kept with it in the render cache: a hit doesn't parse it again
+    text, fig = prefetcher.render( kind, inputs + [limit], lambda: fit_figure( build(), limit, kind ), parse=pio.from_json )
+    budget.spend( kind, text, fig.layout.meta )
+    target.plotly_chart(fig, use_container_width=use_container_width)
+    return text
+
+def folium_cached( target, kind, inputs, build, coarser=(), width=700, height=500 ):
+    """ Shows a folium map, built and rendered to HTML only when its inputs change (render cache),
+    replaced by a coarser version when it doesn't fit in the payload budget
+    :param target: st or a column
+    :param kind: name of the map
+    :param inputs: list of the data and parameters the map is built from
+    :param build: function returning the folium map
+    :param coarser: (reduction, inputs, build) of lighter versions of the map, finest first: the first one
+                    that fits is sent (the last one when none fits)
+    :param width: width of the frame
+    :param height: height of the map
+    :return: map HTML """
+    import folium
+    import streamlit.components.v1 as components
+    render = lambda inputs, build: prefetcher.render( kind, inputs, lambda: folium.Figure().add_child(build()).render() )
+    text = render( inputs, build )
+    size, reductions = len(text), []
+    for reduction, inputs, build in coarser:
+        if len(text) <= budget.allowance():
+            break
+        text = render( inputs, build )
+        reductions.append('{} ({:,} bytes)'.format(reduction, len(text)))
+    budget.spend( kind, text, {'payload_bytes': size, 'reductions': reductions} )
+    with target:
+        components.html(text, height=height + 10, width=width)
+    return text
+
+def paged_table( table, key, rows=None, columns=None ):
+    """ Shows one page of a table, with sorting, paging and export widgets (only the page is sent to the browser)
+    :param table: PagedTable
+    :param key: unique prefix of the widget keys
+    :param rows: boolean mask or index array of the rows to show. Default: all
+    :param columns: columns to show. Default: all
+    :return: dataframe of the page """
+    c1, c2, c3, c4 = st.columns(4)
+    sort_by = c1.selectbox('Sort by', ['-'] + (table.columns if columns is None else list(columns)), key=key + '_sort')
+    ascending = c2.selectbox('Order', ['ascending', 'descending'], key=key + '_order') == 'ascending'
+    page_size = c3.selectbox('Rows per page', [10, 50, 100, 500], index=1, key=key + '_size')
+    page = c4.number_input('Page', min_value=1, max_value=table.pages( page_size, rows ), value=1, key=key + '_page')
+
+    selection = {'rows': rows, 'sort_by': None if sort_by == '-' else sort_by, 'ascending': ascending, 'columns': columns}
+    window = table.window( page, page_size, **selection )
+    st.dataframe(window)
+
+    first = ( page - 1 ) * page_size
+    st.write('rows {} to {} of {}'.format(min(first + 1, table.count( rows )), first + len(window), table.count( rows )))
+
+    # Export: the whole selection is written in chunks to a temporary file of this session, whose handle is
+    # given to the download button (read once, no copy built in memory), then deleted
+    if st.button('Export csv', key=key + '_export'):
+        fd, path = tempfile.mkstemp(prefix='house_rocket_{}.'.format(key), suffix='.csv')
+        os.close(fd)
+        try:
+            table.export( path, **selection )
+            with open(path, 'rb') as export:
+                st.download_button('Download {}.csv'.format(key), export, file_name='{}.csv'.format(key),
+                                   mime='text/csv', key=key + '_download')
+        finally:
+            os.remove(path)
+    return window
+
+# Charts and maps sent by each session: the page budget is split in equal shares between them (PayloadBudget).
+# Update when a session gets or loses one (more elements sent than counted here is logged)
+PAGE_ELEMENTS = {'Region Overview': 2, 'Commercial Attributes': 2, 'House Attributes': 5, 'Buy Repport': 1}
 
 # ========================================================================
 # Create session: "Data Overview"
 # ========================================================================
-def overview_data( data ):
+def overview_data( data, cube, index, table, stats ):
     # 1. Filtros dos imóveis por um ou várias regiões.
     # Objetivo: Visualizar imóveis por código postal (zipcode)
     # Obs: várias lat/lot neste dataset tem mesmo zipcode, logo podemos utilizar como agrupador de região.
@@ -92,34 +397,31 @@ def overview_data( data ):
     f_attributes = st.sidebar.multiselect('Enter Columns', data.columns)
 
     f_zipcode = st.sidebar.multiselect('Enter zipcode',
-                                       data['zipcode'].unique())
+                                       pd.unique(data['zipcode']))
 
-    # Attributes + zipcode -> need rows and cols
-    if (f_zipcode != []) & (f_attributes != []):
-        # data_overview is used just for the first table
-        data_overview = data.loc[data['zipcode'].isin(f_zipcode), f_attributes]
-        # data is used for the other components that not first table
-        data = data.loc[data['zipcode'].isin(f_zipcode), :]
+    # zipcode -> filter rows (mask is used by all components); no zipcode -> all rows
+    if f_zipcode == []:
+        mask = None
+    else:
+        mask = index.rows( index.member('zipcode', f_zipcode) )
 
-        # just zipcode -> just filter rows, all colums
-    elif (f_zipcode != []) & (f_attributes == []):
-        data_overview = data.loc[data['zipcode'].isin(f_zipcode), :]
-        data = data.loc[data['zipcode'].isin(f_zipcode), :]
+    # attributes -> filter cols of the first table; no attributes -> all columns
+    columns = f_attributes if f_attributes != [] else None
 
-        # just attributes -> just filter cols, all rows
-    elif (f_zipcode == []) & (f_attributes != []):
-        data_overview = data.loc[:, f_attributes]
+    profile.rows( len(data) if mask is None else len(mask) )
 
-        # no attributes -> returns original ds
-    else:
-        data_overview = data.copy()
+    # likely next selection: one of the zipcodes with the most houses added, bitmap computed in the background
+    for zipcode in cube[('price', 'count')].nlargest(TOP_ZIPCODES).index:
+        if zipcode not in f_zipcode:
+            upcoming.append(( None, lambda z=zipcode: index.member('zipcode', list(f_zipcode) + [z]) ))
 
 # Table: Data Overview ----------------------------------------------------
 
     st.title('Data Overview')
 
-    # Show all columns
-    st.write(data_overview.head(), height=400)
+    # Paginated table of the filtered rows and columns: only the current page is sent
+    data_overview = paged_table( table, 'data_overview', rows=mask, columns=columns )
+    profile.payload( 'Data Overview', data_overview )
 
 
 # Table: Averages by Zip Code ---------------------------------------------
@@ -133,16 +435,9 @@ def overview_data( data ):
     # Create 2 columns with same size
     c1, c2 = st.columns((1, 1))
 
-    # Average metrics
-    df1 = data[['id', 'zipcode']].groupby('zipcode').count().reset_index()
-    df2 = data[['price', 'zipcode']].groupby('zipcode').mean().reset_index()
-    df3 = data[['sqft_living', 'zipcode']].groupby('zipcode').mean().reset_index()
-    df4 = data[['price_m2', 'zipcode']].groupby('zipcode').mean().reset_index()
-
-    # Merge dataframes by zipcode
-    m1 = pd.merge(df1, df2, on='zipcode', how='inner')
-    m2 = pd.merge(m1, df3, on='zipcode', how='inner')
-    df = pd.merge(m2, df4, on='zipcode', how='inner')
+    # Average metrics of the selected zipcodes, read from the zipcode cube
+    df = select( cube, 'zipcode', f_zipcode )
+    df = df[[('price', 'count'), ('price', 'mean'), ('sqft_living', 'mean'), ('price_m2', 'mean')]].reset_index()
 
     # Rename columns
     df.columns = ['zipcode', 'total houses', 'price', 'sqrt living, ', 'price/m2']
@@ -150,6 +445,7 @@ def overview_data( data ):
     # Show dataframe in c1 (left)
     c1.header('Averages by Zip Code')
     c1.dataframe(df, height=300)
+    profile.payload( 'Averages by Zip Code', df )
 
 # Table: Descriptive Attributes ----------------------------------------------
 
@@ -158,17 +454,8 @@ def overview_data( data ):
     # Ação do Usuário: Digitar as métricas desejadas.
     # A visualização: Uma tabela com métricas descritivas por atributo.
 
-    # Calculate descriptive metrics
-    num_attributes = data.select_dtypes(include=['int64', 'float64'])
-    media = pd.DataFrame(num_attributes.apply(np.mean))
-    mediana = pd.DataFrame(num_attributes.apply(np.median))
-    std = pd.DataFrame(num_attributes.apply(np.std))
-
-    max_ = pd.DataFrame(num_attributes.apply(np.max))
-    min_ = pd.DataFrame(num_attributes.apply(np.min))
-
-    # Concat columns on same dataframe
-    df1 = pd.concat([max_, min_, media, mediana, std], axis=1).reset_index()
+    # Descriptive metrics of the selected zipcodes, merged from the zipcode summaries (no row scan)
+    df1 = stats.describe( f_zipcode ).reset_index()
 
     # Rename columns
     df1.columns = ['attributes', 'max', 'min', 'mean', 'median', 'std']
@@ -176,6 +463,9 @@ def overview_data( data ):
     # Show dataframe in c2 (right)
     c2.header('Descriptive Attributes')
     c2.dataframe(df1, height=300)
+    sketched = [c for c in stats.columns if stats.error_bound( c ) > 0]
+    c2.write('Median within ±{:.0%} for: {}'.format(stats.relative_accuracy, ', '.join(sketched)))
+    profile.payload( 'Descriptive Attributes', df1 )
 
     return None
 
@@ -183,7 +473,9 @@ def overview_data( data ):
 # ========================================================================
 # Create session: "Region Overview"
 # ========================================================================
-def portifolio_density ( data, geofile ):
+def portifolio_density ( data, url, cube, clusters ):
+    import branca
+    import folium
 
     # 5. Uma mapa com a densidade de portfólio por região e também densidade de preço.
     # Densidade: concentração de alguma coisa.
@@ -197,58 +489,86 @@ def portifolio_density ( data, geofile ):
 # Map: Portfolio Density ------------------------------------------------
 
     c1.header('Portfolio Density')
-    df = data.head(500)
-
-    # Base Map - Folium (empty map)
-    density_map = folium.Map(location=[data['lat'].mean(),
-                                       data['long'].mean()],
-                             default_zoom_start=15)
-
-    # Add points on map
-    marker_cluster = MarkerCluster().add_to(density_map)
-    for name, row in df.iterrows():
-        folium.Marker([row['lat'], row['long']],
-                      # card function, showing features:
-                      popup='Sold R${0} on: {1}. Features: {2} sqft, {3} bedrooms, {4} bathrooms, year built: {5}'.format(
-                          row['price'],
-                          row['date'],
-                          row['sqft_living'],
-                          row['bedrooms'],
-                          row['bathrooms'],
-                          row['yr_built'])).add_to(marker_cluster)
-    # Plot map
-    with c1:
-        folium_static(density_map)
+    # Every property, pre-clustered on a grid: finest zoom level with at most 500 clusters
+    zoom = pick_zoom( clusters, max_clusters=500 )
+    df = clusters[zoom]
+    profile.rows( len(df) )
+
+    # Full-resolution points where the clusters hide the most properties: densest cells of the finest zoom level
+    points = data.frame( columns=['id', 'lat', 'long', 'price', 'bedrooms', 'sqft_living'],
+                         mask=dense_points( data['lat'], data['long'], clusters ) )
+    profile.rows( len(points) )
+
+    center = [data['lat'].mean(), data['long'].mean()]
+
+    def density_map( df, zoom ):
+        # Base Map - Folium (empty map)
+        density_map = folium.Map(location=center,
+                                 zoom_start=zoom)
+
+        # Add clusters on map: one cell per cluster, colored by number of properties
+        colormap = branca.colormap.linear.YlOrRd_09.scale(df['count'].min(), df['count'].max())
+        colormap.caption = 'PROPERTIES'
+        folium.GeoJson(cells_geojson( df ),
+                       style_function=lambda feature: {'fillColor': colormap(feature['properties']['count']),
+                                                       'fillOpacity': 0.6,
+                                                       'weight': 0.3,
+                                                       'color': 'gray'},
+                       # card function, showing cluster features:
+                       tooltip=folium.GeoJsonTooltip(fields=['count', 'mean_price'],
+                                                     aliases=['Properties', 'Average price R$'])).add_to(density_map)
+
+        # Add points on map: one marker per property of the densest cells, card with its features
+        folium.GeoJson(points_geojson( points, properties=['id', 'price', 'bedrooms', 'sqft_living'] ),
+                       popup=folium.GeoJsonPopup(fields=['id', 'price', 'bedrooms', 'sqft_living'],
+                                                 aliases=['ID', 'Price R$', 'Bedrooms', 'Living room size'])).add_to(density_map)
+        colormap.add_to(density_map)
+        return density_map
+
+    # Plot map: rendered once per cluster set (it doesn't depend on any widget); over budget, the clusters of
+    # the coarser zoom levels are tried, the points are kept
+    coarser = [('zoom {} -> {}'.format(zoom, z), [clusters[z], points, center, z], lambda z=z: density_map( clusters[z], z ))
+               for z in sorted(clusters, reverse=True) if z < zoom]
+    html = folium_cached( c1, 'Portfolio Density', [df, points, center, zoom], lambda: density_map( df, zoom ), coarser )
+    profile.payload( 'Portfolio Density', html )
 
 
 # Map: Price Density ----------------------------------------------------
     c2.header('Price Density')
 
     # Average price by zipcode
-    df = data[['price', 'zipcode']].groupby('zipcode').mean().reset_index()
+    df = cube[('price', 'mean')].reset_index()
     # Rename columns
     df.columns = ['ZIP', 'PRICE']
-
-    # Filter only dataset regions on geofile file
-    geofile = geofile[geofile['ZIP'].isin(df['ZIP'].tolist())]
-
-    # Creates base map
-    region_price_map = folium.Map(location=[data['lat'].mean(),
-                                            data['long'].mean()],
-                                  default_zoom_start=15)
-
-    # Plots density by color
-    region_price_map.choropleth(data=df,
-                                geo_data=geofile,
-                                columns=['ZIP', 'PRICE'],
-                                key_on='feature.properties.ZIP',  # join com meus dados
-                                fill_color='YlOrRd',
-                                fill_opacity=0.7,
-                                line_opacity=0.3,  # 0.2
-                                legend_name='AVERAGE PRICE ($)')
-    # Plot map
-    with c2:
-        folium_static(region_price_map)
+    profile.rows( len(df) )
+
+    def region_price_map( geofile ):
+        # Filter only dataset regions on geofile file (simplified polygons of these zipcodes)
+        zips = feature_collection( geofile, df['ZIP'].tolist() )
+
+        # Creates base map
+        region_price_map = folium.Map(location=center,
+                                      default_zoom_start=15)
+
+        # Plots density by color
+        region_price_map.choropleth(data=df,
+                                    geo_data=zips,
+                                    columns=['ZIP', 'PRICE'],
+                                    key_on='feature.properties.ZIP',  # join com meus dados
+                                    fill_color='YlOrRd',
+                                    fill_opacity=0.7,
+                                    line_opacity=0.3,  # 0.2
+                                    legend_name='AVERAGE PRICE ($)')
+        return region_price_map
+
+    # Plot map: the polygons are keyed by the version of the geometry store, not hashed; over budget, the
+    # more simplified polygons of the store are tried
+    geofile, geofile_version = get_geofile( url )
+    coarser = [('polygons simplified at {:g}'.format(t), [df, get_geofile( url, t )[1], center],
+                lambda t=t: region_price_map( get_geofile( url, t )[0] ))
+               for t in TOLERANCES if t > DEFAULT_TOLERANCE]
+    html = folium_cached( c2, 'Price Density', [df, geofile_version, center], lambda: region_price_map( geofile ), coarser )
+    profile.payload( 'Price Density', html )
 
     return None
 
@@ -256,8 +576,7 @@ def portifolio_density ( data, geofile ):
 # ========================================================================
 # Create session: "Commercial Attributes"
 # ========================================================================
-def commercial ( data ):
-
+def commercial ( series, since=None ):
     st.title('Commercial Attributes')
 
 # Line Graph: Average Price per Year Built ------------------------------
@@ -272,29 +591,31 @@ def commercial ( data ):
     st.sidebar.title('----------------- # ------------------')
     st.sidebar.title('Commercial Attributes')
 
-    # Extract date
-    data['date'] = pd.to_datetime(data['date']).dt.strftime('%Y-%m-%d')
-
     # Filter - Average Price per Year Built
-    min_year_built = int(data['yr_built'].min())
-    max_year_built = int(data['yr_built'].max())
+    min_year_built = int(series['yr_built'].keys[0])
+    max_year_built = int(series['yr_built'].keys[-1])
 
     st.sidebar.subheader('Average Price per Year Built')
     f_year_built = st.sidebar.slider('Min Year Built', min_year_built,
                                      max_year_built,
                                      min_year_built)  # default
 
-    # Use filter data
-    df = data.loc[data['yr_built'] >= f_year_built]
+    # Use filter data: average price of each yr_built since f_year_built, from the running sums
+    inputs, build = year_built_chart( series, f_year_built )
+    mean_price, count = series['yr_built'].range_mean( start=f_year_built )
+    profile.rows( len(inputs[0]) )
 
  # Graph
     st.header('Average Price per Year Built')
-
-    df = df[['yr_built', 'price']].groupby('yr_built').mean().reset_index()
+    st.write('Average price since {}: $ {:,.2f} ({} houses)'.format(f_year_built, mean_price, count))
 
     # Plot
-    fig = px.line(df, x='yr_built', y='price')
-    st.plotly_chart(fig, use_container_width=True)
+    fig = plotly_cached( st, 'Average Price per Year Built', inputs, build )
+    profile.payload( 'Average Price per Year Built', fig )
+
+    # Next years of the slider, in the background
+    for year in neighbours( range(min_year_built, max_year_built + 1), f_year_built, steps=(-1, 1, -5, 5) ):
+        prefetch_chart( 'Average Price per Year Built', year_built_chart, series, year )
 
 
 # Line Graph: Average Price per Day -----------------------------------
@@ -307,25 +628,40 @@ def commercial ( data ):
 # Filter
     st.sidebar.subheader('Average Price per Day')
 
-    min_date = datetime.strptime(data['date'].min(), '%Y-%m-%d')
-    max_date = datetime.strptime(data['date'].max(), '%Y-%m-%d')
+    # Period of the chart: day, week or month
+    f_period = st.sidebar.selectbox('Period', list(FREQUENCIES), index=0)
 
-    f_date = st.sidebar.slider('Min Date', min_date, max_date, min_date)
-    # st.write(type(data['date'][0]))
+    # Sale days of the date store
+    min_date = pd.Timestamp(series['Day'].keys[0]).to_pydatetime()
+    max_date = pd.Timestamp(series['Day'].keys[-1]).to_pydatetime()
 
-    data['date'] = pd.to_datetime(data['date'])
+    f_date = st.sidebar.slider('Min Date', min_date, max_date, min_date)
 
-    # Use filter data
-    df = data.loc[data['date'] >= f_date]
+    # Use filter data: average price of each period since f_date, downsampled to MAX_POINTS points
+    # (since: series of the partitions with sales after f_date only, partitioned store)
+    date_series = series if since is None else since( f_date )
+    inputs, build = period_chart( date_series, f_period, f_date )
+    mean_price, count = date_series['Day'].range_mean( start=np.datetime64(f_date) )
+    profile.rows( len(inputs[0]) )
 
 # Graph
-    st.header('Average Price per Day')
-
-    df = df[['date', 'price']].groupby('date').mean().reset_index()
+    st.header('Average Price per {}'.format(f_period))
+    st.write('Average price since {:%Y-%m-%d}: $ {:,.2f} ({} houses)'.format(f_date, mean_price, count))
 
     # Plot
-    fig = px.line(df, x='date', y='price')
-    st.plotly_chart(fig, use_container_width=True)
+    fig = plotly_cached( st, 'Average Price per Period', inputs, build )
+    profile.payload( 'Average Price per {}'.format(f_period), fig )
+
+    # Next days / weeks of the slider and the other periods, in the background
+    # (the series since each date is computed by the background job too, not by this rerun)
+    since_chart = lambda date, period: period_chart( series if since is None else since( date ), period, date )
+    for days in (-7, -1, 1, 7):
+        date = f_date + pd.Timedelta(days=days)
+        if min_date <= date <= max_date:
+            prefetch_chart( 'Average Price per Period', since_chart, date, f_period )
+    for period in FREQUENCIES:
+        if period != f_period:
+            prefetch_chart( 'Average Price per Period', period_chart, date_series, period, f_date )
 
     return None
 
@@ -334,7 +670,7 @@ def commercial ( data ):
 # ========================================================================
 # create session "House Attributes"
 # ========================================================================
-def attributes_distribuition ( data ):
+def attributes_distribuition ( histograms ):
 
     # 8. Conferir a distribuição dos imóveis (histograma) por:
     # - Preço;
@@ -356,100 +692,104 @@ def attributes_distribuition ( data ):
     st.sidebar.subheader('Price Distribution')
 
     # Range values
-    min_price = int(data['price'].min())
-    max_price = int(data['price'].max())
+    min_price = int(histograms['price'].min)
+    max_price = int(histograms['price'].max)
 
     f_price = st.sidebar.slider('Max Price', min_price, max_price, max_price)
 
-    # Data filtering
-    df = data.loc[data['price'] <= f_price]
+    # Histogram of the prices <= f_price, from the cumulative counts (nbins = número de barras)
+    inputs, build = price_chart( histograms, f_price )
+    profile.rows( len(inputs[1]) )
 
 # Graph
     st.header('Price Distribution')
 
     # Plot
-    fig = px.histogram(df, x='price', nbins=50)  # nbins = número de barras
-    st.plotly_chart(fig, use_container_width=True)
+    fig = plotly_cached( st, 'Price Distribution', inputs, build )
+    profile.payload( 'Price Distribution', fig )
+
+    # Next positions of the slider (arrow keys, one chart bin up or down), in the background
+    width = max(1, int(( f_price - min_price ) / 50))
+    for price in sorted({f_price - width, f_price - 1, f_price + 1, f_price + width}):
+        if min_price <= price <= max_price:
+            prefetch_chart( 'Price Distribution', price_chart, histograms, price )
 
 
 # Bar Graph: Houses per Bedroom -------------------------------------
 # Filter
     st.sidebar.subheader('Houses per Bedroom')
 
-    # Get nd array unique bedrooms list
-    unique_bedrooms = data['bedrooms'].unique()
-
-    #Converts nd array to dict, and then to list to pass to index of selectbox:
-    unique_bedrooms_list = list(dict(enumerate(unique_bedrooms.flatten(), 0)))
-
-    # index sorted by the last key of dictionary (grater number)
-    f_bedrooms = st.sidebar.selectbox('Max Number of Bedrooms', sorted(set(data['bedrooms'].unique())), index=list(unique_bedrooms_list).index( unique_bedrooms_list[-1] ) )
+    # Sorted bedrooms values, default is the last one (grater number)
+    unique_bedrooms = list(histograms['bedrooms'].values)
+    f_bedrooms = st.sidebar.selectbox('Max Number of Bedrooms', unique_bedrooms, index=len(unique_bedrooms) - 1 )
 
     #Graph
     c1, c2 = st.columns(2)
 
     c1.header('Houses per Bedroom')
 
-    df = data[data['bedrooms'] <= f_bedrooms]
-    fig = px.histogram(df, x='bedrooms', nbins=19)
-    c1.plotly_chart(fig, use_container_width=True)
+    inputs, build = attribute_chart( histograms, 'bedrooms', upto=f_bedrooms )
+    profile.rows( len(inputs[1]) )
+    fig = plotly_cached( c1, 'histogram', inputs, build )
+    profile.payload( 'Houses per Bedroom', fig )
+
+    for value in neighbours( unique_bedrooms, f_bedrooms ):
+        prefetch_chart( 'histogram', attribute_chart, histograms, 'bedrooms', value )
 
 # Bar Graph: Houses per Bathroom ------------------------------------
 #Filter
     st.sidebar.subheader('Houses per Bathroom')
 
-    # Get nd array unique bathrooms list
-    unique_bathrooms = data['bathrooms'].unique()
-
-    # Converts nd array to dict, and then to list to pass to index of selectbox:
-    unique_bathrooms_list = list(dict(enumerate(unique_bathrooms.flatten(), 0)))
-
-    # index sorted by the last key of dictionary (grater number)
-    f_bathrooms = st.sidebar.selectbox('Max Number of Bathrooms', sorted(set(data['bathrooms'].unique())), index=list(unique_bathrooms_list).index(unique_bathrooms_list[-1]) )
+    # Sorted bathrooms values, default is the last one (grater number)
+    unique_bathrooms = list(histograms['bathrooms'].values)
+    f_bathrooms = st.sidebar.selectbox('Max Number of Bathrooms', unique_bathrooms, index=len(unique_bathrooms) - 1 )
 
 # Graph
     c2.header('Houses per Bathroom')
 
-    df = data[data['bathrooms'] <= f_bathrooms]
-    fig = px.histogram(df, x='bathrooms', nbins=19)
-    c2.plotly_chart(fig, use_container_width=True)
+    inputs, build = attribute_chart( histograms, 'bathrooms', upto=f_bathrooms )
+    profile.rows( len(inputs[1]) )
+    fig = plotly_cached( c2, 'histogram', inputs, build )
+    profile.payload( 'Houses per Bathroom', fig )
+
+    for value in neighbours( unique_bathrooms, f_bathrooms ):
+        prefetch_chart( 'histogram', attribute_chart, histograms, 'bathrooms', value )
 
 # Bar Graph: Houses per Floor ---------------------------------------
 # Filter
     st.sidebar.subheader('Houses per Floor')
 
-    # Get nd array unique bathrooms list
-    unique_floors = data['floors'].unique()
-
-    # Converts nd array to dict, and then to list to pass to index of selectbox:
-    unique_floors_list = list(dict(enumerate(unique_floors.flatten(), 0)))
-
-    # index sorted by the last key of dictionary (grater number)
-    f_floors = st.sidebar.selectbox('Max Number of Floors', sorted(set(data['floors'].unique())),index=list(unique_floors_list).index(unique_floors_list[-1]) )
+    # Sorted floors values, default is the last one (grater number)
+    unique_floors = list(histograms['floors'].values)
+    f_floors = st.sidebar.selectbox('Max Number of Floors', unique_floors, index=len(unique_floors) - 1 )
 
 # Graph
     c1, c2 = st.columns(2)
 
     c1.header('Houses per Floor')
-    df = data[data['floors'] <= f_floors]
+    inputs, build = attribute_chart( histograms, 'floors', upto=f_floors )
+    profile.rows( len(inputs[1]) )
 
-    fig = px.histogram(df, x='floors', nbins=19)
-    c1.plotly_chart(fig, use_container_width=True)
+    fig = plotly_cached( c1, 'histogram', inputs, build )
+    profile.payload( 'Houses per Floor', fig )
+
+    for value in neighbours( unique_floors, f_floors ):
+        prefetch_chart( 'histogram', attribute_chart, histograms, 'floors', value )
 
 # Bar Graph: Waterview ----------------------------------------------
 # Filter
     st.sidebar.subheader('Waterview')
     f_waterview = st.sidebar.checkbox('Only Houses with Waterview')
 
-    if f_waterview:
-        df = data[data['waterfront'] == 1]
-    else:
-        df = data.copy()
+    inputs, build = attribute_chart( histograms, 'waterfront', only=[1] if f_waterview else None )
+    profile.rows( len(inputs[1]) )
 
 # Graph
     c2.header('Waterview')
-    fig = px.histogram(df, x='waterfront', nbins=10)
-    c2.plotly_chart(fig, use_container_width=True)
+    fig = plotly_cached( c2, 'histogram', inputs, build )
+    profile.payload( 'Waterview', fig )
+
+    prefetch_chart( 'histogram', attribute_chart, histograms, 'waterfront', None, None if f_waterview else [1] )
 
     return None
 
@@ -458,7 +798,8 @@ def attributes_distribuition ( data ):
 # Create session "Business Recommendations" and "Buy Repport"
 # ========================================================================
 
-def buy_repport(data):
+def buy_repport(data, cube, comparables_of):
+    import plotly.express as px
 
     st.title('Business Recommendations')
 
@@ -467,43 +808,25 @@ def buy_repport(data):
 # Problema de negócio 1: Quais são os imóveis que a House Rocket deveria comprar e por qual preço ?
 
 #Relatório
-    # Confirmar que condição 5 é a melhor, validando a subida de preços por condição
-    data[['condition', 'price']].groupby('condition').mean().reset_index()
-
-    # Agrupar os imóveis por região ( zipcode )
-    dfzip = data[['price', 'zipcode']].groupby('zipcode').median().reset_index()
-
-    # Sugerir os imóveis que estão abaixo do preço mediano da região, que estejam em boas condições e tenham vista para água
-    # Unir o dataframe dfzip com o data, pelo zipcode
-    df2 = pd.merge(data, dfzip, on='zipcode', how='inner')
-
-    # Renomear colunas do novo ds
-    df2.rename(columns={'price_x': 'buy_price', 'price_y': 'median_price'}, inplace=True)  # to keep in the same df
-
-    # Percorre valores e atribui para variável 'recommendation' a recomomendação: 'compra' ou 'não compra'
-    df2['recommendation'] = 'NA'
-
-    for i in range(len(df2)):
-        if ( df2.loc[i, 'buy_price'] < df2.loc[i, 'median_price'] ) & ( df2.loc[i, 'condition'] >= 4 ) & ( df2.loc[i, 'waterfront'] == 1 ):
-            df2.loc[i, 'recommendation'] = 'compra'
-        else:
-            df2.loc[i, 'recommendation'] = 'não compra'
-
-    # Cria DS só com imóveis recomendados para compra:
-    recom_buy = df2.loc[df2['recommendation'] == 'compra'].copy()
-
-    # Cria coluna 'condition_status' para traduzir o que é cada uma 'condition'
-    recom_buy['condition_status'] = "NA"
-    recom_buy['condition_status'] = recom_buy['condition'].apply( lambda x: 'excelente' if x == 5 else "muito bom" if x == 4 else None )
-
-    # Cria um relatório só com as informações relevantes
-    rep_buy = recom_buy[['id', 'zipcode', 'buy_price', 'median_price', 'condition_status', 'recommendation', 'lat', 'long']]
-
-    # Ressetar índices para estética no relatório
-    rep_buy = rep_buy.reset_index(drop=True)
+    # Preço de referência: mediana do zipcode, ou mediana dos k imóveis mais próximos (comparáveis)
+    reference = st.radio('Reference price', ['Zipcode median', 'Comparables median'])
+
+    # Sugerir os imóveis que estão abaixo do preço de referência, que estejam em boas condições e tenham vista para água
+    # Relatório só com imóveis recomendados para compra ('compra') e as informações relevantes
+    df = data.frame( columns=['id', 'zipcode', 'price', 'condition', 'waterfront', 'lat', 'long'] )
+    if reference == 'Comparables median':
+        k = st.slider('Nearest comparables', 5, 50, 10)
+        prices = comparables_of( k )
+        rep_buy = buy_report( df, reference_price=prices['comparables_price'], min_condition=4, waterfront=True )
+    else:
+        # Agrupar os imóveis por região ( zipcode )
+        dfzip = cube[('price', 'median')].rename('price').reset_index()
+        rep_buy = buy_report( df, median_price=dfzip, min_condition=4, waterfront=True )
+    profile.rows( len(df) )
 
-    # Exibe o relatório
-    st.dataframe(rep_buy)
+    # Exibe o relatório, paginado
+    page = paged_table( PagedTable( rep_buy ), 'buy_report' )
+    profile.payload( 'Purchasing Recommendation Report', page )
 
     st.header('Location of Recommended Properties:')
 
@@ -511,18 +834,23 @@ def buy_repport(data):
    # Cria e exibe um mapa com os imóveis recomendados para compra:
     houses = rep_buy[['id', 'lat', 'long', 'buy_price']]
 
-    fig = px.scatter_mapbox(houses,
-                            lat='lat',
-                            lon='long',
-                            size='buy_price',
-                            color_continuous_scale=px.colors.cyclical.IceFire,
-                            size_max=15,
-                            zoom=10)
+    def houses_map():
+        fig = px.scatter_mapbox(houses,
+                                lat='lat',
+                                lon='long',
+                                size='buy_price',
+                                color_continuous_scale=px.colors.cyclical.IceFire,
+                                size_max=15,
+                                zoom=10)
 
-    fig.update_layout(mapbox_style='open-street-map')
-    fig.update_layout(height=600, margin={'r': 0, 't': 0, 'l': 0, 'b': 0})
-    # fig.show()
-    st.plotly_chart(fig)
+        fig.update_layout(mapbox_style='open-street-map')
+        fig.update_layout(height=600, margin={'r': 0, 't': 0, 'l': 0, 'b': 0})
+        # fig.show()
+        return fig
+
+    # Rendered again only when the recommended houses change
+    fig = plotly_cached( st, 'Location of Recommended Properties', [houses], houses_map, use_container_width=False )
+    profile.payload( 'Location of Recommended Properties', fig )
 
     return rep_buy
 
@@ -530,7 +858,7 @@ def buy_repport(data):
 # Create sell "repport"
 # ========================================================================
 
-def sell_repport(data, recom_buy_ds):
+def sell_repport(season_cube, recom_buy_ds, scenarios):
 
     recom_buy = recom_buy_ds
 
@@ -540,83 +868,55 @@ def sell_repport(data, recom_buy_ds):
 
 #Relatório
 
-    # Criar coluna seasonality, definindo summer e winter:
-    data['date_month'] = pd.to_datetime(data['date']).dt.month  # month (int)
-
-    data['seasonality'] = "NA"
-    data['seasonality'] = data['date_month'].apply(lambda x: 'winter' if (x == 12 or x <= 2) else 'summer' if (6 <= x <= 8) else "NA")
-
-    # Keep just data on winter and summer
-    data = data.loc[data['seasonality'] != 'NA']
+    # Zipcodes com compra recomendada no mercado selecionado (King County: só o 98070)
+    bought_zips = pd.unique(recom_buy['zipcode'])
 
-    # Agora, confirmar se existe diferença de preço por sazonalidade.
-    # Como só sugeri compra no zipcode 98070, vamos obter a mediana apenas naquele zipcode por sazonalidade:
-
-    bouhgt = data.loc[data['zipcode'] == 98070] #hardcoded - only recommended to buy
-
-    group_zips = (bouhgt[['price', 'seasonality']].groupby(['seasonality']).mean().reset_index())
-
-    # Calcula a variação (mediana) de preço entre inverno x verão
-    res_price_diff = perc_diff(group_zips['price'][1], group_zips['price'][0])
-    # print(res_price_diff) #8.22 mais caro no inverno com relação ao verão
-
-    # Atribui pra depois jogar no relatório
-    winter_median_price = 537730.7692
-
-    # Condições de venda:
-    # 1 Se o preço da compra do imóvel for maior que a mediana da região + sazonalidade mais cara. O preço da venda será igual ao preço da compra + 10%
-    # 2 Se meu preço da compra for menor que a mediana da região + sazonalidade mais cara. O preço da venda será igual ao preço da compra + 30%
-
-    # Criar novo dataset unindo o ds de recomendação de compra e do de venda, pra poder calcular o lucro e ter o relatório final.
-    # Temos no ds 'recom_buy' para o relatório: id, zipcode, median_price, buy_price(compra)
-    # Obter:
-    # -1 seasonality,
-    # -2 preço da mediana da região
-    # -3 preço venda,
-    # -4 lucro
-
-    # -1 seasonality,
-    # Criar um novo ds de recomendação de venda:
-    recom_sell = recom_buy.copy()
-    # Recomendar vender no inverno, logo setar seasonality como 'winter'
-    recom_sell['seasonality'] = 'winter'  # ok
+    if len(bought_zips) == 0:
+        # Sem imóveis recomendados para compra, não há relatório de venda
+        st.write('No properties recommended for purchase in this market.')
+    else:
+        # Sazonalidade (summer e winter) já agregada no cubo zipcode x season
+        # Agora, confirmar se existe diferença de preço por sazonalidade nos zipcodes recomendados:
+        bouhgt = rollup( select( season_cube, 'zipcode', bought_zips ), by=('season',) )['price']
 
-    # -2 preço da mediana da região
-    # O preço de venda na localização recomendada de compra no inverno, e setar no relatório como 'winter_median_price'
-    recom_sell['winter_median_price'] = winter_median_price
+        group_zips = bouhgt.reindex(['summer', 'winter'])[['mean']].rename(columns={'mean': 'price'}).reset_index()
 
-    # Resetar índices para 0, 1, 2.. para percorrer laços na sequência.
-    recom_sell = recom_sell.reset_index(drop=True)
-    # print( recom_sell )
+        # Calcula a variação (mediana) de preço entre inverno x verão
+        res_price_diff = perc_diff(group_zips['price'][1], group_zips['price'][0])
+        # print(res_price_diff) #8.22 mais caro no inverno com relação ao verão
 
-    # -3 preço venda
-    # Analisar se podemos pedir 30% acima para ficar próximo à mediana como inicialmente pensado:
-    #recom_sell[['buy_price', 'winter_median_price']]
+        # Preço de referência no inverno de cada zipcode recomendado, pra depois jogar no relatório
+        winter_median_price = season_cube[('price', 'mean')].xs('winter', level='season')
 
-    # Conferindo os percentuais de diferença entre o valor pago pelas casas e a mediana para o inverno no zipcode
-    #for i in range(len(recom_sell)):
-        # print( recom_sell.loc[i, 'winter_median_price'], recom_sell.loc[i, 'buy_price'] )
-        #conf_diff = perc_diff(recom_sell.loc[i, 'winter_median_price'], recom_sell.loc[i, 'buy_price'])
-        # print (conf_diff)
+        # Condições de venda:
+        # 1 Se o preço da compra do imóvel for maior que a mediana da região + sazonalidade mais cara. O preço da venda será igual ao preço da compra + 10%
+        # 2 Se meu preço da compra for menor que a mediana da região + sazonalidade mais cara. O preço da venda será igual ao preço da compra + 30%
 
-    # Vamos com base nestes percentuais: setar os 30% planejados sobre o valor pago como valor de venda:
-    recom_sell['sale_price'] = 'NA'
-    for i in range(len(recom_sell)):
-        recom_sell.loc[i, 'sale_price'] = ((recom_sell.loc[i, 'buy_price'] * 30 / 100) + recom_sell.loc[i, 'buy_price'])
+        # Criar novo dataset unindo o ds de recomendação de compra e do de venda, pra poder calcular o lucro e ter o relatório final.
+        # Temos no ds 'recom_buy' para o relatório: id, zipcode, median_price, buy_price(compra)
+        # Obter:
+        # -1 seasonality,
+        # -2 preço da mediana da região
+        # -3 preço venda,
+        # -4 lucro
 
-    # Confere o relatório agora com preço de venda
-    # print( recom_sell)
+        # Relatório de venda: vender no inverno, pelo preço de compra + 30%, e lucro = venda - compra
+        rel_sell = sell_report( recom_buy, winter_median_price, season='winter', markup=30 )
+        profile.rows( len(recom_buy) )
 
-    # -4 lucro
-    recom_sell['profit'] = 'NA'
-    for i in range(len(recom_sell)):
-        recom_sell.loc[i, 'profit'] = (recom_sell.loc[i, 'sale_price'] - recom_sell.loc[i, 'buy_price'])
+        # Exibe o relatório, paginado
+        page = paged_table( PagedTable( rel_sell ), 'sell_report' )
+        profile.payload( 'Sales Recommendation Report', page )
 
-    # Cria relatório de vendas final:
-    rel_sell = recom_sell[['id', 'zipcode', 'seasonality', 'winter_median_price', 'buy_price', 'sale_price', 'profit']]
+# Tabela: Cenários de venda
+    # Cada cenário combina uma regra de compra (condição mínima, vista para água, preço máximo / mediana do zipcode)
+    # e uma regra de venda (estação, markup abaixo e acima da mediana da estação no zipcode), ranqueados por lucro total
+    st.header('Sales Scenarios')
 
-    # Exibe o relatório
-    st.dataframe(rel_sell)
+    top = st.slider('Scenarios shown', 5, 100, 10)
+    st.dataframe(scenarios.head(top))
+    profile.rows( len(scenarios) )
+    profile.payload( 'Sales Scenarios', scenarios.head(top) )
 
     #Rodapé
     st.write(" \n\n"
@@ -630,40 +930,161 @@ def sell_repport(data, recom_buy_ds):
 # ============================================================================================================================================
 
 if __name__ == '__main__': #ETL:
+    # Wall / CPU time, rows and payload bytes of each session (HOUSE_ROCKET_PROFILE=1,
+    # HOUSE_ROCKET_PROFILE_LOG=<file>, HOUSE_ROCKET_PROFILE_DUMP=<folder>), used by the sessions
+    profile = RerunProfile()
+    # Bytes of the charts and maps of the rerun (HOUSE_ROCKET_CHART_BUDGET_KB, HOUSE_ROCKET_PAGE_BUDGET_KB):
+    # a chart over budget is downsampled / aggregated, a map replaced by a coarser one, before it is sent.
+    # The page budget is split between the charts and maps of the sessions (PAGE_ELEMENTS): with the default
+    # budgets each one gets 1024 KB / 10 = 102 KB, below the 256 KB chart budget
+    budget = PayloadBudget( elements=sum(PAGE_ELEMENTS.values()) )
+    renders = get_render_cache()
+    # Charts of the neighbouring widget values, queued by the sessions and rendered in the background
+    # once the page is painted
+    prefetcher = get_prefetcher()
+    upcoming = []
+    profile.start()
+
 # ============================================================================================================================================
     # DATA EXTRACTION
 # ============================================================================================================================================
-    # Extract data
-    path = 'kc_house_data.csv'
-    data = get_data(path)
+    # Extract data (HOUSE_ROCKET_DATA: another csv with the same columns, e.g. the benchmark data)
+    path = os.environ.get('HOUSE_ROCKET_DATA', 'kc_house_data.csv')
 
-    # Extract geofile
+    # Extract geofile: loaded by the "Region Overview" session, so the sessions above it are painted first
     url = 'https://opendata.arcgis.com/datasets/83fc2e72903343aabff6de8cb445b81c_2.geojson'
-    geofile = get_geofile( url )
+
+    # HOUSE_ROCKET_STORE: partitioned store of several datasets (house_rocket.partitions), one selected in the sidebar
+    store = os.environ.get('HOUSE_ROCKET_STORE')
+    since = None
+    stats = None
+
+    with profile.section('Data Extraction'):
+        # HOUSE_ROCKET_MEMORY_LIMIT_MB: read the csv in bounded batches; sections run on the streamed
+        # aggregates and on a row sample instead of the full dataset
+        memory_limit = os.environ.get('HOUSE_ROCKET_MEMORY_LIMIT_MB')
+        if store:
+            catalog = get_catalog( store ).refresh()
+            # empty or new store: nothing to show until a dataset is added (house_rocket.partitions)
+            if not catalog.datasets():
+                st.error('The store {} has no dataset: add one with python -m house_rocket.partitions'.format(store))
+                st.stop()
+            st.sidebar.title('Dataset')
+            f_dataset = st.sidebar.selectbox('Market', catalog.datasets())
+            f_regions = st.sidebar.multiselect('Regions', catalog.regions( f_dataset ))
+
+            # only the partitions of the selected dataset and regions are loaded
+            entries = catalog.partitions( f_dataset, regions=f_regions )
+            if not entries:
+                st.error('The dataset {} has no partition'.format(f_dataset))
+                st.stop()
+            version = catalog.version( entries )
+            data = store_data( catalog, entries )
+            url = catalog.geofile( f_dataset )
+        elif memory_limit:
+            version = file_version( path )
+            data, cubes = get_streamed_data( version, path, int(memory_limit) * 2**20 )
+        else:
+            data = get_data(path)
+        profile.rows( len(data) )
 
 # ============================================================================================================================================
     # DATA TRANSFORMATION
 # ============================================================================================================================================
-    # Create price per square meters ('price_m2')
-    data = set_feature( data )
+    # price per square meters ('price_m2') is created once, when the dataset is loaded (HouseDataset)
+
+    with profile.section('Data Transformation'):
+        # Aggregates by zipcode, zipcode x season, zipcode x yr_built and zipcode x date
+        # partitioned store: new sales (delta partitions) only update the groups and zipcodes they touch (cubes,
+        # statistics, filter index, histograms, clusters, time series); the table, comparables and scenarios are
+        # built again after a delta. Every structure is kept for the current partitions only (get_live_aggregates)
+        if store:
+            live = get_live_aggregates( f_dataset, tuple(f_regions) )
+            aggregates = live.update( data, entries )
+            cubes, stats = aggregates['cubes'], aggregates['stats']
+            since = lambda start: date_series( live, data, start )
+        elif not memory_limit:
+            version = dataset_version( path )
+            cubes = get_cubes( version, data )
+
+        # Indexes of the sidebar filters (results cached by widget value)
+        index = aggregates['index'] if store else get_filter_index( version, data )
+        profile.rows( len(data) )
+
+    # The clusters of the Portfolio Density map and the histograms of the House Attributes charts
+    # are built by their sessions, each session is painted as soon as it is ready
+
+    # Bytes allocated by each session (HOUSE_ROCKET_MEMORY_REPORT=1): tracing is process-wide, meant for one browser session at a time
+    memory = MemoryReport()
 
     # Create session: "Data Overview"
-    overview_data( data )
+    with profile.section('Data Overview'), memory.track('Data Overview'):
+        stats = get_stats( version, data ) if stats is None else stats
+        table = live.cached( 'table', lambda: PagedTable( data ) ) if store else get_dataset_table( version, data )
+        overview_data( data, cubes['zipcode'], index, table, stats )
 
     # Create session: "Region Overview"
-    portifolio_density ( data, geofile )
+    with profile.section('Region Overview'), memory.track('Region Overview'):
+        clusters = aggregates['clusters'] if store else get_clusters( version, data )
+        portifolio_density ( data, url, cubes['zipcode'], clusters )
 
     # Create session: "Commercial Attributes"
-    commercial ( data )
+    with profile.section('Commercial Attributes'), memory.track('Commercial Attributes'):
+        series = aggregates['series'] if store else get_timeseries( version, cubes )
+        commercial ( series, since )
 
     # Create session "House Attributes"
-    attributes_distribuition ( data )
+    with profile.section('House Attributes'), memory.track('House Attributes'):
+        histograms = aggregates['histograms'] if store else get_histograms( version, data )
+        attributes_distribuition ( histograms )
 
     # Create session "Business Recommendations" and "Buy Repport"
-    recom_buy_ds = buy_repport(data)
+    with profile.section('Buy Repport'), memory.track('Buy Repport'):
+        if store:
+            comparables_of = lambda k: live.cached( ('comparables', k), lambda: build_comparables( data, k ) )
+        else:
+            comparables_of = lambda k: get_comparables( version, data, k )
+        recom_buy_ds = buy_repport(data, cubes['zipcode'], comparables_of)
 
     # Create sell "repport"
-    sell_repport(data, recom_buy_ds)
+    with profile.section('Sell Repport'), memory.track('Sell Repport'):
+        if store:
+            scenarios = live.cached( 'scenarios', lambda: build_scenarios( data, cubes['zipcode'], cubes['zipcode_season'] ) )
+        else:
+            scenarios = get_scenarios( version, data, cubes['zipcode'], cubes['zipcode_season'] )
+        sell_repport(cubes['zipcode_season'], recom_buy_ds, scenarios)
+
+    if memory.enabled:
+        st.header('Memory per Session')
+        st.dataframe(memory.to_frame())
+
+    if profile.panel:
+        with st.expander('Profile'):
+            st.subheader('Time per Session')
+            st.dataframe(profile.to_frame())
+            st.subheader('Payload per Element')
+            st.dataframe(profile.elements_frame())
+            st.subheader('Dataset')
+            st.write('{:,} rows, {:.1f} bytes per row (compact columns)'.format(len(data), data.bytes_per_row))
+            st.subheader('Render Cache')
+            st.write(renders.stats())
+            st.subheader('Prefetch')
+            st.write(prefetcher.stats())
+            st.subheader('Payload Budget')
+            st.write(budget.stats())
+            st.dataframe(budget.to_frame())
+            if store:
+                st.subheader('Delta Aggregates')
+                st.write(live.stats())
+
+    profile.finish()
+
+    if os.environ.get('HOUSE_ROCKET_PREFETCH', '1') != '0':
+        for kind, job in upcoming:
+            if kind is None:
+                prefetcher.submit( job )
+            else:
+                prefetcher.prefetch( kind, job )
 
 # ============================================================================================================================================
     # DATA LOAD
@@ -0,0 +1,144 @@
+""" Delta ingestion (house_rocket.delta): aggregates folded as sales are appended vs a full recompute.
+
+A store is built from the csv without its last sale days and without one zipcode, then
+each of those days, and the zipcode, is appended as a delta. After every delta the
+structures LiveAggregates folded (cubes, statistics, zipcode FilterIndex, histograms,
+map clusters, time series) must be equal, value for value, to the ones built from every
+row. A delta appended twice adds nothing, and a delta with an invalid value is rejected
+as a whole.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from house_rocket.delta import LiveAggregates, append_rows
+from house_rocket.histograms import ContinuousHistogram
+from house_rocket.partitions import Catalog, PartitionedDataset, add_dataset, load_partition
+
+CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kc_house_data.csv')
+
+DAYS = 3
+ZIPCODE = '98039'
+
+
+def store_data( store ):
+    catalog = Catalog( store )
+    entries = catalog.entries( 'test' )
+    return PartitionedDataset( [load_partition( catalog.path( e ) ) for e in entries], entries ), entries
+
+
+def assert_equal( folded, full ):
+    for name, cube in full['cubes'].items():
+        pd.testing.assert_frame_equal(folded['cubes'][name], cube, check_exact=True)
+
+    assert np.array_equal(folded['stats'].partitions, full['stats'].partitions)
+    for zipcode in [None] + [[z] for z in full['stats'].partitions]:
+        pd.testing.assert_frame_equal(folded['stats'].describe( zipcode ), full['stats'].describe( zipcode ),
+                                      check_exact=True)
+
+    assert folded['index'].size == full['index'].size
+    for zipcode in full['stats'].partitions:
+        assert np.array_equal(folded['index'].member( 'zipcode', [zipcode] ), full['index'].member( 'zipcode', [zipcode] ))
+
+    for name, histogram in full['histograms'].items():
+        if isinstance(histogram, ContinuousHistogram):
+            assert np.array_equal(folded['histograms'][name].edges, histogram.edges)
+            assert np.array_equal(folded['histograms'][name].cumulative, histogram.cumulative)
+        else:
+            assert np.array_equal(folded['histograms'][name].values, histogram.values)
+            assert np.array_equal(folded['histograms'][name].cumulative, histogram.cumulative)
+
+    assert list(folded['clusters']) == list(full['clusters'])
+    for zoom, clusters in full['clusters'].items():
+        pd.testing.assert_frame_equal(folded['clusters'][zoom], clusters, check_exact=True)
+
+    for period, store in full['series'].items():
+        assert np.array_equal(folded['series'][period].keys, store.keys)
+        assert np.array_equal(folded['series'][period].zipcodes, store.zipcodes)
+        assert np.array_equal(folded['series'][period]._sums, store._sums)
+        assert np.array_equal(folded['series'][period]._counts, store._counts)
+        for zipcode in [None] + [[z] for z in store.zipcodes]:
+            for folded_values, values in zip(folded['series'][period].series( zipcodes=zipcode ), store.series( zipcodes=zipcode )):
+                assert np.array_equal(folded_values, values)
+
+
+@pytest.fixture
+def sales():
+    raw = pd.read_csv(CSV, dtype=str)
+    days = raw['date'].str[:8]
+    last = sorted(days.unique())[-DAYS:]
+    deltas = [raw.loc[days == day] for day in last]
+    deltas.append(raw.loc[( raw['zipcode'] == ZIPCODE ) & ~days.isin(last)])
+    return raw.loc[~days.isin(last) & ( raw['zipcode'] != ZIPCODE )], deltas
+
+
+def create_store( path, base ):
+    base.to_csv(path / 'base.csv', index=False)
+    add_dataset( path / 'base.csv', 'test', store_dir=path )
+
+
+def test_folded_equal_to_full_recompute( tmp_path, sales ):
+    base, deltas = sales
+    create_store( tmp_path, base )
+
+    live = LiveAggregates()
+    live.update( *store_data( tmp_path ) )
+    for delta in deltas:
+        append_rows( delta, 'test', store_dir=tmp_path )
+        data, entries = store_data( tmp_path )
+        assert_equal( live.update( data, entries ), LiveAggregates().update( data, entries ) )
+
+    assert (live.builds, live.folds) == (1, len(deltas))
+    assert len(data) == len(base) + sum(len(delta) for delta in deltas)
+
+
+def test_delta_appended_twice_adds_nothing( tmp_path, sales ):
+    base, deltas = sales
+    create_store( tmp_path, base )
+    entries, dropped = append_rows( deltas[0], 'test', store_dir=tmp_path )
+    assert entries and dropped == 0
+
+    live = LiveAggregates()
+    data, entries = store_data( tmp_path )
+    aggregates = live.update( data, entries )
+
+    assert append_rows( deltas[0], 'test', store_dir=tmp_path ) == ([], len(deltas[0]))
+    data, entries = store_data( tmp_path )
+    assert len(data) == len(base) + len(deltas[0])
+    assert live.update( data, entries ) is aggregates
+    assert (live.builds, live.folds) == (1, 0)
+
+
+def test_invalid_delta_rejected_as_a_whole( tmp_path, sales ):
+    base, deltas = sales
+    create_store( tmp_path, base )
+    catalog = Catalog( tmp_path ).entries( 'test' )
+    files = sorted(str(p) for p in tmp_path.rglob('*.feather'))
+
+    delta = deltas[0].copy()
+    delta.iloc[len(delta) // 2, delta.columns.get_loc('price')] = 'n/a'
+    with pytest.raises(ValueError, match='price: 1 invalid values'):
+        append_rows( delta, 'test', store_dir=tmp_path )
+
+    assert Catalog( tmp_path ).entries( 'test' ) == catalog
+    assert sorted(str(p) for p in tmp_path.rglob('*.feather')) == files
+
+
+def test_cached_values_dropped_by_a_delta( tmp_path, sales ):
+    base, deltas = sales
+    create_store( tmp_path, base )
+
+    live = LiveAggregates()
+    data, entries = store_data( tmp_path )
+    live.update( data, entries )
+    first = (entries[0]['file'], entries[0]['version'])
+    live.cached( 'table', lambda: 'every partition' )
+    live.cached( 'first', lambda: 'first partition', files=[first] )
+
+    append_rows( deltas[0], 'test', store_dir=tmp_path )
+    live.update( *store_data( tmp_path ) )
+    assert live.cached( 'table', lambda: 'rebuilt' ) == 'rebuilt'
+    assert live.cached( 'first', lambda: 'rebuilt' ) == 'first partition'
+    assert live.stats()['cached'] == 2
@@ -0,0 +1,28 @@
+""" Memory ceiling of the chunked ingestion (house_rocket.streaming).
+
+A csv larger than the ceiling is streamed in a child process (benchmarks/bench_streaming.py):
+the memory used on top of the interpreter and libraries (peak RSS - RSS after imports)
+must stay under the ceiling given to stream_dataset.
+"""
+import os
+
+import pytest
+
+from benchmarks.bench_streaming import measure, write_synthetic_csv
+
+BASE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kc_house_data.csv')
+
+ROWS = 800_000
+MEMORY_LIMIT_MB = 64
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='peak RSS is read from /proc')
+def test_peak_rss_under_memory_limit( tmp_path ):
+    path = tmp_path / 'large.csv'
+    write_synthetic_csv( BASE_CSV, path, ROWS )
+    assert os.path.getsize(path) > MEMORY_LIMIT_MB * 2**20
+
+    rows, seconds, baseline, peak = measure( path, MEMORY_LIMIT_MB )
+
+    assert rows == ROWS
+    assert peak - baseline <= MEMORY_LIMIT_MB * 2**20